@@ -28,6 +28,8 @@ import time
 import requests
 from rdkit import Chem
 
+from workspace import AGENT2_OUTPUT, REVIEW_JSON, add_run_dir_argument, in_run_dir
+
 # ---------------------------------------------------------------------------
 # Configuration
 # ---------------------------------------------------------------------------
@@ -38,8 +40,8 @@ RCSB_DATA_URL = "https://data.rcsb.org/rest/v1/core/entry"
 
 PUBCHEM_BASE = "https://pubchem.ncbi.nlm.nih.gov/rest/pug"
 
-STRUCTURES_DIR = "structures"
-OUTPUT_FILE = "agent2_output.json"
+STRUCTURES_DIR = "structures"  # shared across run workspaces
+OUTPUT_FILE = AGENT2_OUTPUT
 
 PUBCHEM_DELAY = 0.25  # PubChem allows 5 req/s — stay conservative
 PDB_DELAY = 0.5
@@ -254,8 +256,12 @@ def download_pdb(pdb_id: str, output_dir: str) -> str:
         resp.raise_for_status()
 
         if ext == "pdb":
-            with open(pdb_path, "wb") as f:
+            # Write-then-rename: the structures directory is shared by
+            # concurrent runs, which must never see a half-written file.
+            tmp_path = f"{pdb_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
                 f.write(resp.content)
+            os.replace(tmp_path, pdb_path)
             size_kb = len(resp.content) / 1024
             print(f"[PDB] Saved {pdb_id}.pdb ({size_kb:.1f} KB)")
             return pdb_path
@@ -509,8 +515,8 @@ def main():
         "-i",
         "--input",
         type=str,
-        default="review.json",
-        help="Input JSON from Agent 1 (default: review.json).",
+        default=REVIEW_JSON,
+        help=f"Input JSON from Agent 1 (default: {REVIEW_JSON}).",
     )
     parser.add_argument(
         "-o",
@@ -531,7 +537,10 @@ def main():
         default=50,
         help="Max extra compounds to discover per protein target (default: 50).",
     )
+    add_run_dir_argument(parser)
     args = parser.parse_args()
+    args.input = in_run_dir(args.run_dir, args.input, REVIEW_JSON)
+    args.output = in_run_dir(args.run_dir, args.output, OUTPUT_FILE)
 
     # ----- Load Agent 1 output -----
     print(f"\n{'=' * 60}")
@@ -5,6 +5,8 @@ Agent 3 — DiffDock Simulation Agent
 Reads Agent 2's output (agent2_output.json) containing protein structures and
 drug SMILES strings, sends them to DiffDock running on a RunPod serverless GPU
 endpoint, and returns ranked results with confidence scores normalized to 0-1.
+Chunks are scheduled against a pluggable backend (docking_backends.py), so
+the same code can dock on the local CPU with --backend local.
 
 Pipeline mode (reads Agent 2 output):
     python agent3.py
@@ -18,33 +20,54 @@ Test mode:
 Environment variables:
     RUNPOD_API_KEY      - Your RunPod API key
     RUNPOD_ENDPOINT_ID  - Your RunPod serverless endpoint ID (default: a15lcnozlsx6f8)
+    DOCKING_BACKEND     - "runpod" (default) or "local"
 """
 
 import argparse
 import base64
 import json
+import math
 import os
 import re
 import sys
+import statistics
+import threading
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 from dotenv import load_dotenv
 
-load_dotenv()
+from docking_backends import DockingBackend, get_backend
+from pose_store import POSE_PACK_FILE, PoseStore, offload_poses
+from workspace import AGENT2_OUTPUT, AGENT3_OUTPUT, add_run_dir_argument, in_run_dir
+from telemetry import (
+    TELEMETRY_FILE,
+    append_records,
+    finish_chunk_record,
+    format_summary,
+    new_chunk_record,
+    summarize_chunks,
+)
 
-try:
-    import runpod
-except ImportError:
-    runpod = None
+load_dotenv()
 
 # ---------------------------------------------------------------------------
 # Configuration
 # ---------------------------------------------------------------------------
 
-DEFAULT_ENDPOINT_ID = "a15lcnozlsx6f8"
-INPUT_FILE = "agent2_output.json"
-OUTPUT_FILE = "agent3_output.json"
+INPUT_FILE = AGENT2_OUTPUT
+OUTPUT_FILE = AGENT3_OUTPUT
+MAX_POLL_RETRIES = 3
+
+# Straggler hedging: once HEDGE_MIN_SAMPLES chunks have finished, any chunk
+# running longer than hedge_multiplier × the median chunk latency gets a
+# duplicate submission; whichever copy finishes first wins.
+HEDGE_MIN_SAMPLES = 2
+HEDGE_CHECK_INTERVAL = 5.0
+
+# Progressive docking: fraction of pre-screened ligands promoted to full
+# sampling when no explicit top-K is given.
+PRESCREEN_FRACTION = 0.2
 
 EXAMPLE_LIGANDS = [
     {"name": "sotorasib", "smiles": "C=CC(=O)N1CCC(CC1)n2c(=O)c3cc(F)c(cc3n2c4ccc(cc4)c5nc(cnc5OC)N)OC"},
@@ -70,44 +93,194 @@ def chunk_list(lst: list, chunk_size: int) -> list[list]:
     return [lst[i : i + chunk_size] for i in range(0, len(lst), chunk_size)]
 
 
-def submit_chunk(endpoint, protein_pdb_b64: str, ligand_chunk: list[dict],
-                 samples_per_complex: int, chunk_idx: int):
-    """Submit a single chunk to RunPod and return the result."""
-    payload = {
-        "input": {
-            "protein_pdb_b64": protein_pdb_b64,
-            "ligands": ligand_chunk,
-            "samples_per_complex": samples_per_complex,
-        }
-    }
+def submit_chunk(backend: DockingBackend, receptor, ligand_chunk: list[dict],
+                 samples_per_complex: int, chunk_idx: int,
+                 telemetry: list | None = None, telemetry_tags: dict | None = None,
+                 cancel_event: threading.Event | None = None):
+    """Submit a single chunk to the docking backend and return the result.
+
+    ``receptor`` is the handle returned by ``backend.prepare`` (the base64
+    PDB for RunPod, the file path for the local backend).
+
+    If ``telemetry`` is a list, a per-chunk record (see telemetry.py) is
+    appended to it once the chunk reaches a final state.  Setting
+    ``cancel_event`` cancels the job at the next poll and returns
+    ``{"cancelled": True, "results": []}``.
+    """
+    record = new_chunk_record(
+        chunk_idx,
+        n_ligands=len(ligand_chunk),
+        payload_bytes=backend.payload_bytes(receptor, ligand_chunk, samples_per_complex),
+        samples_per_complex=samples_per_complex,
+        backend=backend.name,
+        **(telemetry_tags or {}),
+    )
+
+    def _finish(status, job_state=None, output=None):
+        finish_chunk_record(record, status, job_state, output)
+        if telemetry is not None:
+            telemetry.append(record)
+
+    if cancel_event is not None and cancel_event.is_set():
+        # A queued duplicate whose sibling already finished: start no job
+        return {"cancelled": True, "results": []}
 
     print(f"    [chunk {chunk_idx}] Submitting {len(ligand_chunk)} ligands …")
-    run_request = endpoint.run(payload)
+    job = backend.submit(receptor, ligand_chunk, samples_per_complex)
+    record["job_id"] = getattr(job, "job_id", None)
 
-    # Poll for completion
+    # Poll for completion, tolerating a few transient API errors
     while True:
-        status = run_request.status()
+        if cancel_event is not None and cancel_event.is_set():
+            print(f"    [chunk {chunk_idx}] Cancelling (superseded by duplicate)", flush=True)
+            job_state = None
+            try:
+                backend.cancel(job)
+                job_state = backend.poll(job)
+            except Exception:
+                pass
+            _finish("CANCELLED", job_state)
+            return {"cancelled": True, "results": []}
+        try:
+            job_state = backend.poll(job)
+        except Exception as e:
+            record["retries"] += 1
+            if record["retries"] > MAX_POLL_RETRIES:
+                print(f"    [chunk {chunk_idx}] Polling failed: {e}", flush=True)
+                _finish("POLL_ERROR")
+                return {"error": f"Chunk {chunk_idx} POLL_ERROR", "results": []}
+            time.sleep(backend.poll_interval)
+            continue
+        status = job_state.get("status")
         if status == "COMPLETED":
             break
         if status in ("FAILED", "TIMED_OUT", "CANCELLED"):
-            print(f"    [chunk {chunk_idx}] RunPod status: {status}", flush=True)
+            print(f"    [chunk {chunk_idx}] {backend.name} status: {status}", flush=True)
             try:
-                err_output = run_request.output()
+                err_output = job_state.get("error") or backend.results(job)
                 if err_output:
-                    print(f"    [chunk {chunk_idx}] RunPod error: {err_output}", flush=True)
+                    print(f"    [chunk {chunk_idx}] {backend.name} error: {err_output}", flush=True)
             except Exception:
                 pass
+            _finish(status, job_state)
             return {"error": f"Chunk {chunk_idx} {status}", "results": []}
-        time.sleep(5)
+        time.sleep(backend.poll_interval)
 
-    output = run_request.output()
+    output = backend.results(job)
     if output is None:
         print(f"    [chunk {chunk_idx}] Warning: output is None", flush=True)
+        _finish("COMPLETED", job_state)
         return {"results": []}
-    print(f"    [chunk {chunk_idx}] Done ({output.get('processing_time_seconds', '?')}s)", flush=True)
+    _finish("COMPLETED", job_state, output)
+    print(f"    [chunk {chunk_idx}] Done ({output.get('processing_time_seconds', '?')}s, "
+          f"queued {record['delay_seconds'] or 0:.1f}s)", flush=True)
     return output
 
 
+def dispatch_chunks(
+    run_chunk,
+    n_chunks: int,
+    max_workers: int = 3,
+    hedge_multiplier: float | None = None,
+    hedge_min_samples: int = HEDGE_MIN_SAMPLES,
+) -> tuple[dict, dict]:
+    """Run ``run_chunk(chunk_idx, attempt, cancel_event)`` for every chunk.
+
+    Without hedging this is a plain bounded thread pool.  With
+    ``hedge_multiplier`` set, a chunk that has been running longer than
+    ``hedge_multiplier`` × the median latency of finished chunks is
+    submitted a second time (attempt 1).  The first attempt to finish
+    successfully wins; the other is cancelled through its event and its
+    output, if it still arrives, is discarded.
+
+    Returns (outputs by chunk index, hedge stats).  Stats record which
+    (chunk_idx, attempt) pairs were discarded so callers can account for
+    the extra GPU spend.
+    """
+    hedging = hedge_multiplier is not None and hedge_multiplier > 0
+    workers = max(1, min(n_chunks, max_workers))
+    started: dict[tuple[int, int], float] = {}
+    cancel_events: dict[tuple[int, int], threading.Event] = {}
+    outputs: dict[int, dict] = {}
+    latencies: list[float] = []
+    stats = {"hedged": [], "won_by_hedge": [], "discarded": []}
+
+    def _attempt(chunk_idx, attempt):
+        event = cancel_events[(chunk_idx, attempt)]
+        if event.is_set():
+            return {"cancelled": True, "results": []}  # decided while queued
+        started[(chunk_idx, attempt)] = time.time()
+        return run_chunk(chunk_idx, attempt, event)
+
+    primary = ThreadPoolExecutor(max_workers=workers)
+    # Hedges get their own pool so they never queue behind primaries.
+    hedge_pool = ThreadPoolExecutor(max_workers=workers) if hedging else None
+    pending = {}
+    try:
+        for i in range(n_chunks):
+            cancel_events[(i, 0)] = threading.Event()
+            pending[primary.submit(_attempt, i, 0)] = (i, 0)
+
+        while pending:
+            done, _ = wait(
+                pending,
+                timeout=HEDGE_CHECK_INTERVAL if hedging else None,
+                return_when=FIRST_COMPLETED,
+            )
+            now = time.time()
+
+            for future in done:
+                chunk_idx, attempt = pending.pop(future)
+                try:
+                    output = future.result()
+                except Exception as e:
+                    print(f"    [chunk {chunk_idx}] Error: {e}")
+                    output = {"error": str(e), "results": []}
+                if output is None:
+                    print(f"    [chunk {chunk_idx}] Warning: empty output")
+                    output = {"results": []}
+
+                if chunk_idx in outputs or output.get("cancelled"):
+                    stats["discarded"].append((chunk_idx, attempt))
+                    continue
+                sibling_running = any(
+                    idx == chunk_idx for idx, _ in pending.values()
+                )
+                if output.get("error") and sibling_running:
+                    # Let the other copy decide this chunk's outcome
+                    stats["discarded"].append((chunk_idx, attempt))
+                    continue
+
+                outputs[chunk_idx] = output
+                latencies.append(now - started.get((chunk_idx, attempt), now))
+                if attempt > 0:
+                    stats["won_by_hedge"].append(chunk_idx)
+                for (idx, other), event in cancel_events.items():
+                    if idx == chunk_idx and other != attempt:
+                        event.set()
+
+            if not hedging or len(latencies) < hedge_min_samples:
+                continue
+            threshold = hedge_multiplier * statistics.median(latencies)
+            for chunk_idx, attempt in list(pending.values()):
+                if attempt != 0 or chunk_idx in stats["hedged"]:
+                    continue
+                t0 = started.get((chunk_idx, 0))
+                if t0 is None or now - t0 <= threshold:
+                    continue
+                print(f"    [chunk {chunk_idx}] Straggler ({now - t0:.0f}s > "
+                      f"{threshold:.0f}s) — submitting duplicate", flush=True)
+                stats["hedged"].append(chunk_idx)
+                cancel_events[(chunk_idx, 1)] = threading.Event()
+                pending[hedge_pool.submit(_attempt, chunk_idx, 1)] = (chunk_idx, 1)
+    finally:
+        primary.shutdown(wait=True)
+        if hedge_pool is not None:
+            hedge_pool.shutdown(wait=True)
+
+    return outputs, stats
+
+
 def _safe_ligand_name(name: str, idx: int, max_len: int = 80) -> str:
     """Return a short, filesystem-safe ligand identifier.
 
@@ -131,36 +304,82 @@ def run_docking(
     api_key: str = None,
     chunk_size: int = 10,
     samples_per_complex: int = 10,
+    telemetry: list | None = None,
+    telemetry_tags: dict | None = None,
+    telemetry_file: str | None = TELEMETRY_FILE,
+    hedge_multiplier: float | None = None,
+    backend: DockingBackend | str | None = None,
+    prescreen_samples: int | None = None,
+    prescreen_top_k: int | None = None,
+    prescreen_fraction: float | None = None,
+    prescreen_backend: DockingBackend | str | None = None,
+    always_full: set[str] | None = None,
+    prescreen_only: list | None = None,
 ) -> list[dict]:
     """
-    Run DiffDock molecular docking via RunPod serverless.
+    Run molecular docking — DiffDock via RunPod serverless by default.
+
+    With ``prescreen_samples`` set, docking is progressive: every ligand is
+    first docked with that many samples (optionally on ``prescreen_backend``,
+    e.g. "local" for a CPU pre-score), then only the best
+    ``prescreen_top_k`` ligands — or the best ``prescreen_fraction`` of
+    them — plus any names in ``always_full`` are re-docked with
+    ``samples_per_complex`` samples.  Only the full-sampling results are
+    returned: pre-screen scores come from fewer samples (or another
+    engine) and are not comparable with them.  The results of ligands
+    that stopped at the pre-screen go to ``prescreen_only``, if given.
+    Every result carries a ``docking_tier`` of "prescreen" or "full".
 
     Args:
         protein_pdb_path: Path to the protein .pdb file
         ligands: List of dicts with "name" and "smiles" keys
-        endpoint_id: RunPod endpoint ID
-        api_key: RunPod API key
+        endpoint_id: RunPod endpoint ID (RunPod backend only)
+        api_key: RunPod API key (RunPod backend only)
         chunk_size: Number of ligands per RunPod job
         samples_per_complex: Number of poses to generate per drug-protein pair
+        telemetry: Optional list that receives one record per chunk
+        telemetry_tags: Extra fields (protein, round, …) stored on each record
+        telemetry_file: JSONL file the chunk records are appended to
+            (None to disable)
+        hedge_multiplier: If set, resubmit chunks running longer than this
+            multiple of the median chunk latency (see dispatch_chunks)
+        backend: A DockingBackend, or "runpod" / "local" (default: the
+            DOCKING_BACKEND env var, else "runpod")
+        prescreen_samples: Samples per complex for the cheap first tier
+        prescreen_top_k: Ligands promoted to full sampling
+        prescreen_fraction: Fraction of ligands promoted (default 0.2 when
+            neither this nor prescreen_top_k is given)
+        prescreen_backend: Backend for the first tier (default: backend)
+        always_full: Ligand names that always get full sampling
+        prescreen_only: Optional list that receives the pre-screen results
+            of ligands not promoted to full sampling
 
     Returns:
         List of result dicts sorted by confidence_score (descending).
     """
-    if runpod is None:
-        raise ImportError("Install runpod SDK: pip install runpod")
-
-    api_key = api_key or os.environ.get("RUNPOD_API_KEY")
-    endpoint_id = endpoint_id or os.environ.get("RUNPOD_ENDPOINT_ID", DEFAULT_ENDPOINT_ID)
-
-    if not api_key:
-        raise ValueError("RUNPOD_API_KEY not set. Get it from https://www.runpod.io/console/user/settings")
-    if not endpoint_id:
-        raise ValueError("RUNPOD_ENDPOINT_ID not set")
+    if prescreen_samples:
+        return _run_progressive_docking(
+            protein_pdb_path, ligands,
+            prescreen_samples=prescreen_samples,
+            top_k=prescreen_top_k,
+            fraction=prescreen_fraction,
+            prescreen_backend=prescreen_backend,
+            always_full=always_full or set(),
+            prescreen_only=prescreen_only,
+            endpoint_id=endpoint_id,
+            api_key=api_key,
+            chunk_size=chunk_size,
+            samples_per_complex=samples_per_complex,
+            telemetry=telemetry,
+            telemetry_tags=telemetry_tags,
+            telemetry_file=telemetry_file,
+            hedge_multiplier=hedge_multiplier,
+            backend=backend,
+        )
 
-    runpod.api_key = api_key
-    endpoint = runpod.Endpoint(endpoint_id)
+    dock_backend = get_backend(backend, endpoint_id=endpoint_id, api_key=api_key)
 
-    protein_pdb_b64 = encode_pdb(protein_pdb_path)
+    receptor = dock_backend.prepare(protein_pdb_path)
 
     # Build RunPod-safe ligands with short names; keep a mapping back to
     # the original metadata so we can restore real names in the results.
@@ -173,34 +392,50 @@ def run_docking(
 
     chunks = chunk_list(safe_ligands, chunk_size)
     n_chunks = len(chunks)
-    print(f"  Docking {len(ligands)} ligands in {n_chunks} chunk(s) of ≤{chunk_size}")
+    print(f"  Docking {len(ligands)} ligands in {n_chunks} chunk(s) of ≤{chunk_size}"
+          f" [{dock_backend.name}]")
 
     all_results = []
+    chunk_records = []
     start_time = time.time()
 
-    with ThreadPoolExecutor(max_workers=min(n_chunks, 3)) as executor:
-        futures = {
-            executor.submit(
-                submit_chunk, endpoint, protein_pdb_b64, chunk,
-                samples_per_complex, i
-            ): i
-            for i, chunk in enumerate(chunks)
-        }
+    def _run_chunk(chunk_idx, attempt, cancel_event):
+        tags = dict(telemetry_tags or {}, attempt=attempt)
+        return submit_chunk(
+            dock_backend, receptor, chunks[chunk_idx], samples_per_complex,
+            chunk_idx, chunk_records, tags, cancel_event,
+        )
 
-        for future in as_completed(futures):
-            chunk_idx = futures[future]
-            try:
-                output = future.result()
-                if output is None:
-                    print(f"    [chunk {chunk_idx}] Warning: empty output")
-                    continue
-                chunk_results = output.get("results", [])
-                all_results.extend(chunk_results)
-            except Exception as e:
-                print(f"    [chunk {chunk_idx}] Error: {e}")
+    try:
+        outputs, hedge_stats = dispatch_chunks(
+            _run_chunk, n_chunks,
+            max_workers=dock_backend.max_concurrency,
+            hedge_multiplier=hedge_multiplier,
+        )
+    finally:
+        if dock_backend is not backend:
+            dock_backend.close()
+    for chunk_idx in sorted(outputs):
+        all_results.extend(outputs[chunk_idx].get("results", []))
 
     elapsed = time.time() - start_time
 
+    discarded = set(hedge_stats["discarded"])
+    for rec in chunk_records:
+        rec["discarded"] = (rec["chunk_idx"], rec.get("attempt", 0)) in discarded
+    if hedge_stats["hedged"]:
+        extra_gpu = sum(
+            r.get("execution_seconds") or 0 for r in chunk_records if r["discarded"]
+        )
+        print(f"  Hedged {len(hedge_stats['hedged'])} straggler chunk(s), "
+              f"{len(hedge_stats['won_by_hedge'])} won by the duplicate; "
+              f"extra GPU spend {extra_gpu:.1f}s")
+
+    chunk_records.sort(key=lambda r: (r["chunk_idx"], r.get("attempt", 0)))
+    append_records(telemetry_file, chunk_records)
+    if telemetry is not None:
+        telemetry.extend(chunk_records)
+
     # Restore original ligand names in the results
     for r in all_results:
         orig = safe_to_original.get(r.get("name", ""))
@@ -213,6 +448,75 @@ def run_docking(
     return all_results, elapsed
 
 
+def select_for_full_sampling(
+    prescreen_results: list[dict],
+    top_k: int | None = None,
+    fraction: float | None = None,
+    always_full: set[str] | None = None,
+) -> set[str]:
+    """Pick the ligand names promoted from the pre-screen to full sampling."""
+    ranked = sorted(
+        prescreen_results, key=lambda x: x.get("confidence_score", 0), reverse=True
+    )
+    if top_k is None:
+        fraction = PRESCREEN_FRACTION if fraction is None else fraction
+        top_k = math.ceil(len(ranked) * fraction)
+    selected = {r["name"] for r in ranked[:max(0, top_k)]}
+    return selected | set(always_full or ())
+
+
+def _run_progressive_docking(
+    protein_pdb_path: str,
+    ligands: list[dict],
+    prescreen_samples: int,
+    top_k: int | None,
+    fraction: float | None,
+    prescreen_backend,
+    always_full: set[str],
+    prescreen_only: list | None = None,
+    telemetry_tags: dict | None = None,
+    **kwargs,
+) -> tuple[list[dict], float]:
+    """Two-tier docking: cheap pre-screen of everything, full sampling for
+    the best ligands.  See run_docking for the parameters."""
+    full_backend = kwargs.pop("backend", None)
+    full_samples = kwargs.pop("samples_per_complex")
+    tags = dict(telemetry_tags or {})
+
+    print(f"  Pre-screen: {len(ligands)} ligands × {prescreen_samples} samples")
+    tier1, t1 = run_docking(
+        protein_pdb_path, ligands,
+        samples_per_complex=prescreen_samples,
+        backend=prescreen_backend or full_backend,
+        telemetry_tags=dict(tags, tier="prescreen"),
+        **kwargs,
+    )
+
+    promoted = select_for_full_sampling(tier1, top_k, fraction, always_full)
+    full_ligands = [lig for lig in ligands if lig["name"] in promoted]
+    print(f"  Full sampling: {len(full_ligands)}/{len(ligands)} ligands × {full_samples} samples")
+    tier2, t2 = [], 0.0
+    if full_ligands:
+        tier2, t2 = run_docking(
+            protein_pdb_path, full_ligands,
+            samples_per_complex=full_samples,
+            backend=full_backend,
+            telemetry_tags=dict(tags, tier="full"),
+            **kwargs,
+        )
+
+    # Only the full tier is ranked; pre-screen scores are on another scale
+    for r in tier2:
+        r["docking_tier"] = "full"
+    if prescreen_only is not None:
+        full_names = {r["name"] for r in tier2}
+        for r in tier1:
+            if r["name"] not in full_names:
+                r["docking_tier"] = "prescreen"
+                prescreen_only.append(r)
+    return tier2, t1 + t2
+
+
 # ---------------------------------------------------------------------------
 # Pipeline mode: read Agent 2 output, dock all targets
 # ---------------------------------------------------------------------------
@@ -232,10 +536,20 @@ def run_pipeline(
     chunk_size: int = 10,
     endpoint_id: str = None,
     api_key: str = None,
+    telemetry_file: str | None = TELEMETRY_FILE,
+    hedge_multiplier: float | None = None,
+    backend: str | None = None,
+    prescreen_options: dict | None = None,
+    pose_pack: str | None = POSE_PACK_FILE,
 ) -> dict:
     """
     Read agent2_output.json, run docking for every target, write agent3_output.json.
     The output file is updated live after each target so progress can be monitored.
+    Per-chunk telemetry is appended to telemetry_file and summarised at the end.
+    prescreen_options (prescreen_samples, prescreen_top_k, …) enable
+    progressive docking; see run_docking.
+    Poses are written to pose_pack (relative to the output file) and results
+    carry only a pose_ref; pass pose_pack=None to keep poses inline.
     """
     print(f"\n{'=' * 60}")
     print(f"  Agent 3 — DiffDock Simulation")
@@ -283,6 +597,12 @@ def run_pipeline(
     _flush_output(output_file, output)
 
     total_time = 0
+    chunk_records = []
+    pose_store = None
+    if pose_pack:
+        pose_store = PoseStore(
+            os.path.join(os.path.dirname(os.path.abspath(output_file)), pose_pack)
+        )
 
     for idx, target in enumerate(targets):
         protein = target["protein"]
@@ -321,23 +641,34 @@ def run_pipeline(
             if lig.get("smiles")
         ]
 
+        prescreen_only = []
         results, elapsed = run_docking(
             protein_pdb_path=pdb_file,
             ligands=dock_ligands,
+            prescreen_only=prescreen_only,
             endpoint_id=endpoint_id,
             api_key=api_key,
             chunk_size=chunk_size,
             samples_per_complex=samples_per_complex,
+            telemetry=chunk_records,
+            telemetry_tags={"protein": protein, "round": 1},
+            telemetry_file=telemetry_file,
+            hedge_multiplier=hedge_multiplier,
+            backend=backend,
+            **(prescreen_options or {}),
         )
         total_time += elapsed
 
         # Merge Agent 2 metadata back into results
         ligand_meta = {lig["name"]: lig for lig in ligands}
-        for r in results:
+        for r in results + prescreen_only:
             meta = ligand_meta.get(r["name"], {})
             r["mechanism"] = meta.get("mechanism", "")
             r["fda_status"] = meta.get("fda_status", "")
             r["source"] = meta.get("source", "")
+            r["smiles"] = meta.get("smiles", "")
+        if pose_store:
+            offload_poses(results + prescreen_only, pose_store)
 
         output_targets[idx].update({
             "status": "completed",
@@ -345,6 +676,9 @@ def run_pipeline(
             "docking_time_seconds": round(elapsed, 2),
             "results": results,
         })
+        if prescreen_only:
+            # Not ranked with the results: pre-screen scores are not comparable
+            output_targets[idx]["prescreen_results"] = prescreen_only
         output["completed_targets"] += 1
         output["total_docking_time_seconds"] = round(total_time, 2)
         _flush_output(output_file, output)
@@ -360,6 +694,7 @@ def run_pipeline(
     # ----- Final write -----
     output["status"] = "completed"
     output["total_docking_time_seconds"] = round(total_time, 2)
+    output["telemetry"] = summarize_chunks(chunk_records)
     _flush_output(output_file, output)
 
     # ----- Summary -----
@@ -370,6 +705,8 @@ def run_pipeline(
     print(f"  Targets docked: {len([t for t in output_targets if t['status'] == 'completed'])}")
     print(f"  Total ligands:  {total_docked}")
     print(f"  Total time:     {total_time:.1f}s")
+    if chunk_records:
+        print(format_summary(output["telemetry"]))
     print(f"{'=' * 60}\n")
 
     return output
@@ -422,13 +759,47 @@ def main():
         action="store_true",
         help="Use built-in example ligands (requires --protein).",
     )
+    parser.add_argument("--backend", type=str, default=None, choices=["runpod", "local"],
+                        help="Docking backend (default: DOCKING_BACKEND env var, else runpod)")
     parser.add_argument("--endpoint-id", type=str, default=None)
     parser.add_argument("--api-key", type=str, default=None)
     parser.add_argument("--chunk-size", type=int, default=10)
     parser.add_argument("--samples", type=int, default=10,
                         help="Poses per drug-protein pair (default: 10)")
+    parser.add_argument("--hedge", type=float, default=None, metavar="MULTIPLIER",
+                        help="Resubmit chunks slower than MULTIPLIER × median chunk "
+                             "latency (default: off)")
+    parser.add_argument("--prescreen-samples", type=int, default=None,
+                        help="Progressive mode: pre-screen every ligand with this many "
+                             "samples, then fully sample only the best (default: off)")
+    parser.add_argument("--prescreen-top-k", type=int, default=None,
+                        help="Ligands promoted to full sampling per target")
+    parser.add_argument("--prescreen-fraction", type=float, default=None,
+                        help=f"Fraction promoted when --prescreen-top-k is not given "
+                             f"(default: {PRESCREEN_FRACTION})")
+    parser.add_argument("--prescreen-backend", type=str, default=None,
+                        choices=["runpod", "local"],
+                        help="Backend for the pre-screen tier (default: --backend)")
+    parser.add_argument("--telemetry", type=str, default=TELEMETRY_FILE,
+                        help=f"Per-chunk telemetry JSONL (default: {TELEMETRY_FILE})")
+    parser.add_argument("--inline-poses", action="store_true",
+                        help=f"Keep pose SDFs inside the output JSON instead of "
+                             f"{POSE_PACK_FILE}")
+    add_run_dir_argument(parser)
 
     args = parser.parse_args()
+    args.input = in_run_dir(args.run_dir, args.input, INPUT_FILE)
+    args.output = in_run_dir(args.run_dir, args.output, OUTPUT_FILE)
+    args.telemetry = in_run_dir(args.run_dir, args.telemetry, TELEMETRY_FILE)
+
+    prescreen_options = {}
+    if args.prescreen_samples:
+        prescreen_options = {
+            "prescreen_samples": args.prescreen_samples,
+            "prescreen_top_k": args.prescreen_top_k,
+            "prescreen_fraction": args.prescreen_fraction,
+            "prescreen_backend": args.prescreen_backend,
+        }
 
     # ----- Manual mode -----
     if args.protein:
@@ -452,6 +823,10 @@ def main():
             api_key=args.api_key,
             chunk_size=args.chunk_size,
             samples_per_complex=args.samples,
+            telemetry_file=args.telemetry,
+            hedge_multiplier=args.hedge,
+            backend=args.backend,
+            **prescreen_options,
         )
 
         _print_results_table(results)
@@ -473,6 +848,11 @@ def main():
         chunk_size=args.chunk_size,
         endpoint_id=args.endpoint_id,
         api_key=args.api_key,
+        telemetry_file=args.telemetry,
+        hedge_multiplier=args.hedge,
+        backend=args.backend,
+        prescreen_options=prescreen_options,
+        pose_pack=None if args.inline_poses else POSE_PACK_FILE,
     )
 
 
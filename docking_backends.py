@@ -0,0 +1,445 @@
+#!/usr/bin/env python3
+"""
+Docking Backends
+
+The submit / poll / results interface that agent3.run_docking schedules
+chunks against, plus two implementations:
+
+  runpod  — DiffDock on a RunPod serverless GPU endpoint (the production path)
+  local   — a CPU process pool on this machine.  Uses smina if it is on PATH,
+            otherwise a fast RDKit shape-complementarity scorer.  Scores are
+            mapped onto DiffDock's result schema (confidence_raw / sigmoid
+            confidence_score / top_pose_sdf_b64 / all_poses) so everything
+            downstream works unchanged, but they are NOT on the same scale
+            as DiffDock confidences — use the local backend for small
+            screens, pre-screening and exercising the scheduler offline.
+
+Quick local run:
+    python agent3.py --protein structures/9IAY.pdb --test --backend local
+"""
+
+import base64
+import json
+import math
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import runpod
+except ImportError:
+    runpod = None
+
+# ---------------------------------------------------------------------------
+# Configuration
+# ---------------------------------------------------------------------------
+
+DEFAULT_ENDPOINT_ID = "a15lcnozlsx6f8"
+
+# Local shape scorer
+POCKET_RADIUS = 12.0        # Å around the pocket centre considered for contacts
+CONTACT_DISTANCE = 4.5      # Å — ligand atom counts as "in contact"
+CLASH_DISTANCE = 2.2        # Å — heavier penalty below this
+ROTATIONS_PER_CONFORMER = 24
+
+# smina affinities (kcal/mol) are mapped to a DiffDock-like logit with
+# confidence_raw = (-affinity - SMINA_OFFSET) / SMINA_SCALE
+SMINA_OFFSET = 7.0
+SMINA_SCALE = 2.0
+SMINA_BOX_SIZE = 22.0
+
+_WATER_AND_IONS = {
+    "HOH", "WAT", "DOD", "NA", "CL", "K", "MG", "CA", "ZN", "MN", "FE",
+    "SO4", "PO4", "GOL", "EDO", "PEG", "ACT", "DMS",
+}
+
+
+def _sigmoid(x: float) -> float:
+    return 1.0 / (1.0 + math.exp(-x))
+
+
+# ---------------------------------------------------------------------------
+# Backend interface
+# ---------------------------------------------------------------------------
+
+class DockingBackend(ABC):
+    """Submit / poll / results interface for one docking service.
+
+    ``prepare`` is called once per protein and returns an opaque receptor
+    handle; ``submit`` starts a chunk and returns an opaque job handle;
+    ``poll`` returns a RunPod-style job dict ({"status": …} plus optional
+    ``delayTime`` / ``executionTime`` in ms); ``results`` returns the
+    completed chunk output ({"results": [...], ...}).
+    """
+
+    name = "base"
+    max_concurrency = 3
+    poll_interval = 5.0
+
+    @abstractmethod
+    def prepare(self, protein_pdb_path: str):
+        raise NotImplementedError
+
+    def payload_bytes(self, receptor, ligands: list[dict],
+                      samples_per_complex: int) -> int:
+        return len(json.dumps(ligands))
+
+    @abstractmethod
+    def submit(self, receptor, ligands: list[dict], samples_per_complex: int):
+        raise NotImplementedError
+
+    @abstractmethod
+    def poll(self, job) -> dict:
+        raise NotImplementedError
+
+    @abstractmethod
+    def results(self, job) -> dict | None:
+        raise NotImplementedError
+
+    def cancel(self, job):
+        pass
+
+    def close(self):
+        pass
+
+
+def default_backend() -> str:
+    """The DOCKING_BACKEND setting, read when needed so that a value
+    loaded from .env after import still applies."""
+    return os.environ.get("DOCKING_BACKEND", "runpod").lower()
+
+
+def get_backend(backend=None, endpoint_id: str | None = None,
+                api_key: str | None = None) -> DockingBackend:
+    """Resolve a backend instance from an instance, a name (any case), or
+    the default.  The RunPod credentials are used by the runpod backend
+    and ignored by the others."""
+    if isinstance(backend, DockingBackend):
+        return backend
+    name = (backend or default_backend()).lower()
+    if name == "runpod":
+        return RunPodBackend(endpoint_id=endpoint_id, api_key=api_key)
+    if name == "local":
+        return LocalBackend()
+    raise ValueError(f"Unknown docking backend: {backend!r} (expected 'runpod' or 'local')")
+
+
+# ---------------------------------------------------------------------------
+# RunPod (DiffDock on serverless GPUs)
+# ---------------------------------------------------------------------------
+
+class RunPodBackend(DockingBackend):
+    name = "runpod"
+    max_concurrency = 3
+    poll_interval = 5.0
+
+    def __init__(self, endpoint_id: str = None, api_key: str = None, endpoint=None):
+        if endpoint is not None:
+            # Pre-built endpoint (tests, or callers managing their own client)
+            self.endpoint = endpoint
+            return
+
+        if runpod is None:
+            raise ImportError("Install runpod SDK: pip install runpod")
+
+        api_key = api_key or os.environ.get("RUNPOD_API_KEY")
+        endpoint_id = endpoint_id or os.environ.get("RUNPOD_ENDPOINT_ID", DEFAULT_ENDPOINT_ID)
+
+        if not api_key:
+            raise ValueError("RUNPOD_API_KEY not set. Get it from https://www.runpod.io/console/user/settings")
+        if not endpoint_id:
+            raise ValueError("RUNPOD_ENDPOINT_ID not set")
+
+        runpod.api_key = api_key
+        self.endpoint = runpod.Endpoint(endpoint_id)
+
+    def prepare(self, protein_pdb_path: str) -> str:
+        with open(protein_pdb_path, "rb") as f:
+            return base64.b64encode(f.read()).decode()
+
+    @staticmethod
+    def _payload(receptor: str, ligands: list[dict], samples_per_complex: int) -> dict:
+        return {
+            "input": {
+                "protein_pdb_b64": receptor,
+                "ligands": ligands,
+                "samples_per_complex": samples_per_complex,
+            }
+        }
+
+    def payload_bytes(self, receptor, ligands, samples_per_complex) -> int:
+        return len(json.dumps(self._payload(receptor, ligands, samples_per_complex)))
+
+    def submit(self, receptor, ligands, samples_per_complex):
+        return self.endpoint.run(self._payload(receptor, ligands, samples_per_complex))
+
+    def poll(self, job) -> dict:
+        # Job.status() discards delayTime/executionTime; the raw job JSON
+        # keeps them, so use it when the handle exposes it.
+        fetch = getattr(job, "_fetch_job", None)
+        if fetch is not None:
+            return fetch()
+        return {"status": job.status()}
+
+    def results(self, job) -> dict | None:
+        return job.output()
+
+    def cancel(self, job):
+        job.cancel()
+
+
+# ---------------------------------------------------------------------------
+# Local CPU backend
+# ---------------------------------------------------------------------------
+
+class LocalBackend(DockingBackend):
+    """Dock chunks in a process pool on this machine."""
+
+    name = "local"
+    poll_interval = 0.5
+
+    def __init__(self, max_workers: int | None = None):
+        self.max_workers = max_workers or os.cpu_count() or 2
+        self.max_concurrency = self.max_workers
+        self.engine = "smina" if shutil.which("smina") else "rdkit_shape"
+        self._pool = None
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._pool
+
+    def prepare(self, protein_pdb_path: str) -> str:
+        return protein_pdb_path
+
+    def submit(self, receptor, ligands, samples_per_complex):
+        future = self._get_pool().submit(
+            dock_chunk_local, receptor, ligands, samples_per_complex, self.engine
+        )
+        return {"future": future, "submitted": time.time()}
+
+    def poll(self, job) -> dict:
+        future = job["future"]
+        if future.cancelled():
+            return {"status": "CANCELLED"}
+        if not future.done():
+            return {"status": "IN_PROGRESS"}
+        if future.exception() is not None:
+            return {"status": "FAILED", "error": str(future.exception())}
+        output = future.result()
+        return {
+            "status": "COMPLETED",
+            "delayTime": max(0, int((output["_started_at"] - job["submitted"]) * 1000)),
+            "executionTime": int((output["_finished_at"] - output["_started_at"]) * 1000),
+        }
+
+    def results(self, job) -> dict | None:
+        future = job["future"]
+        if not future.done() or future.cancelled() or future.exception() is not None:
+            return None
+        return future.result()
+
+    def cancel(self, job):
+        job["future"].cancel()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+
+def dock_chunk_local(pdb_path: str, ligands: list[dict], samples_per_complex: int,
+                     engine: str = "rdkit_shape") -> dict:
+    """Dock one chunk of ligands on the CPU (runs in a worker process)."""
+    started = time.time()
+    protein_coords, center = _read_receptor(pdb_path)
+    results = []
+    for lig in ligands:
+        try:
+            if engine == "smina":
+                r = _smina_dock(pdb_path, lig, samples_per_complex, center)
+            else:
+                r = _shape_dock(lig, samples_per_complex, protein_coords, center)
+        except Exception as e:
+            print(f"    [local] {lig['name'][:40]}: {e}", flush=True)
+            r = None
+        if r is not None:
+            results.append(r)
+    finished = time.time()
+    return {
+        "results": results,
+        "processing_time_seconds": round(finished - started, 2),
+        "engine": engine,
+        "_started_at": started,
+        "_finished_at": finished,
+    }
+
+
+def _read_receptor(pdb_path: str):
+    """Return (heavy-atom coordinates, pocket centre) for a PDB file.
+
+    The pocket centre is the centroid of the bound ligand(s) (HETATM records
+    other than water / ions / cryo-protectants) when present, otherwise the
+    protein centroid.
+    """
+    import numpy as np
+
+    protein, hetero = [], []
+    with open(pdb_path, "r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            rec = line[:6]
+            if rec not in ("ATOM  ", "HETATM"):
+                continue
+            element = line[76:78].strip() or line[12:16].strip()[:1]
+            if element == "H":
+                continue
+            try:
+                xyz = (float(line[30:38]), float(line[38:46]), float(line[46:54]))
+            except ValueError:
+                continue
+            if rec == "ATOM  ":
+                protein.append(xyz)
+            elif line[17:20].strip() not in _WATER_AND_IONS:
+                hetero.append(xyz)
+
+    protein_coords = np.array(protein, dtype=float).reshape(-1, 3)
+    if hetero:
+        center = np.array(hetero, dtype=float).mean(axis=0)
+    elif len(protein_coords):
+        center = protein_coords.mean(axis=0)
+    else:
+        center = np.zeros(3)
+    return protein_coords, center
+
+
+def _random_rotations(n: int, rng):
+    """n uniformly distributed 3×3 rotation matrices (via random quaternions)."""
+    import numpy as np
+
+    q = rng.normal(size=(n, 4))
+    q /= np.linalg.norm(q, axis=1, keepdims=True)
+    w, x, y, z = q.T
+    return np.stack([
+        np.stack([1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)], axis=-1),
+        np.stack([2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)], axis=-1),
+        np.stack([2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)], axis=-1),
+    ], axis=1)
+
+
+def _shape_dock(lig: dict, samples: int, protein_coords, center) -> dict | None:
+    """Score a ligand by shape complementarity with the pocket.
+
+    Generates ``samples`` conformers, places each at the pocket centre in a
+    set of random orientations and keeps the orientation with the best
+    contact fraction minus clash penalty.  The per-pose logit is reported as
+    confidence_raw and its sigmoid as confidence_score.
+    """
+    import numpy as np
+    from rdkit import Chem
+    from rdkit.Chem import AllChem
+
+    mol = Chem.MolFromSmiles(lig["smiles"])
+    if mol is None:
+        return None
+    mol = Chem.AddHs(mol)
+    conf_ids = list(AllChem.EmbedMultipleConfs(mol, numConfs=max(1, samples), randomSeed=0xF00D))
+    if not conf_ids:
+        return None
+    heavy = [a.GetIdx() for a in mol.GetAtoms() if a.GetAtomicNum() > 1]
+
+    near = protein_coords[np.linalg.norm(protein_coords - center, axis=1) < POCKET_RADIUS + 6.0]
+    rng = np.random.default_rng(len(lig["smiles"]))
+    rotations = _random_rotations(ROTATIONS_PER_CONFORMER, rng)
+
+    poses = []
+    for cid in conf_ids:
+        xyz = mol.GetConformer(cid).GetPositions()
+        origin = xyz[heavy].mean(axis=0)
+        local = xyz - origin
+        # (rotations, atoms, 3) candidate placements of the heavy atoms
+        placed = np.einsum("rij,aj->rai", rotations, local[heavy]) + center
+        if len(near):
+            d = np.linalg.norm(placed[:, :, None, :] - near[None, None, :, :], axis=-1)
+            dmin = d.min(axis=2)
+            contact = (dmin < CONTACT_DISTANCE).mean(axis=1)
+            clash = (dmin < CLASH_DISTANCE).mean(axis=1)
+        else:
+            contact = np.zeros(len(rotations))
+            clash = np.zeros(len(rotations))
+        raw = 4.0 * (contact - 0.5) - 6.0 * clash
+        best = int(np.argmax(raw))
+        poses.append((float(raw[best]), cid, rotations[best], origin))
+
+    poses.sort(key=lambda p: p[0], reverse=True)
+    top_raw, top_cid, top_rot, top_origin = poses[0]
+
+    conf = mol.GetConformer(top_cid)
+    moved = (conf.GetPositions() - top_origin) @ top_rot.T + center
+    for i, (x, y, z) in enumerate(moved):
+        conf.SetAtomPosition(i, (float(x), float(y), float(z)))
+    sdf = Chem.MolToMolBlock(Chem.RemoveHs(mol), confId=top_cid)
+
+    return {
+        "name": lig["name"],
+        "confidence_raw": top_raw,
+        "confidence_score": _sigmoid(top_raw),
+        "top_pose_sdf_b64": base64.b64encode(sdf.encode()).decode(),
+        "all_poses": [
+            {"confidence_raw": raw, "confidence_score": _sigmoid(raw), "rank": i}
+            for i, (raw, *_rest) in enumerate(poses, 1)
+        ],
+    }
+
+
+def _smina_dock(pdb_path: str, lig: dict, samples: int, center) -> dict | None:
+    """Dock a ligand with smina in a box around the pocket centre."""
+    from rdkit import Chem
+    from rdkit.Chem import AllChem
+
+    mol = Chem.AddHs(Chem.MolFromSmiles(lig["smiles"]))
+    if AllChem.EmbedMolecule(mol, randomSeed=0xF00D) != 0:
+        return None
+    AllChem.MMFFOptimizeMolecule(mol)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        lig_in = os.path.join(tmp, "ligand.sdf")
+        lig_out = os.path.join(tmp, "poses.sdf")
+        Chem.MolToMolFile(mol, lig_in)
+        cmd = [
+            "smina", "-r", pdb_path, "-l", lig_in, "-o", lig_out,
+            "--center_x", f"{center[0]:.3f}",
+            "--center_y", f"{center[1]:.3f}",
+            "--center_z", f"{center[2]:.3f}",
+            "--size_x", str(SMINA_BOX_SIZE),
+            "--size_y", str(SMINA_BOX_SIZE),
+            "--size_z", str(SMINA_BOX_SIZE),
+            "--num_modes", str(max(1, samples)),
+            "--cpu", "1", "-q",
+        ]
+        subprocess.run(cmd, check=True, capture_output=True, timeout=600)
+
+        poses = []
+        for m in Chem.SDMolSupplier(lig_out):
+            if m is None or not m.HasProp("minimizedAffinity"):
+                continue
+            affinity = float(m.GetProp("minimizedAffinity"))
+            raw = (-affinity - SMINA_OFFSET) / SMINA_SCALE
+            poses.append((raw, Chem.MolToMolBlock(m)))
+
+    if not poses:
+        return None
+    poses.sort(key=lambda p: p[0], reverse=True)
+    return {
+        "name": lig["name"],
+        "confidence_raw": poses[0][0],
+        "confidence_score": _sigmoid(poses[0][0]),
+        "top_pose_sdf_b64": base64.b64encode(poses[0][1].encode()).decode(),
+        "all_poses": [
+            {"confidence_raw": raw, "confidence_score": _sigmoid(raw), "rank": i}
+            for i, (raw, _sdf) in enumerate(poses, 1)
+        ],
+    }
@@ -17,18 +17,29 @@ import re
 import sys
 from datetime import datetime
 
-import requests
 from dotenv import load_dotenv
 
+import llm_client
+from llm_client import StreamProgress, get_client, run_concurrently
+from prompt_budget import fit_text
+from workspace import (
+    FINAL_PAPER_MD,
+    RESULTS_MD,
+    REVIEW_MD,
+    add_run_dir_argument,
+    in_run_dir,
+)
+
 # ---------------------------------------------------------------------------
 # Configuration
 # ---------------------------------------------------------------------------
 
 load_dotenv()
 
-PERPLEXITY_API_KEY = os.environ.get("PERPLEXITY_API_KEY", "")
-PERPLEXITY_URL = "https://api.perplexity.ai/chat/completions"
-PERPLEXITY_MODEL = "sonar-pro"
+# Token budgets for source material in the summarising prompts (the
+# section-polishing merges must see their whole section, so are not cut)
+ABSTRACT_SOURCE_TOKENS = 1500  # per document
+INTRO_SOURCE_TOKENS = 6000
 
 
 # ---------------------------------------------------------------------------
@@ -36,34 +47,10 @@ PERPLEXITY_MODEL = "sonar-pro"
 # ---------------------------------------------------------------------------
 
 def query_perplexity(system_prompt: str, user_prompt: str) -> str:
-    """Send a chat-completion request to the Perplexity API and return the
-    assistant's reply text."""
-    if not PERPLEXITY_API_KEY:
-        print("ERROR: PERPLEXITY_API_KEY environment variable is not set.",
-              file=sys.stderr)
-        sys.exit(1)
-
-    headers = {
-        "Authorization": f"Bearer {PERPLEXITY_API_KEY}",
-        "Content-Type": "application/json",
-    }
-    payload = {
-        "model": PERPLEXITY_MODEL,
-        "messages": [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt},
-        ],
-        "temperature": 0.2,
-        "max_tokens": 8000,
-    }
-
-    print("[Perplexity] Sending request …")
-    resp = requests.post(PERPLEXITY_URL, json=payload, headers=headers, timeout=180)
-    resp.raise_for_status()
-    data = resp.json()
-    reply = data["choices"][0]["message"]["content"]
-    print(f"[Perplexity] Received {len(reply)} chars.")
-    return reply
+    """Chat completion through the shared client, with the lower temperature
+    and longer timeout that whole-paper merges need."""
+    return llm_client.query_perplexity(system_prompt, user_prompt,
+                                       temperature=0.2, timeout=180)
 
 
 # ---------------------------------------------------------------------------
@@ -163,9 +150,9 @@ def generate_abstract(review_text: str, results_text: str) -> str:
         "5. State the main conclusion and the need for experimental "
         "validation.\n\n"
         "--- LITERATURE REVIEW ---\n"
-        f"{review_text[:6000]}\n\n"
+        f"{fit_text(review_text, ABSTRACT_SOURCE_TOKENS)}\n\n"
         "--- DOCKING RESULTS ---\n"
-        f"{results_text[:6000]}\n"
+        f"{fit_text(results_text, ABSTRACT_SOURCE_TOKENS)}\n"
     )
     return query_perplexity(system, user)
 
@@ -189,7 +176,7 @@ def merge_introduction_and_background(
     user = (
         "Combine and polish the following sub-sections into one cohesive "
         "Introduction and Background:\n\n"
-        f"{review_text}\n"
+        f"{fit_text(review_text, INTRO_SOURCE_TOKENS)}\n"
     )
     return query_perplexity(system, user)
 
@@ -356,6 +343,35 @@ def _get_results_conclusion(results_md: str) -> str:
     return ""
 
 
+def generate_paper_sections(review_md: str, results_md: str,
+                            progress: StreamProgress | None = None) -> dict:
+    """Generate the abstract and the four merged sections concurrently.
+
+    Each call needs only the source documents (the abstract is written
+    from the review's background/target sections and the results body,
+    not from the merged sections), so all five run at once under the
+    client's concurrency cap.  Returns the
+    sections with echoed headers stripped, keyed abstract / intro /
+    landscape / results / conclusion.  With ``progress``, each section
+    streams as it is written.
+    """
+    review_intro = _get_review_intro_sections(review_md)
+    review_drugs = _get_review_drug_sections(review_md)
+    review_conclusion = _get_review_conclusion(review_md)
+    results_body = _get_results_body(results_md)
+    results_conclusion = _get_results_conclusion(results_md)
+
+    sections = run_concurrently({
+        "abstract": lambda: generate_abstract(review_intro or review_md,
+                                              results_body or results_md),
+        "intro": lambda: merge_introduction_and_background(review_intro, results_md),
+        "landscape": lambda: merge_drug_landscape(review_drugs),
+        "results": lambda: merge_results(results_body),
+        "conclusion": lambda: merge_conclusions(review_conclusion, results_conclusion),
+    }, progress=progress)
+    return {name: _strip_leading_header(text) for name, text in sections.items()}
+
+
 # ---------------------------------------------------------------------------
 # Main pipeline
 # ---------------------------------------------------------------------------
@@ -368,22 +384,31 @@ def main():
     parser.add_argument(
         "--review",
         type=str,
-        default="review.md",
-        help="Path to the literature review Markdown (default: review.md).",
+        default=REVIEW_MD,
+        help=f"Path to the literature review Markdown (default: {REVIEW_MD}).",
     )
     parser.add_argument(
         "--results",
         type=str,
-        default="results.md",
-        help="Path to the docking results Markdown (default: results.md).",
+        default=RESULTS_MD,
+        help=f"Path to the docking results Markdown (default: {RESULTS_MD}).",
     )
     parser.add_argument(
         "-o", "--output",
         type=str,
-        default="final_paper.md",
-        help="Output Markdown file (default: final_paper.md).",
+        default=FINAL_PAPER_MD,
+        help=f"Output Markdown file (default: {FINAL_PAPER_MD}).",
     )
+    add_run_dir_argument(parser)
     args = parser.parse_args()
+    if not get_client().api_key:
+        print("ERROR: PERPLEXITY_API_KEY environment variable is not set.",
+              file=sys.stderr)
+        sys.exit(1)
+
+    args.review = in_run_dir(args.run_dir, args.review, REVIEW_MD)
+    args.results = in_run_dir(args.run_dir, args.results, RESULTS_MD)
+    args.output = in_run_dir(args.run_dir, args.output, FINAL_PAPER_MD)
 
     # Validate inputs
     for path, label in [(args.review, "Review"), (args.results, "Results")]:
@@ -422,36 +447,17 @@ def main():
     ] if s)
     print(f"    Sections extracted: {sections_found}/6")
 
-    # ----- Step 3: Generate abstract -----
-    print("\n>> Step 3: Generating abstract …")
-    abstract = generate_abstract(review_md, results_md)
-    abstract = _strip_leading_header(abstract)
-
-    # ----- Step 4: Polish Introduction & Background -----
-    print("\n>> Step 4: Merging Introduction & Background …")
-    intro_body = merge_introduction_and_background(review_intro, results_md)
-    intro_body = _strip_leading_header(intro_body)
-
-    # ----- Step 5: Polish Methodology -----
-    print("\n>> Step 5: Polishing Methodology …")
+    # ----- Steps 3-8: Abstract and merged sections (concurrently) -----
+    print("\n>> Steps 3-8: Generating abstract and merging sections …")
+    sections = generate_paper_sections(review_md, results_md, progress=StreamProgress())
+    abstract = sections["abstract"]
+    intro_body = sections["intro"]
+    drug_landscape = sections["landscape"]
+    docking_results = sections["results"]
+    conclusion = sections["conclusion"]
     # Methodology comes solely from results.md — just clean it up
     methodology = _strip_leading_header(results_methodology)
 
-    # ----- Step 6: Polish Therapeutic Landscape -----
-    print("\n>> Step 6: Merging Therapeutic Landscape …")
-    drug_landscape = merge_drug_landscape(review_drugs)
-    drug_landscape = _strip_leading_header(drug_landscape)
-
-    # ----- Step 7: Polish Docking Results -----
-    print("\n>> Step 7: Polishing Docking Results …")
-    docking_results = merge_results(results_body)
-    docking_results = _strip_leading_header(docking_results)
-
-    # ----- Step 8: Merge Conclusions -----
-    print("\n>> Step 8: Merging Conclusions …")
-    conclusion = merge_conclusions(review_conclusion, results_conclusion)
-    conclusion = _strip_leading_header(conclusion)
-
     # ----- Step 9: Deduplicate references -----
     print("\n>> Step 9: Building unified reference list …")
     unified_refs = _deduplicate_references(review_refs, "")
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+Gene Symbol Extraction
+
+Finds protein targets in a literature review without an LLM call.  An
+Aho-Corasick automaton over the bundled HGNC table (hgnc_symbols.tsv:
+approved symbols, aliases, previous symbols and approved names) matches
+every entry in one pass over the text; aliases are normalised to the
+official symbol, and genes are ranked by how often they are mentioned,
+weighted by the section they appear in (a "Key protein targets" heading
+counts more than the introduction; the reference list not at all).
+
+Symbols and aliases match case-sensitively as whole words, or followed
+by a variant suffix ("EGFRvIII" counts for EGFR); approved names match
+case-insensitively.  Overlapping matches resolve to the longest, so
+"EML4-ALK" counts once, for ALK.  The table is a curated subset: gene-like
+tokens it does not know are reported by ``unmatched_symbols`` so that
+missing targets show up in the logs rather than vanishing.
+
+Usage:
+    python gene_symbols.py review.md          # ranked targets with scores
+                                              # and unmatched gene-like tokens
+"""
+
+import argparse
+import os
+import re
+from collections import Counter, deque
+
+# ---------------------------------------------------------------------------
+# Configuration
+# ---------------------------------------------------------------------------
+
+HGNC_TABLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "hgnc_symbols.tsv")
+
+MAX_TARGETS = 8
+MIN_SCORE = 2.0  # a single passing mention outside the target sections is not enough
+
+# Mention weight by the nearest heading above it (first keyword match wins)
+SECTION_WEIGHTS = [
+    ("reference", 0.0),
+    ("target", 3.0),
+    ("therap", 2.0),
+    ("treatment", 2.0),
+    ("strateg", 2.0),
+    ("molecular", 1.5),
+    ("genetic", 1.5),
+]
+DEFAULT_WEIGHT = 1.0
+
+# Variant designations written straight after a symbol (EGFRvIII, AR-V7 is
+# already a separate word)
+VARIANT_SUFFIX = re.compile(r"v[IVX]+(?![A-Za-z0-9])")
+
+# Uppercase tokens with a digit (PSMB5, CYP19A1), minus point mutations
+# (G12C, V600E)
+GENE_LIKE = re.compile(r"(?<![A-Za-z0-9-])[A-Z][A-Z0-9]*[0-9][A-Z0-9]*(?![A-Za-z0-9])")
+POINT_MUTATION = re.compile(r"[A-Z][0-9]+[A-Z]?")
+
+
+# ---------------------------------------------------------------------------
+# Multi-pattern matcher
+# ---------------------------------------------------------------------------
+
+class AhoCorasick:
+    """Aho-Corasick automaton mapping each pattern to a value.
+
+    ``find(text)`` yields (start, end, value) for every occurrence of
+    every pattern, overlapping ones included, in a single pass.
+    """
+
+    def __init__(self, patterns: dict[str, str]):
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._out: list[list[tuple[int, str]]] = [[]]
+        for pattern, value in patterns.items():
+            if pattern:
+                self._add(pattern, value)
+        self._link()
+
+    def _add(self, pattern: str, value: str):
+        node = 0
+        for ch in pattern:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = nxt
+        self._out[node].append((len(pattern), value))
+
+    def _link(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                f = self._fail[node]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[child] = self._goto[f].get(ch, 0)
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+
+    def find(self, text: str):
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(ch, 0)
+            for length, value in self._out[node]:
+                yield i + 1 - length, i + 1, value
+
+
+# ---------------------------------------------------------------------------
+# HGNC table
+# ---------------------------------------------------------------------------
+
+def load_table(path: str = HGNC_TABLE) -> tuple[dict[str, str], dict[str, str]]:
+    """Read the symbol table.
+
+    Returns (exact, names): exact maps each symbol and alias to its
+    official symbol; names maps each lower-cased approved name to it.
+    """
+    exact: dict[str, str] = {}
+    names: dict[str, str] = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("#") or line.startswith("symbol\t") or not line.strip():
+                continue
+            fields = line.rstrip("\n").split("\t")
+            symbol = fields[0].strip()
+            name = fields[1].strip() if len(fields) > 1 else ""
+            aliases = fields[2].split("|") if len(fields) > 2 else []
+            exact[symbol] = symbol
+            for alias in aliases:
+                alias = alias.strip()
+                if alias:
+                    exact.setdefault(alias, symbol)
+            if name:
+                names[name.lower()] = symbol
+    return exact, names
+
+
+class GeneMatcher:
+    """Symbol/alias and approved-name automata over one HGNC table."""
+
+    def __init__(self, path: str = HGNC_TABLE):
+        exact, names = load_table(path)
+        self.symbols = set(exact.values())
+        self._exact = AhoCorasick(exact)
+        self._names = AhoCorasick(names)
+
+    def mentions(self, text: str) -> list[tuple[int, int, str]]:
+        """Whole-word (start, end, official symbol) matches, overlaps
+        resolved leftmost-longest."""
+        lowered = text.lower()
+        found = [m for m in self._exact.find(text)
+                 if _is_word(text, m[0], m[1], variants=True)]
+        if len(lowered) == len(text):
+            found += [m for m in self._names.find(lowered) if _is_word(lowered, m[0], m[1])]
+        found.sort(key=lambda m: (m[0], -(m[1] - m[0])))
+        kept = []
+        last_end = -1
+        for start, end, symbol in found:
+            if start >= last_end:
+                kept.append((start, end, symbol))
+                last_end = end
+        return kept
+
+
+def _is_word(text: str, start: int, end: int, variants: bool = False) -> bool:
+    before = text[start - 1] if start > 0 else " "
+    after = text[end] if end < len(text) else " "
+    if variants and VARIANT_SUFFIX.match(text, end):
+        after = " "
+    return not before.isalnum() and not after.isalnum()
+
+
+_matcher: GeneMatcher | None = None
+
+
+def get_matcher() -> GeneMatcher:
+    """The matcher over the bundled table (built on first use)."""
+    global _matcher
+    if _matcher is None:
+        _matcher = GeneMatcher()
+    return _matcher
+
+
+# ---------------------------------------------------------------------------
+# Ranking
+# ---------------------------------------------------------------------------
+
+def _section_weights(text: str) -> list[tuple[int, float]]:
+    """(offset, weight) at each Markdown heading, in order.
+
+    A heading without a weighted keyword inherits the weight of the
+    heading it is nested under (e.g. "### KRAS" under "## Key Targets").
+    """
+    bounds = [(0, DEFAULT_WEIGHT)]
+    parents: list[tuple[int, float]] = []  # (level, weight) of open headings
+    for m in re.finditer(r"^(#{1,6})\s+(.+)$", text, re.MULTILINE):
+        level, heading = len(m.group(1)), m.group(2).lower()
+        while parents and parents[-1][0] >= level:
+            parents.pop()
+        inherited = parents[-1][1] if parents else DEFAULT_WEIGHT
+        weight = next((w for kw, w in SECTION_WEIGHTS if kw in heading), inherited)
+        parents.append((level, weight))
+        bounds.append((m.start(), weight))
+    return bounds
+
+
+def rank_targets(text: str, matcher: GeneMatcher | None = None) -> list[tuple[str, float]]:
+    """(official symbol, score) for every gene mentioned, best first.
+
+    Ties go to the gene mentioned first.
+    """
+    matcher = matcher or get_matcher()
+    bounds = _section_weights(text)
+    scores: dict[str, float] = {}
+    first_seen: dict[str, int] = {}
+    section = 0
+    for start, _, symbol in matcher.mentions(text):
+        while section + 1 < len(bounds) and bounds[section + 1][0] <= start:
+            section += 1
+        scores[symbol] = scores.get(symbol, 0.0) + bounds[section][1]
+        first_seen.setdefault(symbol, start)
+    return sorted(scores.items(), key=lambda kv: (-kv[1], first_seen[kv[0]]))
+
+
+def extract_targets(text: str, max_targets: int = MAX_TARGETS,
+                    min_score: float = MIN_SCORE) -> list[str]:
+    """Official symbols of the most prominent genes in ``text``."""
+    return [symbol for symbol, score in rank_targets(text)[:max_targets]
+            if score >= min_score]
+
+
+def unmatched_symbols(text: str, matcher: GeneMatcher | None = None) -> list[tuple[str, int]]:
+    """(token, count) for gene-like tokens that match no table entry,
+    most frequent first."""
+    matcher = matcher or get_matcher()
+    covered = [(start, end) for start, end, _ in matcher.mentions(text)]
+    counts: Counter = Counter()
+    i = 0
+    for m in GENE_LIKE.finditer(text):
+        while i < len(covered) and covered[i][1] <= m.start():
+            i += 1
+        if i < len(covered) and covered[i][0] < m.end():
+            continue  # part of a match (EML4-ALK, EGFRvIII)
+        if not POINT_MUTATION.fullmatch(m.group()):
+            counts[m.group()] += 1
+    return counts.most_common()
+
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Rank gene/protein mentions in a document.")
+    parser.add_argument("path", help="Markdown or text file to scan.")
+    parser.add_argument("-n", type=int, default=20, help="Rows to show (default: 20).")
+    args = parser.parse_args()
+
+    with open(args.path, encoding="utf-8") as f:
+        text = f.read()
+    selected = set(extract_targets(text))
+    for symbol, score in rank_targets(text)[:args.n]:
+        mark = "*" if symbol in selected else " "
+        print(f"  {mark} {symbol:10s} {score:6.1f}")
+    unmatched = unmatched_symbols(text)
+    if unmatched:
+        print("  Not in the symbol table: " +
+              ", ".join(f"{token} ×{n}" for token, n in unmatched[:args.n]))
+
+
+if __name__ == "__main__":
+    main()
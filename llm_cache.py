@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+LLM Response Cache
+
+Content-addressed on-disk cache for chat completions.  The key is a
+SHA-256 of (model, system prompt, user prompt, temperature, max_tokens),
+so a resumed or re-run stage whose prompts are byte-identical gets its
+reply back from disk instead of waiting on the API.  Entries older than
+the TTL are ignored and purged.
+
+The cache is shared across runs (like the docking results database).
+Configuration (environment):
+    PERPLEXITY_CACHE_DB      SQLite file (default: llm_cache.db; "" disables)
+    PERPLEXITY_CACHE_TTL     entry lifetime in seconds (default: 30 days)
+    PERPLEXITY_CACHE_BYPASS  "1" to ignore cached replies (fresh replies
+                             are still stored)
+
+Usage:
+    python llm_cache.py              # entry count and size
+    python llm_cache.py --purge      # drop expired entries
+    python llm_cache.py --clear      # drop everything
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# ---------------------------------------------------------------------------
+# Configuration
+# ---------------------------------------------------------------------------
+
+LLM_CACHE_DB = os.environ.get("PERPLEXITY_CACHE_DB", "llm_cache.db")
+LLM_CACHE_TTL_SECONDS = float(os.environ.get("PERPLEXITY_CACHE_TTL", str(30 * 24 * 3600)))
+LLM_CACHE_BYPASS = os.environ.get("PERPLEXITY_CACHE_BYPASS", "").lower() in ("1", "true", "yes")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key        TEXT PRIMARY KEY,
+    model      TEXT,
+    created_at REAL NOT NULL,
+    reply      TEXT NOT NULL,
+    usage      TEXT
+);
+"""
+
+
+def cache_key(model: str, system_prompt: str, user_prompt: str,
+              temperature: float, max_tokens: int,
+              response_format: dict | None = None) -> str:
+    """SHA-256 over everything that determines a completion."""
+    material = [model, system_prompt, user_prompt, temperature, max_tokens]
+    if response_format is not None:
+        material.append(response_format)
+    payload = json.dumps(material, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# ---------------------------------------------------------------------------
+# Cache
+# ---------------------------------------------------------------------------
+
+class LLMCache:
+    """SQLite-backed reply cache, safe to share between threads."""
+
+    def __init__(self, db_path: str = LLM_CACHE_DB, ttl_seconds: float = LLM_CACHE_TTL_SECONDS):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def close(self):
+        self._conn.close()
+
+    def get(self, key: str) -> dict | None:
+        """{"reply", "usage"} for a fresh entry, else None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT reply, usage, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or time.time() - row[2] > self.ttl_seconds:
+            return None
+        return {"reply": row[0], "usage": json.loads(row[1]) if row[1] else {}}
+
+    def put(self, key: str, reply: str, usage: dict | None = None, model: str = ""):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, created_at, reply, usage)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (key, model, time.time(), reply, json.dumps(usage or {})),
+            )
+
+    def purge_expired(self) -> int:
+        with self._lock, self._conn:
+            cur = self._conn.execute("DELETE FROM responses WHERE created_at < ?",
+                                     (time.time() - self.ttl_seconds,))
+        return cur.rowcount
+
+    def clear(self) -> int:
+        with self._lock, self._conn:
+            cur = self._conn.execute("DELETE FROM responses")
+        return cur.rowcount
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or prune the LLM response cache.")
+    parser.add_argument("--db", type=str, default=LLM_CACHE_DB,
+                        help=f"SQLite database (default: {LLM_CACHE_DB}).")
+    parser.add_argument("--purge", action="store_true", help="Drop expired entries.")
+    parser.add_argument("--clear", action="store_true", help="Drop every entry.")
+    args = parser.parse_args()
+
+    cache = LLMCache(args.db)
+    if args.clear:
+        print(f"  Removed {cache.clear()} entries")
+    elif args.purge:
+        print(f"  Removed {cache.purge_expired()} expired entries")
+    size = os.path.getsize(args.db) if os.path.exists(args.db) else 0
+    print(f"  {len(cache)} entries in {args.db} ({size / 1024:.0f} KB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,597 @@
+"""
+Perplexity Client
+
+One chat-completion client shared by the review, results and final
+generators and by the pipeline.  It keeps a pooled HTTP session, caps the
+number of requests in flight, retries 429 and 5xx responses (and dropped
+connections) with exponential backoff, and records tokens and latency for
+every call from the API's ``usage`` field.  Replies are served from the
+content-addressed response cache (llm_cache.py) when the same prompt was
+answered before.
+
+Calls are blocking; ``acomplete`` runs one in a worker thread so that
+independent prompts can be awaited together with asyncio.gather, and
+``run_concurrently`` runs independent section generators side by side —
+the concurrency cap applies either way.
+
+Given an ``on_text`` callback (directly, or for every call a thread makes
+inside ``streaming_to``), a call streams its reply and reports the text
+received so far as tokens arrive.  A stream that goes quiet for
+PERPLEXITY_STALL_SECONDS is abandoned and retried instead of waiting out
+the full request timeout.  ``StreamProgress`` turns those callbacks into
+partial section files, a live JSON status file and console progress.
+
+Every call is tagged with the pipeline stage and purpose it serves
+(``llm_tags`` sets them for a thread; ``with_llm_tags`` carries them
+into worker threads) and, once the pipeline sets ``ledger_path``,
+recorded in the run's call ledger (llm_ledger.py).
+
+Configuration (environment):
+    PERPLEXITY_API_KEY       API key (required for real calls)
+    PERPLEXITY_URL           chat-completions endpoint, e.g. a local
+                             llm_standin.py (default: the Perplexity API)
+    PERPLEXITY_CONCURRENCY   requests in flight at once (default: 4)
+    PERPLEXITY_STALL_SECONDS seconds without a token before a stream is
+                             retried (default: 30)
+    PERPLEXITY_STRUCTURED_OUTPUT  "0" to never send response_format
+"""
+
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import requests
+from dotenv import load_dotenv
+
+from llm_cache import LLM_CACHE_BYPASS, LLM_CACHE_DB, LLMCache, cache_key
+from llm_ledger import append_record
+from prompt_budget import count_tokens
+
+load_dotenv()
+
+# ---------------------------------------------------------------------------
+# Configuration
+# ---------------------------------------------------------------------------
+
+PERPLEXITY_API_URL = "https://api.perplexity.ai/chat/completions"
+PERPLEXITY_URL = os.environ.get("PERPLEXITY_URL") or PERPLEXITY_API_URL
+PERPLEXITY_MODEL = "sonar-pro"
+
+DEFAULT_TEMPERATURE = 0.3
+DEFAULT_MAX_TOKENS = 8000
+DEFAULT_TIMEOUT = 120
+
+MAX_CONCURRENCY = int(os.environ.get("PERPLEXITY_CONCURRENCY", "4"))
+MAX_RETRIES = 4
+BACKOFF_BASE_SECONDS = 2.0
+BACKOFF_MAX_SECONDS = 60.0
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+CONNECT_TIMEOUT = 10
+STREAM_STALL_SECONDS = float(os.environ.get("PERPLEXITY_STALL_SECONDS", "30"))
+PROGRESS_INTERVAL_SECONDS = 2.0  # how often streamed progress is flushed
+
+# Send response_format (JSON schema) when a caller asks for it; switched
+# off for the process if the API rejects it by name.
+STRUCTURED_OUTPUT = (os.environ.get("PERPLEXITY_STRUCTURED_OUTPUT", "1").lower()
+                     not in ("0", "false", "no"))
+
+# Transport failures worth another attempt
+RETRY_EXCEPTIONS = (requests.ConnectionError, requests.Timeout,
+                    requests.exceptions.ChunkedEncodingError)
+
+
+class PerplexityError(RuntimeError):
+    """A Perplexity request failed for good (after any retries)."""
+
+
+class MissingAPIKeyError(PerplexityError):
+    """PERPLEXITY_API_KEY is not configured."""
+
+
+class StreamStalledError(requests.Timeout):
+    """A streamed reply stopped producing tokens (retried like a timeout)."""
+
+
+# ---------------------------------------------------------------------------
+# Client
+# ---------------------------------------------------------------------------
+
+class PerplexityClient:
+    """Pooled, rate-limited Perplexity chat-completion client.
+
+    ``calls`` holds one accounting record per request:
+    prompt/completion/total tokens (plus the prompt's estimated size
+    before sending), latency (including retries), the number of retries,
+    whether it was a cache hit, the call's ``stage`` and ``purpose`` tags,
+    the reply's ``finish_reason`` and, for a call that failed for good, its
+    ``error``.  With ``ledger_path`` set, each record is also appended
+    there.  Only replies that finished with "stop" are cached.
+
+    cache:          optional LLMCache consulted before each request
+    bypass_cache:   skip cache lookups (fresh replies are still stored)
+    stall_seconds:  a stream with no new token for this long is retried
+    """
+
+    def __init__(self, api_key: str | None = None, url: str = PERPLEXITY_URL,
+                 model: str = PERPLEXITY_MODEL, max_concurrency: int = MAX_CONCURRENCY,
+                 max_retries: int = MAX_RETRIES, session: requests.Session | None = None,
+                 cache: LLMCache | None = None, bypass_cache: bool = False,
+                 stall_seconds: float = STREAM_STALL_SECONDS):
+        self.api_key = api_key if api_key is not None else os.environ.get("PERPLEXITY_API_KEY", "")
+        self.url = url
+        self.model = model
+        self.max_retries = max_retries
+        self.stall_seconds = stall_seconds
+        self.supports_response_format = STRUCTURED_OUTPUT
+        self.cache = cache
+        self.bypass_cache = bypass_cache
+        self._slots = threading.BoundedSemaphore(max(1, max_concurrency))
+        self._lock = threading.Lock()
+        self.calls: list[dict] = []
+        self.ledger_path: str | None = None
+
+        if session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=1, pool_maxsize=max(1, max_concurrency))
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+        self.session = session
+
+    def close(self):
+        self.session.close()
+
+    # ----- requests -----
+
+    def _backoff(self, attempt: int, resp: requests.Response | None) -> float:
+        retry_after = resp.headers.get("Retry-After") if resp is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), BACKOFF_MAX_SECONDS)
+            except ValueError:
+                pass
+        delay = min(BACKOFF_BASE_SECONDS * 2 ** attempt, BACKOFF_MAX_SECONDS)
+        return delay * (0.5 + random.random() / 2)
+
+    def complete(self, system_prompt: str, user_prompt: str,
+                 temperature: float = DEFAULT_TEMPERATURE,
+                 max_tokens: int = DEFAULT_MAX_TOKENS,
+                 timeout: float = DEFAULT_TIMEOUT,
+                 purpose: str = "",
+                 cache: bool = True,
+                 on_text=None,
+                 response_format: dict | None = None) -> str:
+        """Send one chat completion and return the assistant's reply text.
+
+        cache=False skips the response cache for this call entirely.
+        response_format (e.g. {"type": "json_schema", ...}) asks for
+        structured output; if the API rejects it the request is resent
+        without, and later calls stop sending it.
+        on_text(text) streams the reply: it is called with the text received
+        so far as tokens arrive (a retried stream starts again from "").
+        Defaults to the callback installed by ``streaming_to``, if any.
+        """
+        if on_text is None:
+            on_text = getattr(_stream_sink, "on_text", None)
+        tags = current_llm_tags()
+        stage = tags.get("stage", "")
+        purpose = purpose or tags.get("purpose", "")
+        prompt_chars = len(system_prompt) + len(user_prompt)
+        prompt_estimate = count_tokens(system_prompt) + count_tokens(user_prompt)
+        sizes = {"stage": stage, "prompt_chars": prompt_chars, "prompt_estimate": prompt_estimate}
+
+        key = None
+        if self.cache is not None and cache:
+            # Replies from another endpoint (a local stand-in) never mix
+            # with the real API's
+            model = self.model if self.url == PERPLEXITY_API_URL else f"{self.model}@{self.url}"
+            key = cache_key(model, system_prompt, user_prompt, temperature, max_tokens,
+                            response_format)
+            hit = None if self.bypass_cache else self.cache.get(key)
+            if hit is not None:
+                self._account(purpose, hit["usage"], 0.0, 0, cache_hit=True, **sizes)
+                print(f"[Perplexity] Cache hit ({len(hit['reply'])} chars).")
+                if on_text is not None:
+                    on_text(hit["reply"])
+                return hit["reply"]
+
+        if not self.api_key:
+            raise MissingAPIKeyError("PERPLEXITY_API_KEY environment variable is not set.")
+
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+        }
+        payload = {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt},
+            ],
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+        }
+        if response_format is not None and self.supports_response_format:
+            payload["response_format"] = response_format
+        post_options = {"timeout": timeout}
+        if on_text is not None:
+            # The read timeout applies between chunks, so a silent
+            # connection is caught after stall_seconds, not `timeout`.
+            payload["stream"] = True
+            post_options = {"timeout": (CONNECT_TIMEOUT, self.stall_seconds), "stream": True}
+
+        print(f"[Perplexity] {'Sending' if on_text is None else 'Streaming'} request"
+              f"{f' ({purpose})' if purpose else ''}: ~{prompt_estimate} prompt tokens …")
+        start = time.time()
+        for attempt in range(self.max_retries + 1):
+            resp = None
+            # Each attempt gets the full timeout, however long the
+            # call queued for a slot or backed off before it; the slot
+            # is released while backing off, so a rate-limited call
+            # does not keep others waiting through its Retry-After
+            with self._slots:
+                deadline = time.time() + timeout
+                try:
+                    resp = self.session.post(self.url, json=payload, headers=headers,
+                                             **post_options)
+                    if resp.status_code in (400, 422) and "response_format" in payload:
+                        # Only an error about the schema itself rules structured
+                        # output out for later calls; any other 400 (an over-long
+                        # prompt, say) just drops it from this one
+                        if _mentions_response_format(resp):
+                            print("[Perplexity] Structured output rejected, "
+                                  "resending without it …")
+                            self.supports_response_format = False
+                        else:
+                            print(f"[Perplexity] HTTP {resp.status_code}, resending without "
+                                  f"structured output …")
+                        payload = {k: v for k, v in payload.items() if k != "response_format"}
+                        resp = self.session.post(self.url, json=payload, headers=headers,
+                                                 **post_options)
+                    if resp.status_code not in RETRY_STATUSES:
+                        resp.raise_for_status()
+                        if on_text is None:
+                            data = resp.json()
+                            choice = data["choices"][0]
+                            reply = choice["message"]["content"]
+                            usage = data.get("usage") or {}
+                            finish = choice.get("finish_reason")
+                        else:
+                            reply, usage, finish = self._read_stream(resp, on_text, deadline)
+                        break
+                    error = f"HTTP {resp.status_code}"
+                except RETRY_EXCEPTIONS as e:
+                    error = str(e)
+                except requests.HTTPError as e:
+                    self._account(purpose, {}, time.time() - start, attempt,
+                                  error=str(e), **sizes)
+                    raise PerplexityError(f"Perplexity request failed: {e}") from e
+            if attempt == self.max_retries:
+                self._account(purpose, {}, time.time() - start, attempt,
+                              error=error, **sizes)
+                raise PerplexityError(
+                    f"Perplexity request failed after {attempt + 1} attempts: {error}")
+            delay = self._backoff(attempt, resp)
+            print(f"[Perplexity] {error}, retrying in {delay:.1f}s …")
+            time.sleep(delay)
+
+        # A reply cut short (finish_reason "length") is returned but never
+        # cached, or every rerun would get the same truncated text
+        if key is not None and finish == "stop":
+            self.cache.put(key, reply, usage, model=self.model)
+        record = self._account(purpose, usage, time.time() - start, attempt,
+                               finish_reason=finish, **sizes)
+        print(f"[Perplexity] Received {len(reply)} chars"
+              f" ({record['completion_tokens'] or '?'} tokens, {record['latency_seconds']:.1f}s).")
+        if finish != "stop":
+            print(f"[Perplexity] Warning: reply ended with finish_reason {finish!r}"
+                  f"{' (max_tokens reached)' if finish == 'length' else ''}; not cached.")
+        return reply
+
+    def _read_stream(self, resp, on_text, deadline: float) -> tuple[str, dict, str | None]:
+        """Collect a server-sent-events reply, reporting progress.
+        Returns (text, usage, finish_reason).
+
+        Raises StreamStalledError when keep-alives arrive but no token has
+        for stall_seconds, and requests.Timeout past the overall deadline.
+        """
+        resp.encoding = resp.encoding or "utf-8"
+        text = ""
+        usage = {}
+        finish = None
+        last_token = time.monotonic()
+        on_text(text)
+        try:
+            for line in resp.iter_lines(decode_unicode=True):
+                now = time.monotonic()
+                if time.time() > deadline:
+                    raise requests.Timeout("stream exceeded the request timeout")
+                if not line or not line.startswith("data:"):
+                    if now - last_token > self.stall_seconds:
+                        raise StreamStalledError(
+                            f"stream stalled: no tokens for {now - last_token:.0f}s")
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                try:
+                    chunk = json.loads(data)
+                except json.JSONDecodeError:
+                    continue
+                usage = chunk.get("usage") or usage
+                choices = chunk.get("choices") or [{}]
+                finish = choices[0].get("finish_reason") or finish
+                delta = (choices[0].get("delta") or {}).get("content") or ""
+                if delta:
+                    text += delta
+                    last_token = now
+                    on_text(text)
+        finally:
+            resp.close()
+        return text, usage, finish
+
+    def _account(self, purpose: str, usage: dict, latency: float, retries: int,
+                 prompt_estimate: int = 0, cache_hit: bool = False, stage: str = "",
+                 prompt_chars: int = 0, error: str | None = None,
+                 finish_reason: str | None = None) -> dict:
+        record = {
+            "timestamp": round(time.time(), 3),
+            "stage": stage,
+            "purpose": purpose,
+            "model": self.model,
+            "prompt_chars": prompt_chars,
+            "prompt_tokens_estimate": prompt_estimate,
+            "prompt_tokens": usage.get("prompt_tokens"),
+            "completion_tokens": usage.get("completion_tokens"),
+            "total_tokens": usage.get("total_tokens"),
+            "latency_seconds": round(latency, 3),
+            "retries": retries,
+            "cache_hit": cache_hit,
+        }
+        if error:
+            record["error"] = error
+        if finish_reason:
+            record["finish_reason"] = finish_reason
+        with self._lock:
+            self.calls.append(record)
+            if self.ledger_path:
+                append_record(self.ledger_path, record)
+        return record
+
+    async def acomplete(self, system_prompt: str, user_prompt: str, **kwargs) -> str:
+        """``complete`` in a worker thread, for use with asyncio.gather."""
+        return await asyncio.to_thread(self.complete, system_prompt, user_prompt, **kwargs)
+
+    # ----- accounting -----
+
+    def usage_summary(self) -> dict:
+        """Totals over every request made so far (cache hits counted apart)."""
+        with self._lock:
+            calls = list(self.calls)
+        hits = [c for c in calls if c["cache_hit"]]
+        calls = [c for c in calls if not c["cache_hit"]]
+        latencies = sorted(c["latency_seconds"] for c in calls)
+        return {
+            "calls": len(calls),
+            "cache_hits": len(hits),
+            "tokens_saved": sum(c["total_tokens"] or 0 for c in hits),
+            "prompt_tokens": sum(c["prompt_tokens"] or 0 for c in calls),
+            "completion_tokens": sum(c["completion_tokens"] or 0 for c in calls),
+            "total_tokens": sum(c["total_tokens"] or 0 for c in calls),
+            "retries": sum(c["retries"] for c in calls),
+            "failed": sum(1 for c in calls if c.get("error")),
+            "truncated": sum(1 for c in calls if c.get("finish_reason") == "length"),
+            "latency_seconds": round(sum(latencies), 2),
+            "latency_max_seconds": latencies[-1] if latencies else None,
+        }
+
+
+def _mentions_response_format(resp) -> bool:
+    """Whether an error reply blames the structured-output parameters."""
+    body = (getattr(resp, "text", "") or "").lower()
+    return "response_format" in body or "json_schema" in body
+
+
+_client: PerplexityClient | None = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> PerplexityClient:
+    """The process-wide client (created on first use)."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = PerplexityClient(
+                cache=LLMCache(LLM_CACHE_DB) if LLM_CACHE_DB else None,
+                bypass_cache=LLM_CACHE_BYPASS,
+            )
+        return _client
+
+
+def query_perplexity(system_prompt: str, user_prompt: str,
+                     temperature: float = DEFAULT_TEMPERATURE,
+                     max_tokens: int = DEFAULT_MAX_TOKENS,
+                     timeout: float = DEFAULT_TIMEOUT,
+                     purpose: str = "",
+                     cache: bool = True,
+                     on_text=None,
+                     response_format: dict | None = None) -> str:
+    """Send a chat-completion request through the shared client and return
+    the assistant's reply text."""
+    return get_client().complete(system_prompt, user_prompt, temperature=temperature,
+                                 max_tokens=max_tokens, timeout=timeout, purpose=purpose,
+                                 cache=cache, on_text=on_text,
+                                 response_format=response_format)
+
+
+# ---------------------------------------------------------------------------
+# Call tags
+# ---------------------------------------------------------------------------
+
+_call_tags = threading.local()
+
+
+def current_llm_tags() -> dict:
+    """The stage/purpose tags of the calling thread."""
+    return dict(getattr(_call_tags, "tags", {}))
+
+
+@contextmanager
+def llm_tags(**tags):
+    """Tag every completion this thread makes (``stage``, and a default
+    ``purpose`` for calls that do not pass their own)."""
+    previous = current_llm_tags()
+    _call_tags.tags = {**previous, **tags}
+    try:
+        yield
+    finally:
+        _call_tags.tags = previous
+
+
+def with_llm_tags(fn, **tags):
+    """``fn`` wrapped to run under the caller's current tags plus ``tags``,
+    for handing LLM work to another thread."""
+    inherited = {**current_llm_tags(), **tags}
+
+    def run(*args, **kwargs):
+        with llm_tags(**inherited):
+            return fn(*args, **kwargs)
+    return run
+
+
+# ---------------------------------------------------------------------------
+# Streaming progress
+# ---------------------------------------------------------------------------
+
+_stream_sink = threading.local()
+
+
+@contextmanager
+def streaming_to(on_text):
+    """Stream every completion this thread makes to ``on_text``, so
+    section generators need not pass the callback down themselves."""
+    previous = getattr(_stream_sink, "on_text", None)
+    _stream_sink.on_text = on_text
+    try:
+        yield
+    finally:
+        _stream_sink.on_text = previous
+
+
+def _write_atomic(path: str, text: str):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+class StreamProgress:
+    """Surfaces streamed sections while they are being written.
+
+    Every section is listed in ``live_json`` as soon as it is queued (→
+    streaming → done / error, with characters received), like agent3's
+    live output; the text so far is rewritten to ``out_dir/<name>.md``;
+    a progress line is printed; and ``listener(event)`` gets the same
+    {"section", "status", "chars", "elapsed_seconds"} dict, e.g. to
+    forward to a chat.  Updates are throttled to one per ``interval``
+    seconds per section.
+    """
+
+    def __init__(self, out_dir: str | None = None, live_json: str | None = None,
+                 listener=None, interval: float = PROGRESS_INTERVAL_SECONDS):
+        self.out_dir = out_dir
+        self.live_json = live_json
+        self.listener = listener
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._started = {}
+        self._flushed = {}
+        self.status = {}
+        if out_dir:
+            os.makedirs(out_dir, exist_ok=True)
+
+    def queue(self, names):
+        with self._lock:
+            for name in names:
+                self.status[name] = {"status": "queued", "chars": 0}
+            self._flush_json()
+
+    def sink(self, name: str):
+        """The on_text callback for one section."""
+        def on_text(text):
+            now = time.monotonic()
+            with self._lock:
+                self._started.setdefault(name, now)
+                first = self.status[name]["status"] == "queued"
+                if not first and now - self._flushed.get(name, 0.0) < self.interval:
+                    return
+                self._flushed[name] = now
+            self._update(name, "streaming", text)
+        return on_text
+
+    def finish(self, name: str, text: str | None = None, error: str | None = None):
+        self._update(name, "error" if error else "done", text, error)
+
+    def _update(self, name, status, text, error=None):
+        with self._lock:
+            entry = self.status[name]
+            entry["status"] = status
+            if text is not None:
+                entry["chars"] = len(text)
+            if error:
+                entry["error"] = error
+            started = self._started.get(name)
+            elapsed = time.monotonic() - started if started is not None else 0.0
+            event = {"section": name, **entry, "elapsed_seconds": round(elapsed, 1)}
+            if self.out_dir and text is not None:
+                _write_atomic(os.path.join(self.out_dir, f"{name}.md"), text)
+            self._flush_json()
+        print(f"    [{name}] {status}: {event['chars']} chars ({event['elapsed_seconds']:.0f}s)")
+        if self.listener is not None:
+            self.listener(event)
+
+    def _flush_json(self):
+        if self.live_json:
+            _write_atomic(self.live_json, json.dumps(
+                {"updated_at": time.time(), "sections": self.status}, indent=2))
+
+
+def run_concurrently(tasks: dict, max_workers: int = MAX_CONCURRENCY,
+                     progress: StreamProgress | None = None) -> dict:
+    """Call each zero-argument callable in ``tasks`` on a thread pool and
+    return the results under the same keys.
+
+    Meant for independent LLM-backed generators (report and paper
+    sections); their requests still queue on the shared client's
+    concurrency cap.  Each task's calls keep the caller's stage tag and
+    default to the task's name as their purpose.  With ``progress``, each
+    task's completions stream to its section.  The first failure is
+    re-raised.
+    """
+    if not tasks:
+        return {}
+
+    def run(name, fn):
+        if progress is None:
+            return fn()
+        try:
+            with streaming_to(progress.sink(name)):
+                result = fn()
+        except Exception as e:
+            progress.finish(name, error=str(e))
+            raise
+        progress.finish(name, result if isinstance(result, str) else None)
+        return result
+
+    if progress is not None:
+        progress.queue(tasks)
+    with ThreadPoolExecutor(max_workers=max(1, min(len(tasks), max_workers))) as pool:
+        futures = {name: pool.submit(with_llm_tags(run, purpose=name), name, fn)
+                   for name, fn in tasks.items()}
+        return {name: fut.result() for name, fut in futures.items()}
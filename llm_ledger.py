@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+LLM Call Ledger
+
+One record per Perplexity call: the pipeline stage and purpose it was made
+for, the prompt's size (characters, estimated and billed tokens), the
+completion tokens, latency (including retries and backoff), the number
+of retries, whether the reply came from the response cache and, for calls
+that failed for good, the error.  llm_client appends the records to
+runs/<run_id>/llm_calls.jsonl as calls finish, and the pipeline prints a
+per-stage/purpose table when a run finishes.
+
+Aggregate the ledgers of every run, slowest prompts first:
+    python llm_ledger.py
+    python llm_ledger.py --runs-dir runs --by purpose
+    python llm_ledger.py runs/<run_id>/llm_calls.jsonl
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+
+from telemetry import percentile
+from workspace import RUNS_DIR
+
+# ---------------------------------------------------------------------------
+# Configuration
+# ---------------------------------------------------------------------------
+
+LEDGER_FILE = "llm_calls.jsonl"
+
+GROUP_KEYS = ("stage", "purpose")
+
+
+# ---------------------------------------------------------------------------
+# Records
+# ---------------------------------------------------------------------------
+
+def append_record(path: str, record: dict):
+    """Append one call record to a JSONL ledger."""
+    if not path:
+        return
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def load_records(path: str) -> list[dict]:
+    """Read a JSONL ledger, skipping unreadable lines."""
+    if not os.path.exists(path):
+        return []
+    records = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return records
+
+
+def ledger_paths(runs_dir: str = RUNS_DIR) -> list[str]:
+    """Ledgers of every run under runs_dir."""
+    return sorted(glob.glob(os.path.join(runs_dir, "*", LEDGER_FILE)))
+
+
+# ---------------------------------------------------------------------------
+# Summaries
+# ---------------------------------------------------------------------------
+
+def summarize_calls(records: list[dict], by: tuple = GROUP_KEYS) -> list[dict]:
+    """One row per distinct combination of the ``by`` fields, heaviest
+    total latency first.
+
+    Cache hits are counted but excluded from the token and latency
+    figures, which describe the requests actually sent.  Prompt tokens
+    are the billed count when the API reported one, else the estimate.
+    """
+    groups: dict[tuple, list[dict]] = {}
+    for r in records:
+        key = tuple(r.get(k) or "-" for k in by)
+        groups.setdefault(key, []).append(r)
+
+    total_latency = sum(r.get("latency_seconds") or 0 for r in records
+                        if not r.get("cache_hit")) or 1.0
+    rows = []
+    for key, group in groups.items():
+        sent = [r for r in group if not r.get("cache_hit")]
+        latencies = [r.get("latency_seconds") or 0 for r in sent]
+        row = dict(zip(by, key))
+        row.update({
+            "calls": len(sent),
+            "cache_hits": len(group) - len(sent),
+            "retries": sum(r.get("retries", 0) for r in sent),
+            "errors": sum(1 for r in sent if r.get("error")),
+            "prompt_chars": sum(r.get("prompt_chars") or 0 for r in sent),
+            "prompt_tokens": sum(
+                r.get("prompt_tokens") or r.get("prompt_tokens_estimate") or 0 for r in sent),
+            "completion_tokens": sum(r.get("completion_tokens") or 0 for r in sent),
+            "latency_seconds": round(sum(latencies), 2),
+            "latency_p50_seconds": _round(percentile(latencies, 50)),
+            "latency_max_seconds": _round(max(latencies) if latencies else None),
+            "latency_share": round(sum(latencies) / total_latency, 3),
+        })
+        rows.append(row)
+    rows.sort(key=lambda r: -r["latency_seconds"])
+    return rows
+
+
+def _round(x):
+    return round(x, 2) if x is not None else None
+
+
+def format_table(rows: list[dict], by: tuple = GROUP_KEYS,
+                 title: str = "LLM calls") -> str:
+    """Render summary rows as an aligned text table with a totals line."""
+    def _fmt(v):
+        return "-" if v is None else str(v)
+
+    label_width = max([len(" / ".join(by))] +
+                      [len(" / ".join(str(r[k]) for k in by)) for r in rows])
+    header = (f"    {' / '.join(by):<{label_width}}  {'calls':>5}  {'hits':>4}  "
+              f"{'retry':>5}  {'err':>3}  {'prompt tok':>10}  {'compl tok':>9}  "
+              f"{'total s':>8}  {'p50 s':>6}  {'max s':>6}  {'share':>5}")
+    lines = [f"  {title}:", header]
+    for r in rows:
+        label = " / ".join(str(r[k]) for k in by)
+        lines.append(
+            f"    {label:<{label_width}}  {r['calls']:>5}  {r['cache_hits']:>4}  "
+            f"{r['retries']:>5}  {r['errors']:>3}  {r['prompt_tokens']:>10,}  "
+            f"{r['completion_tokens']:>9,}  "
+            f"{r['latency_seconds']:>8.1f}  {_fmt(r['latency_p50_seconds']):>6}  "
+            f"{_fmt(r['latency_max_seconds']):>6}  {r['latency_share']:>5.0%}"
+        )
+    lines.append(
+        f"    {'total':<{label_width}}  {sum(r['calls'] for r in rows):>5}  "
+        f"{sum(r['cache_hits'] for r in rows):>4}  {sum(r['retries'] for r in rows):>5}  "
+        f"{sum(r['errors'] for r in rows):>3}  "
+        f"{sum(r['prompt_tokens'] for r in rows):>10,}  "
+        f"{sum(r['completion_tokens'] for r in rows):>9,}  "
+        f"{sum(r['latency_seconds'] for r in rows):>8.1f}"
+    )
+    return "\n".join(lines)
+
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Aggregate LLM call ledgers across pipeline runs."
+    )
+    parser.add_argument("paths", nargs="*",
+                        help="Ledger files (default: every run's ledger under --runs-dir).")
+    parser.add_argument("--runs-dir", default=RUNS_DIR,
+                        help=f"Directory holding per-run workspaces (default: {RUNS_DIR}).")
+    parser.add_argument("--by", default=",".join(GROUP_KEYS),
+                        help="Comma-separated fields to group by, e.g. 'purpose' or "
+                             "'run,stage' (default: stage,purpose).")
+    args = parser.parse_args()
+
+    paths = args.paths or ledger_paths(args.runs_dir)
+    records = []
+    for path in paths:
+        run = os.path.basename(os.path.dirname(os.path.abspath(path)))
+        records.extend({"run": run, **r} for r in load_records(path))
+    if not records:
+        print(f"ERROR: No LLM call records in {', '.join(paths) or args.runs_dir}",
+              file=sys.stderr)
+        sys.exit(1)
+
+    by = tuple(k.strip() for k in args.by.split(",") if k.strip()) or GROUP_KEYS
+    print(format_table(summarize_calls(records, by), by,
+                       f"LLM calls across {len(paths)} run(s)"))
+
+
+if __name__ == "__main__":
+    main()
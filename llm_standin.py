@@ -0,0 +1,474 @@
+#!/usr/bin/env python3
+"""
+Local Perplexity Stand-in
+
+A chat-completions server that speaks enough of the Perplexity API
+(plain and streamed replies, ``usage``, ``response_format``) for the
+review, results, final and pipeline code to run without a key.  Point the
+client at it with PERPLEXITY_URL.
+
+Replies come from, in order:
+  1. recordings (llm_recordings.jsonl), matched by a hash of the prompt
+     messages — with ``--upstream`` a miss is forwarded to the real API
+     and recorded, so a live run can be captured once and replayed;
+  2. synthesis: plausible Markdown (the sections, numbered items and
+     tables the prompt asks for, citing genes it mentions) or JSON (an
+     instance of the response_format schema, a drug-name list, or an
+     object with the keys the system prompt lists).  Synthesis is seeded
+     by the prompt hash, so the same prompt always gets the same reply.
+
+Faults can be injected to benchmark concurrency, caching and retries
+offline: time to first token, per-token delay, a share of 429 replies
+(with Retry-After) and a share of replies cut short (finish_reason
+"length", as when max_tokens runs out).
+
+Usage:
+    python llm_standin.py                                # 127.0.0.1:8765
+    python llm_standin.py --latency 2 --rate-limit 0.1 --truncate 0.05
+    python llm_standin.py --upstream https://api.perplexity.ai/chat/completions
+    PERPLEXITY_URL=http://127.0.0.1:8765/chat/completions PERPLEXITY_API_KEY=local \\
+        python pipeline.py "glioblastoma"
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from gene_symbols import get_matcher
+from prompt_budget import count_tokens
+
+# ---------------------------------------------------------------------------
+# Configuration
+# ---------------------------------------------------------------------------
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+RECORDINGS_FILE = "llm_recordings.jsonl"
+
+CHARS_PER_CHUNK = 16     # streamed delta size (about four tokens)
+UPSTREAM_TIMEOUT = 180
+
+# Vocabulary for synthesized replies
+DRUG_NAMES = [
+    "Imatinib", "Erlotinib", "Gefitinib", "Osimertinib", "Sotorasib", "Trametinib",
+    "Dabrafenib", "Olaparib", "Palbociclib", "Everolimus", "Metformin", "Atorvastatin",
+    "Disulfiram", "Itraconazole", "Mebendazole", "Niclosamide", "Chloroquine",
+    "Celecoxib", "Propranolol", "Valproic acid", "Sildenafil", "Auranofin",
+]
+DRUG_CLASSES = ["statins", "kinase inhibitors", "benzimidazoles", "biguanides",
+                "antifungal azoles", "PARP inhibitors"]
+FALLBACK_GENES = ["EGFR", "KRAS", "TP53"]
+FILLER = [
+    "Recent work has clarified how {gene} contributes to tumour growth and "
+    "treatment resistance [{ref}].",
+    "Inhibition of {gene} reduced proliferation in preclinical models, although "
+    "responses varied between molecular subtypes [{ref}].",
+    "Docking and structural studies suggest that approved drugs may engage {gene} "
+    "at sites distinct from those of established inhibitors [{ref}].",
+    "Clinical evidence for targeting {gene} remains limited, motivating "
+    "combination strategies and biomarker-driven trials [{ref}].",
+]
+
+
+def prompt_hash(messages: list[dict]) -> str:
+    """SHA-256 over the (role, content) of every message."""
+    material = [[m.get("role", ""), m.get("content", "")] for m in messages]
+    payload = json.dumps(material, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# ---------------------------------------------------------------------------
+# Recordings
+# ---------------------------------------------------------------------------
+
+def load_recordings(path: str) -> dict[str, dict]:
+    """{prompt_hash: {"reply", "usage"}} from a JSONL file (last wins)."""
+    recordings = {}
+    if not path or not os.path.exists(path):
+        return recordings
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                r = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if r.get("prompt_hash") and "reply" in r:
+                recordings[r["prompt_hash"]] = {"reply": r["reply"], "usage": r.get("usage") or {}}
+    return recordings
+
+
+# ---------------------------------------------------------------------------
+# Synthesis
+# ---------------------------------------------------------------------------
+
+def _genes(text: str) -> list[str]:
+    seen = []
+    for _, _, symbol in get_matcher().mentions(text):
+        if symbol not in seen:
+            seen.append(symbol)
+    return seen or list(FALLBACK_GENES)
+
+
+def _from_schema(schema: dict, name: str, rng: random.Random, genes: list[str]):
+    """A value matching a JSON-schema fragment, using the property name to
+    pick plausible strings."""
+    kind = schema.get("type")
+    if "enum" in schema:
+        return rng.choice(schema["enum"])
+    if kind == "object":
+        props = schema.get("properties", {})
+        return {key: _from_schema(sub, key, rng, genes) for key, sub in props.items()}
+    if kind == "array":
+        item = schema.get("items", {})
+        if item.get("type") == "object":
+            count = rng.randint(3, 6)
+        else:
+            count = rng.randint(1, 3)
+        values = [_from_schema(item, name, rng, genes) for _ in range(count)]
+        if item.get("type") == "string":
+            values = list(dict.fromkeys(values))
+        return values
+    if kind in ("number", "integer"):
+        value = rng.uniform(0, 1)
+        return int(value * 100) if kind == "integer" else round(value, 3)
+    if kind == "boolean":
+        return rng.random() < 0.5
+    return _string_for(name, rng, genes)
+
+
+def _string_for(name: str, rng: random.Random, genes: list[str]) -> str:
+    name = name.lower()
+    if name in ("drug", "name") or "drug_name" in name:
+        return rng.choice(DRUG_NAMES)
+    if "protein" in name or "target" in name or "gene" in name:
+        return rng.choice(genes)
+    if "class" in name:
+        return rng.choice(DRUG_CLASSES)
+    if "fda" in name or "status" in name:
+        return rng.choice(["FDA-approved", "FDA-approved (other indication)", "investigational"])
+    if "mechanism" in name:
+        return f"{rng.choice(genes)} inhibitor"
+    return rng.choice(FILLER).format(gene=rng.choice(genes), ref=rng.randint(1, 9))
+
+
+def synthesize_json(system: str, user: str, response_format: dict | None,
+                    rng: random.Random) -> str:
+    genes = _genes(user)
+    schema = ((response_format or {}).get("json_schema") or {}).get("schema")
+    if schema:
+        return json.dumps(_from_schema(schema, "", rng, genes), indent=2)
+    if "json list" in (system + user).lower():
+        return json.dumps(rng.sample(DRUG_NAMES, 8))
+    if '"drugs"' in system:
+        drugs = [{"drug": name, "proteins": rng.sample(genes, min(len(genes), 2)),
+                  "mechanism": f"{rng.choice(genes)} inhibitor",
+                  "fda_status": "FDA-approved",
+                  "category": rng.choice(["mainstream", "repurposing_candidate"])}
+                 for name in rng.sample(DRUG_NAMES, 5)]
+        return json.dumps({"drugs": drugs, "protein_targets": genes}, indent=2)
+    if '"action"' in system:
+        # The reasoning loop's decision; proceeding keeps offline runs short
+        return json.dumps({
+            "action": "proceed",
+            "rationale": _string_for("rationale", rng, genes),
+            "hypothesis": _string_for("hypothesis", rng, genes),
+        }, indent=2)
+    keys = list(dict.fromkeys(re.findall(r'"(\w+)"\s*:', system))) or ["result"]
+    return json.dumps({key: _string_for(key, rng, genes) for key in keys}, indent=2)
+
+
+def synthesize_markdown(system: str, user: str, rng: random.Random) -> str:
+    """Headings for every section the prompt asks for (its "## " headings
+    or numbered items), each with a few cited paragraphs; a table where
+    the prompt mentions one."""
+    genes = _genes(user)
+    headings = re.findall(r"^##+\s+(.+)$", user, re.MULTILINE)
+    if not headings:
+        headings = [re.sub(r"\*\*|\(.*?\)", "", h).strip(" :")
+                    for h in re.findall(r"^\s*\d+\.\s+(.+)$", user, re.MULTILINE)]
+    headings = [h for h in headings if h] or ["Overview", "Discussion"]
+
+    parts = []
+    ref = 1
+    for heading in headings:
+        parts.append(f"## {heading}")
+        if "reference" in heading.lower():
+            parts.append("\n".join(f"[{i}] Synthetic reference {i}." for i in range(1, ref)))
+            continue
+        if "table" in heading.lower():
+            rows = [f"| {rng.choice(DRUG_NAMES)} | {rng.choice(genes)} | "
+                    f"{rng.choice(['strong', 'computational', 'speculative'])} |"
+                    for _ in range(rng.randint(4, 8))]
+            parts.append("| Drug | Target | Evidence |\n|---|---|---|\n" + "\n".join(rows))
+            continue
+        for _ in range(rng.randint(1, 3)):
+            sentences = []
+            for _ in range(rng.randint(2, 4)):
+                sentences.append(rng.choice(FILLER).format(gene=rng.choice(genes), ref=ref))
+                ref = ref % 9 + 1
+            parts.append(" ".join(sentences))
+    return "\n\n".join(parts) + "\n"
+
+
+def wants_json(system: str, user: str, response_format: dict | None) -> bool:
+    if response_format:
+        return True
+    text = (system + " " + user).lower()
+    return "return only valid json" in text or "json list" in text or "as json" in text
+
+
+# ---------------------------------------------------------------------------
+# Server
+# ---------------------------------------------------------------------------
+
+class StandIn:
+    """Reply source and fault injection shared by every request.
+
+    latency:       seconds before the reply starts (± jitter, as a fraction)
+    token_delay:   seconds between streamed chunks
+    rate_limit:    share of requests answered 429 with Retry-After
+    truncate:      share of replies cut short with finish_reason "length"
+    upstream:      real API URL that misses are forwarded to and recorded
+    strict:        answer 404 instead of synthesizing for unrecorded prompts
+    """
+
+    def __init__(self, recordings_path: str = RECORDINGS_FILE, latency: float = 0.0,
+                 jitter: float = 0.5, token_delay: float = 0.0, rate_limit: float = 0.0,
+                 retry_after: float = 1.0, truncate: float = 0.0, seed: int | None = None,
+                 upstream: str | None = None, strict: bool = False):
+        self.recordings_path = recordings_path
+        self.recordings = load_recordings(recordings_path)
+        self.latency = latency
+        self.jitter = jitter
+        self.token_delay = token_delay
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.truncate = truncate
+        self.upstream = upstream
+        self.strict = strict
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "replayed": 0, "recorded": 0, "synthesized": 0,
+                      "rate_limited": 0, "truncated": 0}
+
+    def _count(self, key: str):
+        with self._lock:
+            self.stats[key] += 1
+
+    def _roll(self, share: float) -> bool:
+        with self._lock:
+            return self._rng.random() < share
+
+    def first_token_delay(self) -> float:
+        with self._lock:
+            spread = self._rng.uniform(-self.jitter, self.jitter)
+        return max(0.0, self.latency * (1 + spread))
+
+    def rate_limited(self) -> bool:
+        self._count("requests")
+        if self.rate_limit and self._roll(self.rate_limit):
+            self._count("rate_limited")
+            return True
+        return False
+
+    def reply(self, payload: dict) -> tuple[str, dict] | None:
+        """(reply, usage) for a request, or None when strict and unseen."""
+        messages = payload.get("messages") or []
+        key = prompt_hash(messages)
+        hit = self.recordings.get(key)
+        if hit is not None:
+            self._count("replayed")
+            return hit["reply"], hit["usage"]
+        if self.upstream:
+            return self._record(key, payload)
+        if self.strict:
+            return None
+
+        self._count("synthesized")
+        system = "\n".join(m.get("content", "") for m in messages if m.get("role") == "system")
+        user = "\n".join(m.get("content", "") for m in messages if m.get("role") != "system")
+        rng = random.Random(key)
+        response_format = payload.get("response_format")
+        if wants_json(system, user, response_format):
+            text = synthesize_json(system, user, response_format, rng)
+        else:
+            text = synthesize_markdown(system, user, rng)
+        usage = {"prompt_tokens": count_tokens(system) + count_tokens(user),
+                 "completion_tokens": count_tokens(text)}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        return text, usage
+
+    def _record(self, key: str, payload: dict) -> tuple[str, dict]:
+        headers = {"Authorization": f"Bearer {os.environ.get('PERPLEXITY_API_KEY', '')}",
+                   "Content-Type": "application/json"}
+        body = {k: v for k, v in payload.items() if k != "stream"}
+        resp = requests.post(self.upstream, json=body, headers=headers, timeout=UPSTREAM_TIMEOUT)
+        resp.raise_for_status()
+        data = resp.json()
+        text, usage = data["choices"][0]["message"]["content"], data.get("usage") or {}
+        with self._lock:
+            self.recordings[key] = {"reply": text, "usage": usage}
+            self.stats["recorded"] += 1
+            with open(self.recordings_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"prompt_hash": key, "model": payload.get("model"),
+                                    "reply": text, "usage": usage,
+                                    "recorded_at": time.time()}, ensure_ascii=False) + "\n")
+        return text, usage
+
+    def maybe_truncate(self, text: str, usage: dict) -> tuple[str, dict, str]:
+        if not self.truncate or not self._roll(self.truncate):
+            return text, usage, "stop"
+        self._count("truncated")
+        with self._lock:
+            cut = int(len(text) * self._rng.uniform(0.3, 0.9))
+        completion = count_tokens(text[:cut])
+        usage = {**usage, "completion_tokens": completion,
+                 "total_tokens": (usage.get("prompt_tokens") or 0) + completion}
+        return text[:cut], usage, "length"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    standin: StandIn = None  # set per server by make_server
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):
+        pass  # one line per reply is printed below instead
+
+    def _send_json(self, status: int, body: dict, headers: dict | None = None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        standin = self.standin
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            self._send_json(400, {"error": {"message": "invalid JSON body"}})
+            return
+        if not self.path.rstrip("/").endswith("chat/completions"):
+            self._send_json(404, {"error": {"message": f"unknown path {self.path}"}})
+            return
+        if standin.rate_limited():
+            self._send_json(429, {"error": {"message": "rate limited (stand-in)"}},
+                            {"Retry-After": f"{standin.retry_after:g}"})
+            return
+
+        delay = standin.first_token_delay()
+        if delay > 0:
+            time.sleep(delay)
+        try:
+            result = standin.reply(payload)
+        except requests.RequestException as e:
+            self._send_json(502, {"error": {"message": f"upstream failed: {e}"}})
+            return
+        if result is None:
+            self._send_json(404, {"error": {"message": "no recording for this prompt"}})
+            return
+        text, usage, finish = standin.maybe_truncate(*result)
+        print(f"  [stand-in] {len(text)} chars ({finish}, {delay:.1f}s"
+              f"{', streamed' if payload.get('stream') else ''})")
+
+        model = payload.get("model", "")
+        if not payload.get("stream"):
+            self._send_json(200, {
+                "model": model,
+                "choices": [{"index": 0, "finish_reason": finish,
+                             "message": {"role": "assistant", "content": text}}],
+                "usage": usage,
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        for i in range(0, len(text), CHARS_PER_CHUNK):
+            chunk = {"model": model,
+                     "choices": [{"index": 0, "delta": {"content": text[i:i + CHARS_PER_CHUNK]}}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            if standin.token_delay > 0:
+                time.sleep(standin.token_delay)
+        final = {"model": model, "usage": usage,
+                 "choices": [{"index": 0, "delta": {}, "finish_reason": finish}]}
+        self.wfile.write(f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n".encode("utf-8"))
+        self.wfile.flush()
+
+
+def make_server(standin: StandIn, host: str = DEFAULT_HOST,
+                port: int = DEFAULT_PORT) -> ThreadingHTTPServer:
+    """A threaded HTTP server answering with ``standin`` (port 0 picks a
+    free port; see ``server.server_address``)."""
+    handler = type("StandInHandler", (_Handler,), {"standin": standin})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Perplexity chat-completions stand-in.")
+    parser.add_argument("--host", default=DEFAULT_HOST, help=f"Bind address (default: {DEFAULT_HOST}).")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT,
+                        help=f"Port (default: {DEFAULT_PORT}).")
+    parser.add_argument("--recordings", default=RECORDINGS_FILE,
+                        help=f"Recorded replies, JSONL (default: {RECORDINGS_FILE}).")
+    parser.add_argument("--upstream", default=None,
+                        help="Forward unrecorded prompts to this URL (with PERPLEXITY_API_KEY) "
+                             "and record the replies.")
+    parser.add_argument("--strict", action="store_true",
+                        help="Answer 404 for unrecorded prompts instead of synthesizing.")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="Seconds before a reply starts (default: 0).")
+    parser.add_argument("--jitter", type=float, default=0.5,
+                        help="Latency spread as a fraction of --latency (default: 0.5).")
+    parser.add_argument("--token-delay", type=float, default=0.0,
+                        help="Seconds between streamed chunks (default: 0).")
+    parser.add_argument("--rate-limit", type=float, default=0.0,
+                        help="Share of requests answered 429 (default: 0).")
+    parser.add_argument("--retry-after", type=float, default=1.0,
+                        help="Retry-After seconds sent with a 429 (default: 1).")
+    parser.add_argument("--truncate", type=float, default=0.0,
+                        help="Share of replies cut short (default: 0).")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for injected faults.")
+    args = parser.parse_args()
+
+    standin = StandIn(args.recordings, latency=args.latency, jitter=args.jitter,
+                      token_delay=args.token_delay, rate_limit=args.rate_limit,
+                      retry_after=args.retry_after, truncate=args.truncate, seed=args.seed,
+                      upstream=args.upstream, strict=args.strict)
+    server = make_server(standin, args.host, args.port)
+    host, port = server.server_address[:2]
+    print(f"  Perplexity stand-in on http://{host}:{port}/chat/completions "
+          f"({len(standin.recordings)} recordings)")
+    print(f"  export PERPLEXITY_URL=http://{host}:{port}/chat/completions")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"  {standin.stats}")
+
+
+if __name__ == "__main__":
+    main()
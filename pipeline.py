@@ -10,10 +10,18 @@ Perplexity Sonar analyzes results, looks for patterns (e.g. drug-class
 clustering), and decides whether to expand the search (3D similarity,
 more drugs of a promising class) or proceed to synthesis.
 
+Each run writes its artifacts to its own workspace, runs/<run_id>/, so
+several pipelines can share a host; downloaded structures are shared.
+
 Usage:
     python pipeline.py "pancreatic ductal adenocarcinoma"
     python pipeline.py "pleural mesothelioma" --max-rounds 3
-    python pipeline.py --resume   # resume from last saved state
+    python pipeline.py --resume   # resume the most recent run
+    python pipeline.py --resume --run-id <run_id>
+    python pipeline.py --resume --max-rounds 3   # redo reasoning onwards only
+    python pipeline.py "glioblastoma" --backend local   # dock on local CPUs
+    python pipeline.py "glioblastoma" --plan --samples 20   # estimate only
+    python pipeline.py --plan agent2_output.json
 """
 
 from __future__ import annotations
@@ -23,7 +31,9 @@ import json
 import os
 import re
 import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 from dotenv import load_dotenv
@@ -35,15 +45,8 @@ load_dotenv()
 # ---------------------------------------------------------------------------
 
 from review import (
-    search_arxiv,
-    query_perplexity,
-    extract_proteins_from_text,
     format_papers_for_prompt,
-    build_cancer_query,
-    build_drug_query,
-    build_repurposing_query,
-    _discover_repurposing_candidates,
-    _extract_drug_protein_map,
+    run_literature_graph,
     _parse_json_response,
     _build_references,
 )
@@ -57,28 +60,49 @@ from agent2 import (
     canonicalize_smiles,
 )
 from agent3 import run_docking
+from llm_client import StreamProgress, get_client, query_perplexity, with_llm_tags
+from llm_ledger import LEDGER_FILE, format_table, load_records, summarize_calls
+from telemetry import TELEMETRY_FILE, summarize_chunks, format_summary
+from pose_store import POSE_PACK_FILE, PoseStore, offload_poses
+from state_log import StateLog
+from results_store import RESULTS_DB, ResultsStore
+from results_export import COLUMNS_FILE, write_columns
+from rankings import Rankings, write_docking_output
+from stage_dag import Stage, StageGraph
+from planner import (
+    estimate,
+    format_plan,
+    history,
+    workload_from_agent2,
+    workload_from_history,
+    workload_from_review,
+)
+from workspace import (
+    AGENT2_OUTPUT,
+    AGENT3_OUTPUT,
+    FINAL_PAPER_MD,
+    LLM_PROGRESS,
+    LLM_STREAM_DIR,
+    RESULTS_MD,
+    REVIEW_JSON,
+    REVIEW_MD,
+    RUNS_DIR,
+    SHARED_STRUCTURES_DIR,
+    STATE_FILE,
+    create_run_dir,
+    find_run_dir,
+)
 from results import (
     summarise_target,
     classify_compound,
     build_overview_block,
     build_classified_overview,
     format_target_summary_for_prompt,
-    generate_methodology,
-    generate_results,
-    generate_conclusion,
+    generate_report_sections,
 )
 from final import (
-    generate_abstract,
-    merge_introduction_and_background,
-    merge_drug_landscape,
-    merge_results as merge_results_section,
-    merge_conclusions,
-    _get_review_intro_sections,
-    _get_review_drug_sections,
-    _get_review_conclusion,
+    generate_paper_sections,
     _get_results_methodology,
-    _get_results_body,
-    _get_results_conclusion,
     _extract_references,
     _deduplicate_references,
     _strip_leading_header,
@@ -88,9 +112,10 @@ from final import (
 # Configuration
 # ---------------------------------------------------------------------------
 
-STATE_FILE = "pipeline_state.json"
-STRUCTURES_DIR = "structures"
+STRUCTURES_DIR = SHARED_STRUCTURES_DIR  # shared across runs
 MAX_EXPANSION_ROUNDS = 2
+MAX_COMPOUNDS_PER_TARGET = 50
+PIPELINED_DOCKING_WORKERS = 2  # targets docked concurrently in --pipelined mode
 PUBCHEM_DELAY = 0.25
 
 
@@ -98,11 +123,38 @@ PUBCHEM_DELAY = 0.25
 # Pipeline state
 # ---------------------------------------------------------------------------
 
-def new_state(cancer_type: str) -> dict:
-    """Create a fresh pipeline state."""
+def new_run_id(cancer_type: str) -> str:
+    """Run identifier: cancer-type slug plus a start timestamp."""
+    slug = re.sub(r"[^a-z0-9]+", "-", cancer_type.lower()).strip("-")
+    return f"{slug}-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+
+
+def new_state(cancer_type: str, docking_options: dict | None = None,
+              run_dir: str | None = None,
+              max_rounds: int = MAX_EXPANSION_ROUNDS,
+              pipelined: bool = False,
+              max_compounds: int = MAX_COMPOUNDS_PER_TARGET) -> dict:
+    """Create a fresh pipeline state.
+
+    docking_options: extra keyword arguments forwarded to run_docking for
+      every docking round (e.g. {"hedge_multiplier": 2.0}).
+    run_dir: workspace for this run's artifacts (default: current directory).
+    max_rounds: expansion rounds the reasoning stage may run.
+    pipelined: dock each target as soon as stage 2 has prepared it.
+    max_compounds: PubChem bioactive compounds fetched per target.
+    """
+    run_id = new_run_id(cancer_type)
     return {
         "cancer_type": cancer_type,
+        "run_id": run_id,
+        "run_dir": run_dir or ".",
         "status": "initialized",
+        "docking_options": docking_options or {},
+        "max_rounds": max_rounds,
+        "pipelined": pipelined,
+        "max_compounds": max_compounds,
+        "stage_fingerprints": {},   # stage → input fingerprint (see stage_dag)
+        "stage_outputs": {},        # stage → hashes of the artifacts it wrote
         "round": 0,
         "protein_targets": [],
         "drugs": [],
@@ -110,6 +162,9 @@ def new_state(cancer_type: str) -> dict:
         "all_docking_results": [],  # accumulated across rounds
         "hypotheses": [],
         "expansion_history": [],
+        "docking_telemetry": [],    # per-round chunk latency / GPU-cost summaries
+        "docking_progress": None,   # {"round", "targets", "done"} while a round runs
+        "pose_pack": POSE_PACK_FILE,  # poses live here; results hold pose_ref only
         "review_md": "",
         "results_md": "",
         "final_paper_md": "",
@@ -117,18 +172,68 @@ def new_state(cancer_type: str) -> dict:
     }
 
 
+_state_logs: dict[str, StateLog] = {}
+
+
+def _get_state_log(run_dir: str = ".") -> StateLog:
+    path = os.path.join(run_dir, STATE_FILE)
+    if path not in _state_logs:
+        _state_logs[path] = StateLog(path)
+    return _state_logs[path]
+
+
+def artifact_path(state: dict, name: str) -> str:
+    """Path of a run artifact inside the state's workspace."""
+    return os.path.join(state.get("run_dir", "."), name)
+
+
+def _stream_progress(state: dict) -> StreamProgress:
+    """Streamed report/paper sections land in the run directory as they
+    are written: llm_stream/<section>.md plus the llm_progress.json status."""
+    return StreamProgress(out_dir=artifact_path(state, LLM_STREAM_DIR),
+                          live_json=artifact_path(state, LLM_PROGRESS))
+
+
+_save_lock = threading.RLock()
+
+
 def save_state(state: dict):
-    """Persist pipeline state to disk."""
-    tmp = STATE_FILE + ".tmp"
-    with open(tmp, "w", encoding="utf-8") as f:
-        json.dump(state, f, indent=2, ensure_ascii=False)
-    os.replace(tmp, STATE_FILE)
+    """Persist pipeline state: append what changed since the last save.
+
+    The event log is folded into a full snapshot once it outgrows it, and
+    always when the run completes.  Safe to call from concurrent stages.
+    """
+    with _save_lock:
+        log = _get_state_log(state.get("run_dir", "."))
+        log.save(state)
+        if state.get("status") == "complete":
+            log.compact(state)
+
+
+def load_state(run_dir: str = ".", lazy: bool = False):
+    """Reconstruct pipeline state from the snapshot and event log.
 
+    With lazy=True, large sections are only parsed when a stage touches them.
+    """
+    state = _get_state_log(run_dir).load(lazy=lazy)
+    state["run_dir"] = run_dir
+    return state
 
-def load_state() -> dict:
-    """Load pipeline state from disk."""
-    with open(STATE_FILE, "r", encoding="utf-8") as f:
-        return json.load(f)
+
+_results_store: ResultsStore | None = None
+
+
+def get_results_store(state: dict) -> ResultsStore:
+    """Open the shared results store, backfilling this run if the state
+    predates it (resumed older runs)."""
+    global _results_store
+    if _results_store is None:
+        _results_store = ResultsStore(RESULTS_DB)
+    if "run_id" not in state:
+        state["run_id"] = new_run_id(state["cancer_type"])
+    if state["all_docking_results"] and not _results_store.count(state["run_id"]):
+        _results_store.add_results(state["run_id"], state["all_docking_results"])
+    return _results_store
 
 
 # ---------------------------------------------------------------------------
@@ -143,77 +248,51 @@ def stage_literature(state: dict) -> dict:
     print(f"  Stage 1: Literature Review — {cancer_type}")
     print(f"{'='*60}\n")
 
-    # Search arXiv
-    print(">> Searching arXiv for cancer papers …")
-    cancer_papers = search_arxiv(build_cancer_query(cancer_type))
-    cancer_papers_text = format_papers_for_prompt(cancer_papers)
-
-    # Generate literature review via Perplexity
-    print(">> Generating literature review …")
-    system_review = (
-        "You are an expert oncology researcher. Write a detailed, scholarly "
-        "literature review in Markdown format. Use inline citations like "
-        "[1], [2], etc., referencing the papers provided."
-    )
-    user_review = (
-        f"Using the following arXiv papers, write a comprehensive literature "
-        f"review about **{cancer_type}**.\n\n"
-        f"Include:\n"
-        f"1. Introduction (epidemiology, significance)\n"
-        f"2. Molecular and genetic landscape\n"
-        f"3. **Key protein targets** for treatment\n"
-        f"4. Current therapeutic strategies\n"
-        f"5. References\n\n"
-        f"Papers:\n{cancer_papers_text}"
-    )
-    first_review = query_perplexity(system_review, user_review)
-
-    # Extract protein targets
-    print(">> Extracting protein targets …")
-    proteins = extract_proteins_from_text(first_review)
-    if not proteins:
-        proteins = ["EGFR", "p53", "KRAS"]
-        print(f"    (Using fallback: {proteins})")
-    print(f"    Targets: {proteins}")
-
-    # Search for drug papers
-    time.sleep(3)
-    print(">> Searching arXiv for drug papers …")
-    drug_papers = search_arxiv(build_drug_query(cancer_type, proteins))
-    time.sleep(3)
-    repurpose_papers = search_arxiv(build_repurposing_query(proteins))
-
-    # Dedup
-    seen_ids = {p["arxiv_id"] for p in drug_papers}
-    for rp in repurpose_papers:
-        if rp["arxiv_id"] not in seen_ids:
-            drug_papers.append(rp)
-            seen_ids.add(rp["arxiv_id"])
-
-    drug_papers_text = format_papers_for_prompt(drug_papers) if drug_papers else "(No papers found.)"
-
-    # Generate drug section
-    print(">> Generating drug analysis …")
-    offset = len(cancer_papers)
-    system_drugs = (
-        "You are an expert pharmacology researcher. Write a detailed Markdown "
-        "section about FDA-approved drugs and repurposing candidates. "
-        "Be precise about drug names, mechanisms, and protein interactions."
-    )
-    user_drugs = (
-        f"Continue the review on **{cancer_type}**.\n\n"
-        f"Protein targets: {', '.join(proteins)}.\n\n"
-        f"Write sections on:\n"
-        f"1. FDA-Approved Drugs and Candidate Compounds per target\n"
-        f"2. Drug-Protein Interaction Summary Table\n"
-        f"3. Conclusion and Future Directions\n\n"
-        f"Papers:\n{drug_papers_text}"
-    )
-    drug_review = query_perplexity(system_drugs, user_drugs)
+    def write_first_review(cancer_papers):
+        cancer_papers_text = format_papers_for_prompt(cancer_papers)
+        system_review = (
+            "You are an expert oncology researcher. Write a detailed, scholarly "
+            "literature review in Markdown format. Use inline citations like "
+            "[1], [2], etc., referencing the papers provided."
+        )
+        user_review = (
+            f"Using the following arXiv papers, write a comprehensive literature "
+            f"review about **{cancer_type}**.\n\n"
+            f"Include:\n"
+            f"1. Introduction (epidemiology, significance)\n"
+            f"2. Molecular and genetic landscape\n"
+            f"3. **Key protein targets** for treatment\n"
+            f"4. Current therapeutic strategies\n"
+            f"5. References\n\n"
+            f"Papers:\n{cancer_papers_text}"
+        )
+        return query_perplexity(system_review, user_review)
+
+    def write_drug_review(proteins, cancer_papers, drug_papers):
+        drug_papers_text = format_papers_for_prompt(drug_papers) if drug_papers else "(No papers found.)"
+        system_drugs = (
+            "You are an expert pharmacology researcher. Write a detailed Markdown "
+            "section about FDA-approved drugs and repurposing candidates. "
+            "Be precise about drug names, mechanisms, and protein interactions."
+        )
+        user_drugs = (
+            f"Continue the review on **{cancer_type}**.\n\n"
+            f"Protein targets: {', '.join(proteins)}.\n\n"
+            f"Write sections on:\n"
+            f"1. FDA-Approved Drugs and Candidate Compounds per target\n"
+            f"2. Drug-Protein Interaction Summary Table\n"
+            f"3. Conclusion and Future Directions\n\n"
+            f"Papers:\n{drug_papers_text}"
+        )
+        return query_perplexity(system_drugs, user_drugs)
 
-    # Repurposing candidates
-    print(">> Searching for repurposing candidates …")
-    repurposing_review = _discover_repurposing_candidates(cancer_type, proteins)
+    # The repurposing discovery overlaps the follow-up arXiv searches;
+    # search_arxiv spaces arXiv requests itself.
+    lit = run_literature_graph(cancer_type, write_first_review, write_drug_review)
+    proteins, drug_map = lit["proteins"], lit["drug_map"]
+    cancer_papers, drug_papers = lit["cancer_papers"], lit["drug_papers"]
+    first_review, drug_review = lit["first_review"], lit["drug_review"]
+    repurposing_review = lit["repurposing_review"]
 
     # Assemble review markdown
     all_papers = cancer_papers + drug_papers
@@ -228,15 +307,10 @@ def stage_literature(state: dict) -> dict:
         f"## Consolidated References\n\n{references_block}\n"
     )
 
-    with open("review.md", "w", encoding="utf-8") as f:
+    with open(artifact_path(state, REVIEW_MD), "w", encoding="utf-8") as f:
         f.write(review_md)
 
-    # Extract drug-protein map
-    print(">> Extracting drug-protein map …")
-    combined = drug_review + "\n\n" + repurposing_review
-    drug_map = _extract_drug_protein_map(combined, cancer_type, proteins)
-
-    with open("review.json", "w", encoding="utf-8") as f:
+    with open(artifact_path(state, REVIEW_JSON), "w", encoding="utf-8") as f:
         json.dump(drug_map, f, indent=2, ensure_ascii=False)
 
     # Update state
@@ -254,12 +328,15 @@ def stage_literature(state: dict) -> dict:
 # Stage 2: Structure retrieval
 # ---------------------------------------------------------------------------
 
-def stage_structure(state: dict, extra_ligands: dict | None = None) -> dict:
+def stage_structure(state: dict, extra_ligands: dict | None = None,
+                    on_target=None) -> dict:
     """Retrieve PDB structures and drug SMILES.
 
     extra_ligands: optional dict mapping protein name → list of
       {"name": str, "smiles": str, "mechanism": str, "source": str}
       from expansion rounds.
+    on_target: optional callback invoked with each target as soon as it is
+      ready (including targets kept from an interrupted run).
     """
     cancer_type = state["cancer_type"]
     proteins = state["protein_targets"]
@@ -269,9 +346,19 @@ def stage_structure(state: dict, extra_ligands: dict | None = None) -> dict:
     print(f"  Stage 2: Structure Retrieval")
     print(f"{'='*60}\n")
 
-    targets = []
+    # Per-protein checkpoint: targets retrieved before an interruption are
+    # kept and their proteins skipped.
+    targets = list(state.get("targets") or []) if state["status"] == "literature_complete" else []
+    done = {t["protein"] for t in targets}
+    state["targets"] = targets
 
     for protein in proteins:
+        if protein in done:
+            print(f"  {protein}: already retrieved, skipping")
+            if on_target:
+                on_target(next(t for t in targets if t["protein"] == protein))
+            continue
+
         print(f"\n{'─'*40}")
         print(f"  Processing: {protein}")
         print(f"{'─'*40}\n")
@@ -308,7 +395,8 @@ def stage_structure(state: dict, extra_ligands: dict | None = None) -> dict:
             })
 
         # Discover bioactive compounds
-        extra = search_compounds_for_target(protein, max_compounds=50)
+        extra = search_compounds_for_target(
+            protein, max_compounds=state.get("max_compounds", MAX_COMPOUNDS_PER_TARGET))
         existing_smiles = {l["smiles"] for l in ligands if l["smiles"]}
         for c in extra:
             if c["smiles"] and c["smiles"] not in existing_smiles:
@@ -331,21 +419,27 @@ def stage_structure(state: dict, extra_ligands: dict | None = None) -> dict:
         # Drop empty SMILES
         ligands = [l for l in ligands if l["smiles"]]
 
-        targets.append({
+        target = {
             "protein": protein,
             "pdb_id": pdb_id,
             "pdb_file": pdb_file,
             "ligands": ligands,
-        })
+        }
+        with _save_lock:
+            targets.append(target)
+            save_state(state)
 
         print(f"  >> {protein}: PDB={pdb_id}, {len(ligands)} ligands")
+        if on_target:
+            on_target(target)
 
-    state["targets"] = targets
-    state["status"] = "structures_complete"
-    save_state(state)
+    with _save_lock:
+        state["targets"] = targets
+        state["status"] = "structures_complete"
+        save_state(state)
 
     # Also write agent2_output.json for compatibility
-    with open("agent2_output.json", "w", encoding="utf-8") as f:
+    with open(artifact_path(state, AGENT2_OUTPUT), "w", encoding="utf-8") as f:
         json.dump({"cancer_type": cancer_type, "targets": targets}, f, indent=2)
 
     return state
@@ -355,101 +449,215 @@ def stage_structure(state: dict, extra_ligands: dict | None = None) -> dict:
 # Stage 3: Docking
 # ---------------------------------------------------------------------------
 
+def _dock_target(state: dict, target: dict, progress: dict, chunk_records: list,
+                 pose_store: PoseStore, store: ResultsStore):
+    """Dock one target for the round in progress and checkpoint its results."""
+    protein = target["protein"]
+    pdb_file = target.get("pdb_file")
+    ligands = target.get("ligands", [])
+    round_num = progress["round"]
+
+    if protein in progress["done"]:
+        print(f"  {protein}: already docked in round {round_num}, skipping")
+        return
+
+    if not pdb_file or not os.path.exists(pdb_file):
+        print(f"  WARNING: No PDB file for {protein}, skipping")
+        return
+
+    dock_ligands = [
+        {"name": l["name"], "smiles": l["smiles"]}
+        for l in ligands if l.get("smiles")
+    ]
+
+    if not dock_ligands:
+        print(f"  WARNING: No ligands for {protein}, skipping")
+        return
+
+    options = dict(state.get("docking_options", {}))
+    if options.get("prescreen_samples"):
+        # Literature drugs are the point of the study — never let the
+        # pre-screen cut them.
+        literature_drugs = {d.get("drug") for d in state.get("drugs", [])}
+        options["always_full"] = {
+            l["name"] for l in dock_ligands if l["name"] in literature_drugs
+        }
+
+    print(f"\n  Docking {len(dock_ligands)} ligands against {protein} …")
+    # Ligands cut at the pre-screen are kept too (ranked after the full
+    # tier) so that they count as docked and are not picked again
+    prescreen_only = []
+    results, elapsed = run_docking(
+        protein_pdb_path=pdb_file,
+        ligands=dock_ligands,
+        telemetry=chunk_records,
+        telemetry_tags={"protein": protein, "round": round_num},
+        telemetry_file=artifact_path(state, TELEMETRY_FILE),
+        prescreen_only=prescreen_only,
+        **options,
+    )
+    results = results + prescreen_only
+
+    # Merge metadata back
+    ligand_meta = {l["name"]: l for l in ligands}
+    for r in results:
+        meta = ligand_meta.get(r["name"], {})
+        r["mechanism"] = meta.get("mechanism", "")
+        r["fda_status"] = meta.get("fda_status", "")
+        r["source"] = meta.get("source", "")
+        r["smiles"] = meta.get("smiles", "")
+        r["protein_target"] = protein
+        r["pdb_id"] = target.get("pdb_id", "")
+        r["round"] = round_num
+    offload_poses(results, pose_store)
+
+    # Checkpoint this target
+    with _save_lock:
+        store.add_results(state["run_id"], results)
+        state["all_docking_results"].extend(results)
+        progress["done"].append(protein)
+        save_state(state)
+
+    print(f"  Top 5 for {protein}:")
+    for i, r in enumerate(results[:5]):
+        print(f"    {i+1}. {r['name'][:40]:40s} score={r['confidence_score']:.4f}")
+
+
+def _record_round_telemetry(state: dict, round_num: int, chunk_records: list):
+    if not chunk_records:
+        return
+    summary = summarize_chunks(chunk_records)
+    summary["round"] = round_num
+    state.setdefault("docking_telemetry", []).append(summary)
+    print()
+    print(format_summary(summary, f"Round {round_num} telemetry"))
+
+
+def _round_progress(state: dict, round_num: int,
+                    targets_to_dock: list[dict] | None = None) -> dict:
+    progress = state.get("docking_progress") or {}
+    if progress.get("round") != round_num:
+        progress = {
+            "round": round_num,
+            # Expansion targets exist only in memory — keep them for resume
+            "targets": targets_to_dock,
+            "done": [],
+        }
+    state["docking_progress"] = progress
+    return progress
+
+
 def stage_docking(state: dict, targets_to_dock: list[dict] | None = None) -> dict:
-    """Run DiffDock on all targets (or a subset for expansion rounds)."""
+    """Run DiffDock on all targets (or a subset for expansion rounds).
+
+    Each docked target is checkpointed: its results are committed to the
+    state and docking_progress records it as done, so resuming an
+    interrupted round only docks the remaining targets.
+    """
     targets = targets_to_dock or state["targets"]
     round_num = state["round"]
 
+    progress = _round_progress(state, round_num, targets_to_dock)
+    state["status"] = f"docking_round_{round_num}_in_progress"
+
     print(f"\n{'='*60}")
     print(f"  Stage 3: DiffDock Docking — Round {round_num}")
     print(f"{'='*60}\n")
 
-    round_results = []
+    chunk_records = []
+    pose_store = PoseStore(artifact_path(state, state.get("pose_pack", POSE_PACK_FILE)))
+    store = get_results_store(state)
 
     for target in targets:
-        protein = target["protein"]
-        pdb_file = target.get("pdb_file")
-        ligands = target.get("ligands", [])
+        _dock_target(state, target, progress, chunk_records, pose_store, store)
 
-        if not pdb_file or not os.path.exists(pdb_file):
-            print(f"  WARNING: No PDB file for {protein}, skipping")
-            continue
+    _record_round_telemetry(state, round_num, chunk_records)
 
-        dock_ligands = [
-            {"name": l["name"], "smiles": l["smiles"]}
-            for l in ligands if l.get("smiles")
-        ]
+    state["docking_progress"] = None
+    state["status"] = f"docking_round_{round_num}_complete"
+    save_state(state)
 
-        if not dock_ligands:
-            print(f"  WARNING: No ligands for {protein}, skipping")
-            continue
+    # Write agent3_output.json for compatibility
+    _write_docking_output(state)
 
-        print(f"\n  Docking {len(dock_ligands)} ligands against {protein} …")
-        results, elapsed = run_docking(
-            protein_pdb_path=pdb_file,
-            ligands=dock_ligands,
-        )
+    return state
 
-        # Merge metadata back
-        ligand_meta = {l["name"]: l for l in ligands}
-        for r in results:
-            meta = ligand_meta.get(r["name"], {})
-            r["mechanism"] = meta.get("mechanism", "")
-            r["fda_status"] = meta.get("fda_status", "")
-            r["source"] = meta.get("source", "")
-            r["protein_target"] = protein
-            r["pdb_id"] = target.get("pdb_id", "")
-            r["round"] = round_num
 
-        round_results.extend(results)
+def stage_structure_pipelined(state: dict) -> dict:
+    """Stage 2 with round-1 docking overlapped.
 
-        print(f"  Top 5 for {protein}:")
-        for i, r in enumerate(results[:5]):
-            print(f"    {i+1}. {r['name'][:40]:40s} score={r['confidence_score']:.4f}")
+    Each target is handed to a docking worker as soon as its structure and
+    ligand list are ready, so network-bound retrieval of later proteins runs
+    alongside docking of earlier ones.  The docking stage that follows
+    finds these targets done and only finalizes the round.
+    """
+    state["round"] = 1
+    progress = _round_progress(state, 1)
+    chunk_records = []
+    pose_store = PoseStore(artifact_path(state, state.get("pose_pack", POSE_PACK_FILE)))
+    store = get_results_store(state)
+
+    with ThreadPoolExecutor(max_workers=PIPELINED_DOCKING_WORKERS) as pool:
+        futures = []
+
+        def submit(target):
+            if target["protein"] not in progress["done"]:
+                futures.append(pool.submit(
+                    _dock_target, state, target, progress, chunk_records,
+                    pose_store, store,
+                ))
+
+        stage_structure(state, on_target=submit)
+        for fut in futures:
+            fut.result()  # surface docking failures
+
+    with _save_lock:
+        _record_round_telemetry(state, 1, chunk_records)
+        save_state(state)
+    return state
 
-    state["all_docking_results"].extend(round_results)
-    state["status"] = f"docking_round_{round_num}_complete"
-    save_state(state)
 
-    # Write agent3_output.json for compatibility
-    _write_docking_output(state)
+_rankings: dict[str, Rankings] = {}
 
-    return state
+
+def get_rankings(state: dict) -> Rankings:
+    """Per-target rankings for this run, caught up with all_docking_results.
+
+    Built once per process (e.g. after a resume); afterwards each call only
+    merges the results appended since the previous one.
+    """
+    run_dir = state.get("run_dir", ".")
+    rankings = _rankings.setdefault(run_dir, Rankings())
+    rankings.sync(state["all_docking_results"])
+    return rankings
 
 
 def _write_docking_output(state: dict):
-    """Write agent3_output.json from accumulated results."""
-    results_by_protein = {}
-    for r in state["all_docking_results"]:
-        prot = r.get("protein_target", "unknown")
-        results_by_protein.setdefault(prot, []).append(r)
+    """Write agent3_output.json from the per-target rankings."""
+    rankings = get_rankings(state)
 
     target_entries = []
     for target in state["targets"]:
         protein = target["protein"]
-        results = results_by_protein.get(protein, [])
-        results.sort(key=lambda x: x.get("confidence_score", 0), reverse=True)
         target_entries.append({
             "protein": protein,
             "pdb_id": target.get("pdb_id"),
             "pdb_file": target.get("pdb_file"),
             "status": "completed",
             "num_ligands_total": len(target.get("ligands", [])),
-            "num_ligands_docked": len(results),
+            "num_ligands_docked": len(rankings.get(protein)),
             "docking_time_seconds": 0,
-            "results": results,
         })
 
-    output = {
+    header = {
         "cancer_type": state["cancer_type"],
         "status": "completed",
         "completed_targets": len(target_entries),
         "total_targets": len(target_entries),
         "total_docking_time_seconds": 0,
-        "targets": target_entries,
     }
-    with open("agent3_output.json", "w", encoding="utf-8") as f:
-        json.dump(output, f, indent=2, ensure_ascii=False)
+    write_docking_output(artifact_path(state, AGENT3_OUTPUT), header,
+                         target_entries, rankings)
 
 
 # ---------------------------------------------------------------------------
@@ -469,11 +677,10 @@ def analyze_and_decide(state: dict) -> dict:
     """
     cancer_type = state["cancer_type"]
     round_num = state["round"]
-    results = state["all_docking_results"]
     hypotheses = state["hypotheses"]
 
     # Build a summary of top results for the prompt
-    top_results = sorted(results, key=lambda x: x.get("confidence_score", 0), reverse=True)[:30]
+    top_results = get_results_store(state).top_k(state["run_id"], 30)
     results_summary = []
     for r in top_results:
         results_summary.append({
@@ -523,7 +730,7 @@ def analyze_and_decide(state: dict) -> dict:
     print(f"{'='*60}\n")
     print(">> Asking Perplexity to analyze results …")
 
-    raw = query_perplexity(system, user)
+    raw = query_perplexity(system, user, purpose="decision")
     decision = _parse_json_response(raw)
 
     # Ensure required fields
@@ -565,25 +772,14 @@ def execute_expansion(state: dict, decision: dict) -> dict:
     print(f"{'='*60}\n")
 
     new_ligands_by_protein = {}  # protein → [ligand dicts]
+    store = get_results_store(state)
+    run_id = state["run_id"]
 
     if action == "expand_3d_similar":
         seed_cids = decision.get("seed_cids", [])
         if not seed_cids:
             # Fall back to top-scoring compounds that have CIDs
-            for r in sorted(
-                state["all_docking_results"],
-                key=lambda x: x.get("confidence_score", 0),
-                reverse=True,
-            ):
-                src = r.get("source", "")
-                if src.startswith("pubchem_cid_"):
-                    try:
-                        cid = int(src.split("_")[-1])
-                        seed_cids.append(cid)
-                    except ValueError:
-                        pass
-                if len(seed_cids) >= 5:
-                    break
+            seed_cids = store.seed_cids(run_id, 5)
 
         print(f"  Expanding 3D similarity for CIDs: {seed_cids}")
         for cid in seed_cids:
@@ -614,7 +810,8 @@ def execute_expansion(state: dict, decision: dict) -> dict:
                 "FDA-approved drug names (generic names). No explanation.",
                 f"List 10 FDA-approved drugs in the class: {drug_class}. "
                 f"Exclude any already in this list: "
-                f"{[r['name'] for r in state['all_docking_results'][:20]]}",
+                f"{[r['name'] for r in store.top_k(run_id, 20)]}",
+                purpose="class_members",
             )
             try:
                 match = re.search(r"\[.*?\]", raw, re.DOTALL)
@@ -638,6 +835,19 @@ def execute_expansion(state: dict, decision: dict) -> dict:
                 for protein in state["protein_targets"]:
                     new_ligands_by_protein.setdefault(protein, []).append(lig)
 
+    # Drop compounds already docked against that protein in this run
+    skipped = 0
+    for protein, ligs in new_ligands_by_protein.items():
+        fresh = [
+            l for l in ligs
+            if not store.is_docked(run_id, protein, smiles=l["smiles"], name=l["name"])
+        ]
+        skipped += len(ligs) - len(fresh)
+        new_ligands_by_protein[protein] = fresh
+    new_ligands_by_protein = {p: l for p, l in new_ligands_by_protein.items() if l}
+    if skipped:
+        print(f"  Skipped {skipped} protein/compound pairs already docked")
+
     # Count new compounds
     total_new = sum(len(v) for v in new_ligands_by_protein.values())
     print(f"\n  >> Added {total_new} new ligands across {len(new_ligands_by_protein)} targets")
@@ -679,7 +889,11 @@ def stage_report(state: dict) -> dict:
 
     # Load docking data from the file we wrote
     from results import load_docking_data
-    data = load_docking_data("agent3_output.json")
+    data = load_docking_data(artifact_path(state, AGENT3_OUTPUT))
+
+    # Columnar copy for cross-run analytics, now that docking is final
+    write_columns({**data, "run_id": state.get("run_id", "")},
+                  artifact_path(state, COLUMNS_FILE))
 
     target_summaries = [summarise_target(t) for t in data.get("targets", [])]
     overview = build_overview_block(data, target_summaries)
@@ -702,19 +916,14 @@ def stage_report(state: dict) -> dict:
                 f"- Rationale: {exp['rationale']}\n\n"
             )
 
-    print(">> Generating Methodology …")
-    methodology = generate_methodology(cancer_type, overview)
-
-    print(">> Generating Results …")
-    results_text = generate_results(cancer_type, overview, classified)
-
-    print(">> Generating Conclusion …")
-    conclusion = generate_conclusion(cancer_type, overview, classified)
+    print(">> Generating Methodology, Results and Conclusion …")
+    sections = generate_report_sections(cancer_type, overview, classified,
+                                        progress=_stream_progress(state))
 
     # Strip duplicate headers
-    methodology = _strip_leading_header(methodology)
-    results_text = _strip_leading_header(results_text)
-    conclusion = _strip_leading_header(conclusion)
+    methodology = _strip_leading_header(sections["methodology"])
+    results_text = _strip_leading_header(sections["results"])
+    conclusion = _strip_leading_header(sections["conclusion"])
 
     today = datetime.now().strftime("%B %d, %Y")
     results_md = (
@@ -726,7 +935,7 @@ def stage_report(state: dict) -> dict:
         f"## Conclusion\n\n{conclusion}\n"
     )
 
-    with open("results.md", "w", encoding="utf-8") as f:
+    with open(artifact_path(state, RESULTS_MD), "w", encoding="utf-8") as f:
         f.write(results_md)
 
     state["results_md"] = results_md
@@ -748,41 +957,23 @@ def stage_paper(state: dict) -> dict:
     results_md = state.get("results_md", "")
 
     if not review_md:
-        with open("review.md", "r") as f:
+        with open(artifact_path(state, REVIEW_MD), "r") as f:
             review_md = f.read()
     if not results_md:
-        with open("results.md", "r") as f:
+        with open(artifact_path(state, RESULTS_MD), "r") as f:
             results_md = f.read()
 
-    # Extract sections
-    review_intro = _get_review_intro_sections(review_md)
-    review_drugs = _get_review_drug_sections(review_md)
-    review_conclusion = _get_review_conclusion(review_md)
-    results_methodology = _get_results_methodology(results_md)
-    results_body = _get_results_body(results_md)
-    results_conclusion = _get_results_conclusion(results_md)
     review_refs = _extract_references(review_md)
+    methodology = _strip_leading_header(_get_results_methodology(results_md))
 
-    print(">> Generating abstract …")
-    abstract = _strip_leading_header(generate_abstract(review_md, results_md))
-
-    print(">> Merging Introduction …")
-    intro = _strip_leading_header(
-        merge_introduction_and_background(review_intro, results_md)
-    )
-
-    print(">> Merging Therapeutic Landscape …")
-    landscape = _strip_leading_header(merge_drug_landscape(review_drugs))
-
-    methodology = _strip_leading_header(results_methodology)
-
-    print(">> Merging Results …")
-    docking_results = _strip_leading_header(merge_results_section(results_body))
-
-    print(">> Merging Conclusions …")
-    conclusion = _strip_leading_header(
-        merge_conclusions(review_conclusion, results_conclusion)
-    )
+    print(">> Generating abstract and merging sections …")
+    sections = generate_paper_sections(review_md, results_md,
+                                       progress=_stream_progress(state))
+    abstract = sections["abstract"]
+    intro = sections["intro"]
+    landscape = sections["landscape"]
+    docking_results = sections["results"]
+    conclusion = sections["conclusion"]
 
     unified_refs = _deduplicate_references(review_refs, "")
 
@@ -800,14 +991,14 @@ def stage_paper(state: dict) -> dict:
         f"## References\n\n{unified_refs}\n"
     )
 
-    with open("final_paper.md", "w", encoding="utf-8") as f:
+    with open(artifact_path(state, FINAL_PAPER_MD), "w", encoding="utf-8") as f:
         f.write(final_md)
 
     state["final_paper_md"] = final_md
     state["status"] = "complete"
     save_state(state)
 
-    print(f"\n  >> Final paper: final_paper.md ({len(final_md):,} chars)")
+    print(f"\n  >> Final paper: {artifact_path(state, FINAL_PAPER_MD)} ({len(final_md):,} chars)")
     return state
 
 
@@ -815,107 +1006,271 @@ def stage_paper(state: dict) -> dict:
 # Main orchestrator
 # ---------------------------------------------------------------------------
 
-def run_pipeline(cancer_type: str, max_rounds: int = MAX_EXPANSION_ROUNDS):
-    """Run the full autonomous pipeline."""
-    state = new_state(cancer_type)
+def _stage_structures(state: dict) -> dict:
+    if state.get("pipelined"):
+        return stage_structure_pipelined(state)
+    return stage_structure(state)
 
-    print(f"\n{'#'*60}")
-    print(f"  Autonomous Drug Discovery Pipeline")
-    print(f"  Target: {cancer_type}")
-    print(f"  Max expansion rounds: {max_rounds}")
-    print(f"{'#'*60}\n")
 
-    # Stage 1: Literature
-    state = stage_literature(state)
+def _stage_first_docking_round(state: dict) -> dict:
+    state["round"] = 1
+    return stage_docking(state)
 
-    # Stage 2: Structure retrieval
-    state = stage_structure(state)
 
-    # Stage 3: First docking round
-    state["round"] = 1
-    state = stage_docking(state)
+def _stage_reasoning(state: dict) -> dict:
+    """Reasoning loop: analyze, expand and re-dock up to max_rounds times."""
+    progress = state.get("docking_progress") or {}
+    if progress.get("round", 0) > 1:
+        # An expansion round was interrupted — finish it first
+        state = stage_docking(state, targets_to_dock=progress.get("targets"))
 
-    # Stage 4: Reasoning loop
-    for _ in range(max_rounds):
+    max_rounds = state.get("max_rounds", MAX_EXPANSION_ROUNDS)
+    for _ in range(max_rounds - (state["round"] - 1)):
         decision = analyze_and_decide(state)
 
         if decision["action"] == "proceed":
             print("\n  >> Reasoning decided: proceed to synthesis")
             break
 
-        # Execute expansion and re-dock
+        # Execute expansion and re-dock; the loop then analyzes again
         state = execute_expansion(state, decision)
+    return state
+
+
+def _stage_report(state: dict) -> dict:
+    # Rewrite agent3_output.json with the current schema before the report
+    _write_docking_output(state)
+    return stage_report(state)
+
+
+def _reset_structures(state: dict):
+    state["targets"] = []
+    if state.get("pipelined"):
+        # Round 1 is docked while structures are retrieved
+        _reset_docking(state)
+
+
+def _reset_docking(state: dict):
+    progress = state.get("docking_progress") or {}
+    if state.get("pipelined") and progress.get("round") == 1:
+        return  # docked by the structures stage of this execution
+    get_results_store(state).delete_run(state["run_id"])
+    _rankings.pop(state.get("run_dir", "."), None)
+    state["all_docking_results"] = []
+    state["docking_telemetry"] = []
+    state["docking_progress"] = None
+    state["round"] = 0
+
+
+def _reset_reasoning(state: dict):
+    """Drop expansion rounds, keeping the first docking round."""
+    get_results_store(state).delete_run(state["run_id"], min_round=2)
+    _rankings.pop(state.get("run_dir", "."), None)
+    state["all_docking_results"] = [
+        r for r in state["all_docking_results"] if r.get("round", 1) == 1
+    ]
+    state["docking_telemetry"] = [
+        t for t in state.get("docking_telemetry", []) if t.get("round") == 1
+    ]
+    state["docking_progress"] = None
+    state["hypotheses"] = []
+    state["expansion_history"] = []
+    state["round"] = 1
 
-        # Analyze again after expansion
-        # (the loop continues and will call analyze_and_decide again)
 
-    # Stage 5: Report
-    state = stage_report(state)
+PIPELINE_STAGES = StageGraph([
+    Stage("literature", stage_literature, params=("cancer_type",),
+          outputs=(REVIEW_MD, REVIEW_JSON)),
+    Stage("structures", _stage_structures, deps=("literature",),
+          params=("max_compounds", "pipelined"), reset=_reset_structures,
+          outputs=(AGENT2_OUTPUT,)),
+    Stage("docking", _stage_first_docking_round, deps=("structures",),
+          params=("docking_options",), reset=_reset_docking),
+    Stage("reasoning", _stage_reasoning, deps=("docking",),
+          params=("max_rounds",), reset=_reset_reasoning),
+    Stage("report", _stage_report, deps=("reasoning",),
+          outputs=(AGENT3_OUTPUT, RESULTS_MD)),
+    Stage("paper", stage_paper, deps=("report",), outputs=(FINAL_PAPER_MD,)),
+])
+# Tag every LLM call in the ledger with the stage that made it
+for _stage in PIPELINE_STAGES.stages.values():
+    _stage.run = with_llm_tags(_stage.run, stage=_stage.name)
+
+
+def _completed_stages_from_status(state) -> list[str]:
+    """Stages a state written before the DAG executor had completed."""
+    status = state.get("status", "")
+    order = PIPELINE_STAGES.order
+    if status == "complete":
+        n = 6
+    elif status == "report_complete":
+        n = 5
+    elif status.endswith("_in_progress"):
+        n = 3 if state.get("round", 1) > 1 else 2
+    elif status.startswith("docking_round_"):
+        n = 4  # older runs went straight from docking to the report
+    elif status == "structures_complete":
+        n = 2
+    elif status == "literature_complete":
+        n = 1
+    else:
+        n = 0
+    return order[:n]
 
-    # Stage 6: Paper
-    state = stage_paper(state)
 
-    # Final summary
-    total_compounds = len(state["all_docking_results"])
-    total_rounds = state["round"]
+def _print_summary(state):
     print(f"\n{'#'*60}")
     print(f"  Pipeline Complete")
-    print(f"  Cancer type:     {cancer_type}")
-    print(f"  Docking rounds:  {total_rounds}")
-    print(f"  Total compounds: {total_compounds}")
+    print(f"  Cancer type:     {state['cancer_type']}")
+    print(f"  Docking rounds:  {state['round']}")
+    print(f"  Total compounds: {len(state['all_docking_results'])}")
     print(f"  Hypotheses:      {len(state['hypotheses'])}")
-    print(f"  Output:          final_paper.md")
+    usage = get_client().usage_summary()
+    if usage["calls"]:
+        print(f"  LLM calls:       {usage['calls']} ({usage['total_tokens']:,} tokens, "
+              f"{usage['latency_seconds']:.0f}s, {usage['retries']} retries)")
+    if usage["cache_hits"]:
+        print(f"  LLM cache hits:  {usage['cache_hits']} "
+              f"({usage['tokens_saved']:,} tokens saved)")
+    print(f"  Output:          {artifact_path(state, FINAL_PAPER_MD)}")
+    print(f"{'#'*60}\n")
+    calls = load_records(artifact_path(state, LEDGER_FILE))
+    if calls:
+        print(format_table(summarize_calls(calls), title="LLM calls by stage (this run)"))
+        print()
+
+
+def _open_ledger(state: dict):
+    """Record this run's LLM calls in its workspace (appending on resume)."""
+    get_client().ledger_path = artifact_path(state, LEDGER_FILE)
+
+
+def run_pipeline(
+    cancer_type: str,
+    max_rounds: int = MAX_EXPANSION_ROUNDS,
+    docking_options: dict | None = None,
+    runs_dir: str = RUNS_DIR,
+    pipelined: bool = False,
+    max_compounds: int = MAX_COMPOUNDS_PER_TARGET,
+):
+    """Run the full autonomous pipeline in a fresh workspace under runs_dir."""
+    state = new_state(cancer_type, docking_options, max_rounds=max_rounds,
+                      pipelined=pipelined, max_compounds=max_compounds)
+    state["run_dir"] = create_run_dir(state["run_id"], runs_dir)
+    _get_state_log(state["run_dir"]).reset()
+    _open_ledger(state)
+
+    print(f"\n{'#'*60}")
+    print(f"  Autonomous Drug Discovery Pipeline")
+    print(f"  Target: {cancer_type}")
+    print(f"  Run:    {state['run_dir']}")
+    print(f"  Max expansion rounds: {max_rounds}")
     print(f"{'#'*60}\n")
 
+    state = PIPELINE_STAGES.execute(state, on_complete=save_state)
+    _print_summary(state)
     return state
 
 
-def resume_pipeline():
-    """Resume from the last saved state."""
-    if not os.path.exists(STATE_FILE):
-        print(f"ERROR: No state file found ({STATE_FILE})", file=sys.stderr)
+def _override_parameters(state: dict, max_rounds: int | None,
+                         docking_options: dict | None,
+                         max_compounds: int | None = None,
+                         pipelined: bool | None = None):
+    """Apply resume-time overrides; docking options are merged into the
+    saved ones, so passing only --hedge keeps the saved backend etc."""
+    if max_rounds is not None:
+        state["max_rounds"] = max_rounds
+    if max_compounds is not None:
+        state["max_compounds"] = max_compounds
+    if pipelined is not None:
+        state["pipelined"] = pipelined
+    if docking_options:
+        state["docking_options"] = {**(state.get("docking_options") or {}),
+                                    **docking_options}
+
+
+def resume_pipeline(
+    run_id: str | None = None,
+    runs_dir: str = RUNS_DIR,
+    max_rounds: int | None = None,
+    docking_options: dict | None = None,
+    max_compounds: int | None = None,
+    pipelined: bool | None = None,
+):
+    """Resume a run (default: the newest), redoing only out-of-date stages.
+
+    max_rounds / docking_options / max_compounds / pipelined override the
+    run's saved parameters; only the stages that depend on a changed
+    parameter are re-run.
+    """
+    run_dir = find_run_dir(run_id, runs_dir)
+    if run_dir is None:
+        print(f"ERROR: No saved run found ({run_id or runs_dir})", file=sys.stderr)
         sys.exit(1)
 
-    state = load_state()
-    status = state["status"]
-    cancer_type = state["cancer_type"]
+    state = load_state(run_dir, lazy=True)
+    _open_ledger(state)
+    print(f"\n  Resuming pipeline for '{state['cancer_type']}' "
+          f"(status: {state['status']}, run: {run_dir})")
 
-    print(f"\n  Resuming pipeline for '{cancer_type}' (status: {status})")
+    if "max_rounds" not in state:
+        state["max_rounds"] = MAX_EXPANSION_ROUNDS
+    if "stage_fingerprints" not in state:
+        PIPELINE_STAGES.adopt(state, _completed_stages_from_status(state))
+    _override_parameters(state, max_rounds, docking_options, max_compounds, pipelined)
 
-    if status == "literature_complete":
-        state = stage_structure(state)
-        state["round"] = 1
-        state = stage_docking(state)
-        decision = analyze_and_decide(state)
-        if decision["action"] != "proceed":
-            state = execute_expansion(state, decision)
-        state = stage_report(state)
-        state = stage_paper(state)
+    plan = PIPELINE_STAGES.plan(state)
+    if all(action == "skip" for _, action in plan):
+        print("  Pipeline already complete.")
+        return state
 
-    elif "docking" in status:
-        # Rewrite agent3_output.json with correct schema before report
-        _write_docking_output(state)
-        state = stage_report(state)
-        state = stage_paper(state)
+    state = PIPELINE_STAGES.execute(state, on_complete=save_state)
+    _print_summary(state)
+    return state
 
-    elif status == "report_complete":
-        state = stage_paper(state)
 
-    elif status == "complete":
-        print("  Pipeline already complete.")
+def plan_pipeline(state: dict, input_path: str | None = None,
+                  runs_dir: str = RUNS_DIR) -> dict:
+    """Dry run: estimate requests, docking and wall time for the stages
+    that executing ``state`` would run, without calling any service.
 
+    The workload comes from input_path (agent2_output.json or review.json)
+    when given, else from what the state already holds, else from the
+    history of earlier runs.
+    """
+    if input_path:
+        with open(input_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if "targets" in data:
+            workload = workload_from_agent2(data)
+        else:
+            workload = workload_from_review(data)
+        workload["source"] += f" ({input_path})"
+    elif state.get("targets"):
+        workload = workload_from_agent2(state)
+    elif state.get("protein_targets"):
+        workload = workload_from_review(state)
     else:
-        print(f"  Unknown status: {status}. Starting from structures.")
-        state = stage_structure(state)
-        state["round"] = 1
-        state = stage_docking(state)
-        decision = analyze_and_decide(state)
-        if decision["action"] != "proceed":
-            state = execute_expansion(state, decision)
-        state = stage_report(state)
-        state = stage_paper(state)
+        workload = workload_from_history(
+            state["cancer_type"], history(runs_dir, state["cancer_type"]))
+
+    skip = tuple(name for name, action in PIPELINE_STAGES.plan(state) if action == "skip")
+    plan = estimate(
+        workload,
+        max_rounds=state.get("max_rounds", MAX_EXPANSION_ROUNDS),
+        max_compounds=state.get("max_compounds", MAX_COMPOUNDS_PER_TARGET),
+        docking_options=state.get("docking_options"),
+        runs_dir=runs_dir,
+        skip_stages=skip,
+        pipelined=state.get("pipelined", False),
+    )
 
-    return state
+    print(f"\n{'#'*60}")
+    print(f"  Plan: {state['cancer_type']}")
+    print(f"{'#'*60}\n")
+    print(format_plan(plan))
+    print()
+    return plan
 
 
 # ---------------------------------------------------------------------------
@@ -940,15 +1295,174 @@ def main():
     parser.add_argument(
         "--max-rounds",
         type=int,
-        default=MAX_EXPANSION_ROUNDS,
-        help=f"Max expansion rounds (default: {MAX_EXPANSION_ROUNDS}).",
+        default=None,
+        help=f"Max expansion rounds (default: {MAX_EXPANSION_ROUNDS}). With "
+             f"--resume, a new value re-runs only the reasoning and later stages.",
+    )
+    parser.add_argument(
+        "--hedge",
+        type=float,
+        default=None,
+        metavar="MULTIPLIER",
+        help="Resubmit docking chunks slower than MULTIPLIER × the median "
+             "chunk latency (default: off).",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=["runpod", "local"],
+        default=None,
+        help="Docking backend: RunPod DiffDock (default) or local CPU.",
+    )
+    parser.add_argument(
+        "--prescreen-samples",
+        type=int,
+        default=None,
+        help="Progressive docking: pre-screen every ligand with this many "
+             "samples, then re-dock only the best with full sampling.",
+    )
+    parser.add_argument(
+        "--prescreen-top-k",
+        type=int,
+        default=None,
+        help="Ligands per target promoted to full sampling.",
+    )
+    parser.add_argument(
+        "--prescreen-fraction",
+        type=float,
+        default=None,
+        help="Fraction of ligands per target promoted (default: 0.2).",
+    )
+    parser.add_argument(
+        "--prescreen-backend",
+        choices=["runpod", "local"],
+        default=None,
+        help="Backend for the pre-screen tier (e.g. 'local' for a CPU pre-score).",
+    )
+    parser.add_argument(
+        "--samples",
+        type=int,
+        default=None,
+        help="DiffDock samples per complex (default: 10).",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=None,
+        help="Ligands per docking job (default: 10).",
+    )
+    parser.add_argument(
+        "--max-compounds",
+        type=int,
+        default=None,
+        help=f"PubChem bioactive compounds per target (default: {MAX_COMPOUNDS_PER_TARGET}).",
+    )
+    parser.add_argument(
+        "--plan",
+        nargs="?",
+        const="",
+        default=None,
+        metavar="INPUT",
+        help="Dry run: print estimated requests, docking jobs and wall time "
+             "per stage, then exit. INPUT may be a review.json or "
+             "agent2_output.json to size the run from.",
+    )
+    parser.add_argument(
+        "--no-llm-cache",
+        action="store_true",
+        help="Ignore cached Perplexity replies (fresh replies are still cached).",
+    )
+    parser.add_argument(
+        "--pipelined",
+        action="store_true",
+        default=None,
+        help="Dock each target as soon as its structure and ligands are "
+             "retrieved, overlapping stages 2 and 3.",
+    )
+    parser.add_argument(
+        "--run-id",
+        type=str,
+        default=None,
+        help="With --resume: run ID (or run directory) to resume "
+             "(default: the most recent run).",
+    )
+    parser.add_argument(
+        "--runs-dir",
+        type=str,
+        default=RUNS_DIR,
+        help=f"Directory holding per-run workspaces (default: {RUNS_DIR}).",
     )
     args = parser.parse_args()
 
-    if args.resume:
-        resume_pipeline()
+    docking_options = {}
+    if args.samples:
+        docking_options["samples_per_complex"] = args.samples
+    if args.chunk_size:
+        docking_options["chunk_size"] = args.chunk_size
+    if args.hedge:
+        docking_options["hedge_multiplier"] = args.hedge
+    if args.backend:
+        docking_options["backend"] = args.backend
+    if args.prescreen_samples:
+        docking_options.update({
+            "prescreen_samples": args.prescreen_samples,
+            "prescreen_top_k": args.prescreen_top_k,
+            "prescreen_fraction": args.prescreen_fraction,
+            "prescreen_backend": args.prescreen_backend,
+        })
+
+    if args.no_llm_cache:
+        get_client().bypass_cache = True
+    if args.plan is None and (args.resume or args.cancer_type) and not get_client().api_key:
+        print("ERROR: PERPLEXITY_API_KEY environment variable is not set.", file=sys.stderr)
+        sys.exit(1)
+
+    if args.plan is not None:
+        if args.resume:
+            run_dir = find_run_dir(args.run_id, args.runs_dir)
+            if run_dir is None:
+                print(f"ERROR: No saved run found ({args.run_id or args.runs_dir})",
+                      file=sys.stderr)
+                sys.exit(1)
+            state = load_state(run_dir, lazy=True)
+            if "stage_fingerprints" not in state:
+                PIPELINE_STAGES.adopt(state, _completed_stages_from_status(state))
+            _override_parameters(state, args.max_rounds, docking_options,
+                                 args.max_compounds, args.pipelined)
+        else:
+            cancer_type = args.cancer_type
+            if not cancer_type and args.plan and os.path.exists(args.plan):
+                with open(args.plan, "r", encoding="utf-8") as f:
+                    cancer_type = json.load(f).get("cancer_type")
+            if not cancer_type:
+                parser.error("--plan needs a cancer type or an input file")
+            state = new_state(
+                cancer_type,
+                docking_options,
+                max_rounds=args.max_rounds if args.max_rounds is not None else MAX_EXPANSION_ROUNDS,
+                pipelined=bool(args.pipelined),
+                max_compounds=(args.max_compounds if args.max_compounds is not None
+                               else MAX_COMPOUNDS_PER_TARGET),
+            )
+        plan_pipeline(state, input_path=args.plan or None, runs_dir=args.runs_dir)
+    elif args.resume:
+        resume_pipeline(
+            args.run_id,
+            runs_dir=args.runs_dir,
+            max_rounds=args.max_rounds,
+            docking_options=docking_options or None,
+            max_compounds=args.max_compounds,
+            pipelined=args.pipelined,
+        )
     elif args.cancer_type:
-        run_pipeline(args.cancer_type, max_rounds=args.max_rounds)
+        run_pipeline(
+            args.cancer_type,
+            max_rounds=args.max_rounds if args.max_rounds is not None else MAX_EXPANSION_ROUNDS,
+            docking_options=docking_options,
+            runs_dir=args.runs_dir,
+            pipelined=bool(args.pipelined),
+            max_compounds=(args.max_compounds if args.max_compounds is not None
+                           else MAX_COMPOUNDS_PER_TARGET),
+        )
     else:
         parser.print_help()
         sys.exit(1)
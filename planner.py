@@ -0,0 +1,399 @@
+"""
+Dry-run Planner
+
+Estimates what a pipeline run will cost before it starts: external
+requests per stage (arXiv, Perplexity, RCSB, PubChem), docking jobs and
+chunks, GPU-seconds and expected wall time.
+
+The workload (targets, known drugs, ligands per target) comes from the most
+specific source available: an agent2_output.json gives exact ligand
+counts, a review.json gives targets and drugs, and for a bare cancer type
+the averages of earlier runs in the runs directory are used (falling back
+to built-in defaults).  Docking throughput and queue delay come from the
+docking telemetry recorded by earlier runs when there is any.
+
+The estimate is an upper bound for the reasoning stage: every expansion
+round up to max_rounds is assumed to run.
+
+Used by ``python pipeline.py <cancer type> --plan``.
+"""
+
+import glob
+import math
+import os
+
+from agent2 import PDB_DELAY, PUBCHEM_DELAY
+from docking_backends import RunPodBackend, default_backend
+from llm_client import MAX_CONCURRENCY as LLM_CONCURRENCY
+from state_log import StateLog
+from telemetry import TELEMETRY_FILE, load_records, percentile
+from workspace import STATE_FILE, list_runs
+
+# ---------------------------------------------------------------------------
+# Configuration
+# ---------------------------------------------------------------------------
+
+# Request latencies (seconds) when nothing better is known
+REQUEST_SECONDS = {"arxiv": 2.0, "perplexity": 30.0, "rcsb": 0.8, "pubchem": 0.6}
+ARXIV_PAUSE_SECONDS = 3.0  # review.ARXIV_MIN_INTERVAL between arXiv queries
+
+# Docking throughput when there is no telemetry for the backend
+DEFAULT_SECONDS_PER_LIGAND_SAMPLE = {"runpod": 0.6, "local": 2.0}
+DEFAULT_DELAY_SECONDS = {"runpod": 20.0, "local": 0.0}
+
+# Workload when neither an input file nor earlier runs say otherwise
+DEFAULT_PROTEINS = 3
+DEFAULT_DRUGS_PER_PROTEIN = 3
+DEFAULT_COMPOUND_YIELD = 0.8     # fraction of max_compounds PubChem returns
+DEFAULT_EXPANSION_LIGANDS = 30   # new ligands per target per expansion round
+
+# Mechanism tag stage 2 gives PubChem target-search compounds
+BIOACTIVE_MECHANISM = "Bioactive — PubChem target search"
+
+PDB_CANDIDATES = 10        # structures whose metadata pick_best_structure fetches
+PUBCHEM_BATCH = 100        # CIDs per property request
+EXPANSION_SEEDS = 5        # seed CIDs per 3D-similarity expansion
+
+LITERATURE_PERPLEXITY_CALLS = 4   # review, drugs, repurposing, drug map
+REPORT_PERPLEXITY_CALLS = 3       # methodology, results, conclusion
+PAPER_PERPLEXITY_CALLS = 5        # abstract, intro, landscape, results, conclusions
+
+
+# ---------------------------------------------------------------------------
+# Historical rates
+# ---------------------------------------------------------------------------
+
+def telemetry_paths(runs_dir: str) -> list[str]:
+    """Telemetry files of earlier runs (plus a pre-workspace one in .)."""
+    paths = glob.glob(os.path.join(runs_dir, "*", TELEMETRY_FILE))
+    if os.path.exists(TELEMETRY_FILE):
+        paths.append(TELEMETRY_FILE)
+    return paths
+
+
+def docking_rates(paths: list[str], backend: str | None = None) -> dict:
+    """Per-ligand-sample execution time and per-chunk queue delay for a
+    backend (default: DOCKING_BACKEND), measured from telemetry records
+    when there are any."""
+    backend = (backend or default_backend()).lower()
+    records = []
+    for path in paths:
+        records.extend(
+            r for r in load_records(path)
+            if r.get("backend", "runpod") == backend
+            and r.get("status") == "COMPLETED"
+            and not r.get("discarded")
+        )
+
+    work = sum(r.get("n_ligands", 0) * (r.get("samples_per_complex") or 10)
+               for r in records if r.get("execution_seconds") is not None)
+    execution = sum(r["execution_seconds"] for r in records
+                    if r.get("execution_seconds") is not None)
+    delays = [r["delay_seconds"] for r in records if r.get("delay_seconds") is not None]
+
+    if not work:
+        return {
+            "backend": backend,
+            "seconds_per_ligand_sample": DEFAULT_SECONDS_PER_LIGAND_SAMPLE.get(backend, 1.0),
+            "delay_seconds": DEFAULT_DELAY_SECONDS.get(backend, 0.0),
+            "chunks": 0,
+            "source": "defaults",
+        }
+    return {
+        "backend": backend,
+        "seconds_per_ligand_sample": execution / work,
+        "delay_seconds": percentile(delays, 50) or 0.0,
+        "chunks": len(records),
+        "source": f"telemetry ({len(records)} chunks)",
+    }
+
+
+def backend_concurrency(backend: str) -> int:
+    if backend == "local":
+        return os.cpu_count() or 2
+    return RunPodBackend.max_concurrency
+
+
+# ---------------------------------------------------------------------------
+# Workload
+# ---------------------------------------------------------------------------
+
+def workload_from_agent2(data: dict) -> dict:
+    """Exact workload from an agent2_output.json."""
+    return {
+        "cancer_type": data.get("cancer_type", ""),
+        "targets": [
+            {
+                "protein": t["protein"],
+                "drugs": sum(1 for l in t.get("ligands", [])
+                             if l.get("mechanism") != BIOACTIVE_MECHANISM),
+                "ligands": sum(1 for l in t.get("ligands", []) if l.get("smiles")),
+                "pdb_cached": bool(t.get("pdb_file")) and os.path.exists(t["pdb_file"]),
+            }
+            for t in data.get("targets", [])
+        ],
+        "source": "agent2 output",
+    }
+
+
+def workload_from_review(data: dict) -> dict:
+    """Targets and drug counts from a review.json; ligand counts estimated."""
+    proteins = data.get("protein_targets") or sorted(
+        {p for d in data.get("drugs", []) for p in d.get("proteins", [])}
+    )
+    return {
+        "cancer_type": data.get("cancer_type", ""),
+        "targets": [
+            {
+                "protein": p,
+                "drugs": sum(1 for d in data.get("drugs", []) if p in d.get("proteins", [])),
+                "ligands": None,
+                "pdb_cached": False,
+            }
+            for p in proteins
+        ],
+        "source": "review",
+    }
+
+
+def history(runs_dir: str, cancer_type: str | None = None) -> dict:
+    """Averages over earlier runs (the same cancer type when there are
+    any): proteins per run, drugs per protein, PubChem compound yield and
+    expansion ligands per target per round."""
+    states = []
+    for path in list_runs(runs_dir):
+        try:
+            state = StateLog(os.path.join(path, STATE_FILE)).load(lazy=True)
+        except (OSError, ValueError):
+            continue
+        if state.get("targets"):
+            states.append(state)
+    same = [s for s in states if s.get("cancer_type") == cancer_type]
+    states = same or states
+    if not states:
+        return {}
+
+    proteins, drugs, yields, expansion = [], [], [], []
+    for s in states:
+        targets = s["targets"]
+        proteins.append(len(targets))
+        max_compounds = s.get("max_compounds", 50)
+        for t in targets:
+            ligands = t.get("ligands", [])
+            n_drugs = sum(1 for l in ligands if l.get("mechanism") != BIOACTIVE_MECHANISM)
+            drugs.append(n_drugs)
+            if max_compounds:
+                yields.append((len(ligands) - n_drugs) / max_compounds)
+        rounds = s.get("round", 1) - 1
+        if rounds > 0:
+            added = sum(1 for r in s.get("all_docking_results", []) if (r.get("round") or 1) > 1)
+            expansion.append(added / rounds / len(targets))
+
+    def _mean(values, default):
+        return sum(values) / len(values) if values else default
+
+    return {
+        "runs": len(states),
+        "proteins": round(_mean(proteins, DEFAULT_PROTEINS)),
+        "drugs_per_protein": _mean(drugs, DEFAULT_DRUGS_PER_PROTEIN),
+        "compound_yield": _mean(yields, DEFAULT_COMPOUND_YIELD),
+        "expansion_ligands": _mean(expansion, DEFAULT_EXPANSION_LIGANDS),
+    }
+
+
+def workload_from_history(cancer_type: str, hist: dict) -> dict:
+    """Placeholder targets sized from earlier runs (or defaults)."""
+    n = hist.get("proteins", DEFAULT_PROTEINS)
+    drugs = round(hist.get("drugs_per_protein", DEFAULT_DRUGS_PER_PROTEIN))
+    source = f"history ({hist['runs']} runs)" if hist else "defaults"
+    return {
+        "cancer_type": cancer_type,
+        "targets": [
+            {"protein": f"target {i + 1}", "drugs": drugs, "ligands": None,
+             "pdb_cached": False}
+            for i in range(n)
+        ],
+        "source": source,
+    }
+
+
+# ---------------------------------------------------------------------------
+# Estimation
+# ---------------------------------------------------------------------------
+
+def _stage(name: str) -> dict:
+    return {
+        "stage": name,
+        "requests": {"arxiv": 0, "perplexity": 0, "rcsb": 0, "pubchem": 0},
+        "docking_jobs": 0,
+        "chunks": 0,
+        "ligands": 0,
+        "gpu_seconds": 0.0,
+        "wall_seconds": 0.0,
+    }
+
+
+def _add_requests(stage: dict, service: str, n: int, pause: float = 0.0,
+                  concurrency: int = 1):
+    stage["requests"][service] += n
+    waves = math.ceil(n / concurrency)
+    stage["wall_seconds"] += waves * (REQUEST_SECONDS[service] + pause)
+
+
+def _dock(stage: dict, n_ligands: int, samples: int, chunk_size: int, rates: dict):
+    """Account one run_docking tier: chunks dispatched in waves of the
+    backend's concurrency, each wave paying the queue delay."""
+    if n_ligands <= 0:
+        return
+    chunks = math.ceil(n_ligands / chunk_size)
+    per_chunk = min(chunk_size, n_ligands) * samples * rates["seconds_per_ligand_sample"]
+    waves = math.ceil(chunks / backend_concurrency(rates["backend"]))
+    stage["chunks"] += chunks
+    stage["ligands"] += n_ligands
+    stage["gpu_seconds"] += n_ligands * samples * rates["seconds_per_ligand_sample"]
+    stage["wall_seconds"] += waves * (rates["delay_seconds"] + per_chunk)
+
+
+def _dock_target(stage: dict, n_ligands: int, n_drugs: int, options: dict,
+                 rates: dict, prescreen_rates: dict):
+    samples = options.get("samples_per_complex") or 10
+    chunk_size = options.get("chunk_size") or 10
+    stage["docking_jobs"] += 1
+    if not options.get("prescreen_samples"):
+        _dock(stage, n_ligands, samples, chunk_size, rates)
+        return
+    _dock(stage, n_ligands, options["prescreen_samples"], chunk_size, prescreen_rates)
+    promoted = options.get("prescreen_top_k") or math.ceil(
+        n_ligands * (options.get("prescreen_fraction") or 0.2))
+    # Literature drugs always get full sampling
+    _dock(stage, min(n_ligands, promoted + n_drugs), samples, chunk_size, rates)
+
+
+def estimate(workload: dict, max_rounds: int, max_compounds: int = 50,
+             docking_options: dict | None = None, runs_dir: str = "runs",
+             skip_stages: tuple = (), pipelined: bool = False) -> dict:
+    """Per-stage estimate for a run over ``workload``.
+
+    Stages named in ``skip_stages`` (already up to date on resume) are
+    reported with zero cost.
+    """
+    options = dict(docking_options or {})
+    backend = options.get("backend") or default_backend()
+    paths = telemetry_paths(runs_dir)
+    rates = docking_rates(paths, backend)
+    prescreen_rates = docking_rates(paths, options.get("prescreen_backend") or backend)
+    hist = history(runs_dir, workload.get("cancer_type"))
+    compounds = round(max_compounds * hist.get("compound_yield", DEFAULT_COMPOUND_YIELD))
+    targets = workload["targets"]
+
+    stages = []
+
+    # Critical path of the literature graph: cancer search → review →
+    # (local target extraction) → the two follow-up searches (spaced by
+    # the arXiv gate) → drug review → drug map.  Repurposing discovery
+    # runs alongside the follow-up searches and drug review, so it adds
+    # requests, not time.
+    lit = _stage("literature")
+    _add_requests(lit, "arxiv", 1)
+    _add_requests(lit, "perplexity", 1)
+    _add_requests(lit, "arxiv", 2, pause=ARXIV_PAUSE_SECONDS, concurrency=2)
+    _add_requests(lit, "perplexity", LITERATURE_PERPLEXITY_CALLS - 2)
+    lit["requests"]["perplexity"] += 1
+    stages.append(lit)
+
+    struct = _stage("structures")
+    for t in targets:
+        _add_requests(struct, "rcsb", 1)
+        _add_requests(struct, "rcsb", PDB_CANDIDATES, pause=PDB_DELAY)
+        if not t["pdb_cached"]:
+            _add_requests(struct, "rcsb", 1)
+        _add_requests(struct, "pubchem", t["drugs"], pause=PUBCHEM_DELAY)
+        _add_requests(struct, "pubchem", 1 + math.ceil(max_compounds / PUBCHEM_BATCH),
+                      pause=PUBCHEM_DELAY)
+    stages.append(struct)
+
+    dock = _stage("docking")
+    for t in targets:
+        n = t["ligands"] if t["ligands"] is not None else t["drugs"] + compounds
+        _dock_target(dock, n, t["drugs"], options, rates, prescreen_rates)
+    stages.append(dock)
+
+    reason = _stage("reasoning")
+    expansion = round(hist.get("expansion_ligands", DEFAULT_EXPANSION_LIGANDS))
+    for _ in range(max_rounds):
+        _add_requests(reason, "perplexity", 1)
+        _add_requests(reason, "pubchem", 2 * EXPANSION_SEEDS, pause=PUBCHEM_DELAY)
+        for t in targets:
+            _dock_target(reason, expansion, 0, options, rates, prescreen_rates)
+    stages.append(reason)
+
+    report = _stage("report")
+    _add_requests(report, "perplexity", REPORT_PERPLEXITY_CALLS, concurrency=LLM_CONCURRENCY)
+    stages.append(report)
+
+    paper = _stage("paper")
+    _add_requests(paper, "perplexity", PAPER_PERPLEXITY_CALLS, concurrency=LLM_CONCURRENCY)
+    stages.append(paper)
+
+    stages = [
+        _stage(s["stage"]) | {"skipped": True} if s["stage"] in skip_stages else s
+        for s in stages
+    ]
+    return {
+        "workload": workload["source"],
+        "docking_rates": rates["source"],
+        "pipelined": pipelined,
+        "stages": stages,
+    }
+
+
+def total_wall_seconds(plan: dict) -> float:
+    """Expected wall time; with pipelining, structures and round-1
+    docking overlap."""
+    walls = {s["stage"]: s["wall_seconds"] for s in plan["stages"]}
+    total = sum(walls.values())
+    if plan["pipelined"]:
+        total -= min(walls["structures"], walls["docking"])
+    return total
+
+
+def _duration(seconds: float) -> str:
+    if seconds >= 3600:
+        return f"{seconds / 3600:.1f}h"
+    if seconds >= 60:
+        return f"{seconds / 60:.0f}m"
+    return f"{seconds:.0f}s"
+
+
+def format_plan(plan: dict) -> str:
+    """Render an estimate as an aligned table."""
+    lines = [
+        f"  Workload from: {plan['workload']}; docking rates from: {plan['docking_rates']}",
+        "",
+        f"  {'Stage':<12} {'arXiv':>6} {'Pplx':>6} {'RCSB':>6} {'PubChem':>8}"
+        f" {'Jobs':>5} {'Chunks':>7} {'Ligands':>8} {'GPU-s':>8} {'Wall':>7}",
+    ]
+    totals = _stage("total")
+    for s in plan["stages"]:
+        req = s["requests"]
+        note = "  (up to date)" if s.get("skipped") else ""
+        lines.append(
+            f"  {s['stage']:<12} {req['arxiv']:>6} {req['perplexity']:>6} {req['rcsb']:>6}"
+            f" {req['pubchem']:>8} {s['docking_jobs']:>5} {s['chunks']:>7}"
+            f" {s['ligands']:>8} {s['gpu_seconds']:>8.0f} {_duration(s['wall_seconds']):>7}{note}"
+        )
+        for k, v in req.items():
+            totals["requests"][k] += v
+        for k in ("docking_jobs", "chunks", "ligands", "gpu_seconds"):
+            totals[k] += s[k]
+    req = totals["requests"]
+    wall = total_wall_seconds(plan)
+    lines.append(
+        f"  {'total':<12} {req['arxiv']:>6} {req['perplexity']:>6} {req['rcsb']:>6}"
+        f" {req['pubchem']:>8} {totals['docking_jobs']:>5} {totals['chunks']:>7}"
+        f" {totals['ligands']:>8} {totals['gpu_seconds']:>8.0f} {_duration(wall):>7}"
+    )
+    lines.append("")
+    lines.append(f"  GPU-hours: {totals['gpu_seconds'] / 3600:.2f}"
+                 f"{'  (structures overlap round-1 docking)' if plan['pipelined'] else ''}")
+    return "\n".join(lines)
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Docking Pose Store
+
+Keeps DiffDock pose coordinates out of the result dicts.  Each run has one
+append-only binary pack (poses.pack) holding zlib-compressed SDF blocks and
+a JSONL offset index next to it (poses.pack.idx).  Poses are
+content-addressed: a result record keeps only ``pose_ref`` (SHA-1 of the SDF
+text), ``num_poses`` and the per-pose ``pose_scores``, and the coordinates
+are read back only when something actually needs them.
+
+Usage:
+    python pose_store.py show poses.pack <pose_ref>        # print the SDF
+    python pose_store.py migrate pipeline_state.json       # offload inline poses
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import os
+import sys
+import threading
+import zlib
+
+# ---------------------------------------------------------------------------
+# Configuration
+# ---------------------------------------------------------------------------
+
+POSE_PACK_FILE = "poses.pack"
+
+
+# ---------------------------------------------------------------------------
+# Pack + index
+# ---------------------------------------------------------------------------
+
+class PoseStore:
+    """Append-only pose pack with an in-memory offset index.
+
+    The pack is written before the index line, so a crash can at worst
+    leave an unindexed tail in the pack — it is simply skipped, because
+    every read goes through an explicit (offset, length) from the index.
+    """
+
+    def __init__(self, pack_path: str = POSE_PACK_FILE):
+        self.pack_path = pack_path
+        self.index_path = pack_path + ".idx"
+        self._index: dict[str, tuple[int, int]] = {}
+        self._lock = threading.Lock()
+        self._load_index()
+
+    def _load_index(self):
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # torn final line
+                self._index[entry["ref"]] = (entry["offset"], entry["length"])
+
+    def __contains__(self, ref: str) -> bool:
+        return ref in self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def put(self, sdf: str) -> str:
+        """Store an SDF block and return its reference (idempotent)."""
+        data = sdf.encode("utf-8")
+        ref = hashlib.sha1(data).hexdigest()
+        with self._lock:
+            if ref in self._index:
+                return ref
+            blob = zlib.compress(data, 6)
+            os.makedirs(os.path.dirname(os.path.abspath(self.pack_path)), exist_ok=True)
+            with open(self.pack_path, "ab") as f:
+                offset = f.tell()
+                f.write(blob)
+            with open(self.index_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"ref": ref, "offset": offset, "length": len(blob)}) + "\n")
+            self._index[ref] = (offset, len(blob))
+        return ref
+
+    def get(self, ref: str) -> str:
+        """Return the SDF text for a reference (KeyError if unknown)."""
+        offset, length = self._index[ref]
+        with open(self.pack_path, "rb") as f:
+            f.seek(offset)
+            blob = f.read(length)
+        return zlib.decompress(blob).decode("utf-8")
+
+
+# ---------------------------------------------------------------------------
+# Result helpers
+# ---------------------------------------------------------------------------
+
+def offload_poses(results: list[dict], store: PoseStore) -> int:
+    """Move inline poses from result dicts into the store, in place.
+
+    ``top_pose_sdf_b64`` becomes ``pose_ref`` and ``all_poses`` becomes
+    ``num_poses`` + ``pose_scores``.  Returns the number of poses stored.
+    """
+    stored = 0
+    for r in results:
+        sdf_b64 = r.pop("top_pose_sdf_b64", None)
+        if sdf_b64:
+            r["pose_ref"] = store.put(base64.b64decode(sdf_b64).decode("utf-8"))
+            stored += 1
+        poses = r.pop("all_poses", None)
+        if poses is not None:
+            r["num_poses"] = len(poses)
+            r["pose_scores"] = [
+                round(p.get("confidence_score", 0), 6) for p in poses
+            ]
+    return stored
+
+
+def load_pose(result: dict, store: PoseStore) -> str | None:
+    """Return the top-pose SDF for a result, inline or from the store."""
+    if result.get("top_pose_sdf_b64"):
+        return base64.b64decode(result["top_pose_sdf_b64"]).decode("utf-8")
+    ref = result.get("pose_ref")
+    if ref and ref in store:
+        return store.get(ref)
+    return None
+
+
+def migrate_file(json_path: str, store: PoseStore) -> int:
+    """Offload inline poses from an existing pipeline_state.json or
+    agent3_output.json, rewriting it in place.  Returns poses stored."""
+    with open(json_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+
+    stored = offload_poses(data.get("all_docking_results", []), store)
+    for target in data.get("targets", []):
+        stored += offload_poses(target.get("results", []), store)
+
+    tmp = json_path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, json_path)
+    return stored
+
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or populate a pose pack.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    show = sub.add_parser("show", help="Print the SDF for a pose reference.")
+    show.add_argument("pack", type=str)
+    show.add_argument("ref", type=str)
+
+    migrate = sub.add_parser("migrate", help="Offload inline poses from JSON files.")
+    migrate.add_argument("files", nargs="+")
+    migrate.add_argument("--pack", type=str, default=POSE_PACK_FILE,
+                         help=f"Pose pack to write to (default: {POSE_PACK_FILE}).")
+    args = parser.parse_args()
+
+    if args.command == "show":
+        store = PoseStore(args.pack)
+        if args.ref not in store:
+            print(f"ERROR: {args.ref} not in {args.pack}", file=sys.stderr)
+            sys.exit(1)
+        print(store.get(args.ref))
+        return
+
+    store = PoseStore(args.pack)
+    for path in args.files:
+        before = os.path.getsize(path)
+        n = migrate_file(path, store)
+        after = os.path.getsize(path)
+        print(f"  {path}: {n} poses offloaded, {before / 1024:.0f} KB → {after / 1024:.0f} KB")
+    print(f"  Pack: {args.pack} ({len(store)} unique poses, "
+          f"{os.path.getsize(store.pack_path) / 1024:.0f} KB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Prompt Budgets
+
+Helpers that keep LLM prompts inside a token budget however large the
+docking library grows.  Tables are cut to the top-K rows (K shrinking
+until the block fits) with the remainder summarised statistically by
+the caller, and free text is cut at paragraph boundaries.
+
+Token counts are estimates (about four characters per token for English
+prose and Markdown tables); the API's own ``usage`` counts are recorded
+by llm_client once a call completes.
+
+Configuration (environment):
+    PROMPT_BUDGET_SCALE   multiplier applied to every budget (default: 1.0)
+"""
+
+import os
+
+# ---------------------------------------------------------------------------
+# Configuration
+# ---------------------------------------------------------------------------
+
+CHARS_PER_TOKEN = 4.0
+BUDGET_SCALE = float(os.environ.get("PROMPT_BUDGET_SCALE", "1.0"))
+
+DEFAULT_TOP_K = 15  # rows kept per table before any shrinking
+MIN_TOP_K = 3
+
+
+def count_tokens(text: str) -> int:
+    """Estimated token count of ``text``."""
+    return int(len(text) / CHARS_PER_TOKEN + 0.5) if text else 0
+
+
+def scaled(budget_tokens: int) -> int:
+    """A budget after PROMPT_BUDGET_SCALE."""
+    return max(1, int(budget_tokens * BUDGET_SCALE))
+
+
+# ---------------------------------------------------------------------------
+# Fitting
+# ---------------------------------------------------------------------------
+
+def fit_top_k(render, budget_tokens: int, top_k: int = DEFAULT_TOP_K,
+              min_k: int = MIN_TOP_K, fallback=None) -> str:
+    """Render with the largest K (halving from top_k down to min_k) whose
+    output fits the budget.
+
+    render(k) must return the block with at most k rows per table.  If
+    even min_k does not fit, fallback() (a terser rendering, when given)
+    is tried next, and whatever is left over budget is cut with fit_text.
+    """
+    budget_tokens = scaled(budget_tokens)
+    k = max(top_k, min_k)
+    while True:
+        text = render(k)
+        if count_tokens(text) <= budget_tokens:
+            return text
+        if k <= min_k:
+            if fallback is not None:
+                text = fallback()
+            return fit_text(text, budget_tokens, scale=False)
+        k = max(min_k, k // 2)
+
+
+def fit_text(text: str, budget_tokens: int, scale: bool = True) -> str:
+    """Cut ``text`` to the budget at the last paragraph (or line) break,
+    noting how much was left out."""
+    if scale:
+        budget_tokens = scaled(budget_tokens)
+    if count_tokens(text) <= budget_tokens:
+        return text
+    limit = int(budget_tokens * CHARS_PER_TOKEN)
+    cut = text.rfind("\n\n", 0, limit)
+    if cut < limit // 2:
+        cut = text.rfind("\n", 0, limit)
+    if cut < limit // 2:
+        cut = limit
+    omitted = count_tokens(text[cut:])
+    return text[:cut].rstrip() + f"\n\n[… {omitted} tokens omitted for length]"
@@ -0,0 +1,113 @@
+"""
+Per-target docking rankings
+
+Keeps each protein's docking results sorted by confidence score (ligands
+that stopped at a progressive-docking pre-screen after the fully sampled
+ones, since their scores are on another scale) so that expansion rounds only pay for their new results: new results land in an
+append-only tail and are merged into the sorted list (bisect insertion) the
+next time the ranking is read.  Each result's JSON encoding is cached next
+to it, so rewriting agent3_output.json re-encodes only what was added.
+"""
+
+import bisect
+import json
+import os
+
+
+def rank_key(result: dict) -> tuple[bool, float]:
+    """Sort key for a target's results: full-sampling tier first, then by
+    descending confidence."""
+    return result.get("docking_tier") == "prescreen", -result.get("confidence_score", 0)
+
+
+class TargetRanking:
+    """Sorted results for one protein plus an unmerged tail."""
+
+    def __init__(self):
+        self._keys: list[tuple[bool, float]] = []
+        self._results: list[dict] = []
+        self._encoded: list[str] = []
+        self._tail: list[dict] = []
+
+    def __len__(self) -> int:
+        return len(self._results) + len(self._tail)
+
+    def add(self, result: dict):
+        self._tail.append(result)
+
+    def _merge(self):
+        if not self._tail:
+            return
+        for r in sorted(self._tail, key=rank_key):
+            # bisect_right keeps equal scores in arrival order, like a stable sort
+            i = bisect.bisect_right(self._keys, rank_key(r))
+            self._keys.insert(i, rank_key(r))
+            self._results.insert(i, r)
+            self._encoded.insert(i, json.dumps(r, ensure_ascii=False))
+        self._tail = []
+
+    def results(self) -> list[dict]:
+        self._merge()
+        return self._results
+
+    def top(self, k: int) -> list[dict]:
+        return self.results()[:k]
+
+    def encoded(self) -> list[str]:
+        self._merge()
+        return self._encoded
+
+
+class Rankings:
+    """TargetRanking per protein, fed from an append-only result list.
+
+    ``sync`` consumes whatever was appended to the list since the previous
+    call, so callers can simply pass state["all_docking_results"].
+    """
+
+    def __init__(self):
+        self.targets: dict[str, TargetRanking] = {}
+        self.consumed = 0
+
+    def add(self, results: list[dict]):
+        for r in results:
+            prot = r.get("protein_target", "unknown")
+            self.targets.setdefault(prot, TargetRanking()).add(r)
+        self.consumed += len(results)
+
+    def sync(self, all_results: list[dict]) -> int:
+        """Add results appended since the last sync.  Returns how many."""
+        new = all_results[self.consumed:]
+        self.add(new)
+        return len(new)
+
+    def get(self, protein: str) -> TargetRanking:
+        return self.targets.get(protein) or TargetRanking()
+
+
+def write_docking_output(path: str, header: dict, target_entries: list[dict],
+                         rankings: Rankings):
+    """Stream an agent3_output.json-shaped file from rankings.
+
+    ``target_entries`` hold the per-target fields without ``results``;
+    results are taken from the matching TargetRanking in score order.
+    """
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write("{\n")
+        for key, value in header.items():
+            f.write(f"  {json.dumps(key)}: {json.dumps(value, ensure_ascii=False)},\n")
+        f.write('  "targets": [')
+        for i, entry in enumerate(target_entries):
+            f.write(",\n    {" if i else "\n    {")
+            for key, value in entry.items():
+                f.write(f"\n      {json.dumps(key)}: {json.dumps(value, ensure_ascii=False)},")
+            f.write('\n      "results": [')
+            encoded = rankings.get(entry["protein"]).encoded()
+            if encoded:
+                f.write("\n        ")
+                f.write(",\n        ".join(encoded))
+                f.write("\n      ")
+            f.write("]\n    }")
+        f.write("\n  ]\n}\n")
+    os.replace(tmp, path)
@@ -5,64 +5,43 @@ Docking Results Report Generator
 Reads DiffDock simulation output (agent3_output.json) and uses the
 Perplexity API to generate a research-paper–style Methodology, Results,
 and Conclusion section, saved as results.md.
+
+The docking tables sent to Perplexity are token-budgeted: each target
+(and each compound class) keeps its top-K compounds and the rest is
+summarised statistically, so prompt size stays flat as libraries grow.
 """
 
 import argparse
 import json
 import os
 import re
+import statistics
 import sys
+from collections import Counter
 from datetime import datetime
 
-import requests
 from dotenv import load_dotenv
 
+from llm_client import StreamProgress, get_client, query_perplexity, run_concurrently
+from prompt_budget import fit_top_k
+from rankings import rank_key
+from workspace import AGENT3_OUTPUT, RESULTS_MD, add_run_dir_argument, in_run_dir
+
 # ---------------------------------------------------------------------------
 # Configuration
 # ---------------------------------------------------------------------------
 
 load_dotenv()
 
-PERPLEXITY_API_KEY = os.environ.get("PERPLEXITY_API_KEY", "")
-PERPLEXITY_URL = "https://api.perplexity.ai/chat/completions"
-PERPLEXITY_MODEL = "sonar-pro"
+# Token budgets for the docking data embedded in each report prompt
+OVERVIEW_BUDGET_TOKENS = 2500
+CLASS_BUDGET_TOKENS = {"cancer_purposed": 1000, "repurposing": 2500, "novel": 1000}
 
 
 # ---------------------------------------------------------------------------
 # Perplexity helpers
 # ---------------------------------------------------------------------------
 
-def query_perplexity(system_prompt: str, user_prompt: str) -> str:
-    """Send a chat-completion request to the Perplexity API and return the
-    assistant's reply text."""
-    if not PERPLEXITY_API_KEY:
-        print("ERROR: PERPLEXITY_API_KEY environment variable is not set.",
-              file=sys.stderr)
-        sys.exit(1)
-
-    headers = {
-        "Authorization": f"Bearer {PERPLEXITY_API_KEY}",
-        "Content-Type": "application/json",
-    }
-    payload = {
-        "model": PERPLEXITY_MODEL,
-        "messages": [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt},
-        ],
-        "temperature": 0.3,
-        "max_tokens": 8000,
-    }
-
-    print("[Perplexity] Sending request …")
-    resp = requests.post(PERPLEXITY_URL, json=payload, headers=headers, timeout=120)
-    resp.raise_for_status()
-    data = resp.json()
-    reply = data["choices"][0]["message"]["content"]
-    print(f"[Perplexity] Received {len(reply)} chars.")
-    return reply
-
-
 def _strip_leading_header(text: str) -> str:
     """Remove a leading Markdown header (e.g. '## Methodology\\n') that
     Perplexity often echoes back, which would duplicate the header we
@@ -78,7 +57,14 @@ def _strip_leading_header(text: str) -> str:
 # ---------------------------------------------------------------------------
 
 def load_docking_data(path: str) -> dict:
-    """Load and return the agent3_output.json data."""
+    """Load and return the agent3_output.json data.
+
+    Columnar exports (.npz / .parquet from results_export.py) are accepted
+    too and come back in the same shape, without poses.
+    """
+    if path.endswith((".npz", ".parquet")):
+        from results_export import columns_to_docking_data, read_columns
+        return columns_to_docking_data(read_columns(path))
     with open(path, "r", encoding="utf-8") as f:
         return json.load(f)
 
@@ -96,10 +82,13 @@ def summarise_target(target: dict) -> dict:
             "mechanism": r.get("mechanism", ""),
             "fda_status": r.get("fda_status", ""),
             "source": r.get("source", ""),
-            "num_poses": len(r.get("all_poses", [])),
+            "num_poses": r.get("num_poses", len(r.get("all_poses", []))),
         })
-    # Sort by confidence_score descending (should already be, but ensure)
-    results_compact.sort(key=lambda x: x["confidence_score"], reverse=True)
+        if r.get("docking_tier") == "prescreen":
+            results_compact[-1]["docking_tier"] = "prescreen"
+    # Full-sampling tier first, each by confidence_score descending
+    # (should already be, but ensure)
+    results_compact.sort(key=rank_key)
     # Assign ranks after sorting
     for i, r in enumerate(results_compact, 1):
         r["rank"] = i
@@ -114,22 +103,56 @@ def summarise_target(target: dict) -> dict:
     }
 
 
-def format_target_summary_for_prompt(target_summary: dict) -> str:
-    """Format a target summary as human-readable text for LLM prompts."""
+def summarize_tail(compounds: list[dict]) -> str:
+    """One-line statistical summary of compounds left out of a table."""
+    if not compounds:
+        return ""
+    scores = [c["confidence_score"] for c in compounds]
+    approved = sum(1 for c in compounds if "approved" in (c.get("fda_status") or "").lower())
+    line = (
+        f"- …plus {len(compounds)} more compounds: confidence "
+        f"{min(scores):.4f}–{max(scores):.4f} (median {statistics.median(scores):.4f}, "
+        f"mean {statistics.fmean(scores):.4f}); {approved} FDA-approved"
+    )
+    mechanisms = Counter(c["mechanism"][:40] for c in compounds if c.get("mechanism"))
+    if mechanisms:
+        line += "; most common mechanisms: " + ", ".join(
+            f"{m} ×{n}" for m, n in mechanisms.most_common(3))
+    return line
+
+
+def _compound_table(compounds: list[dict], top_k: int | None) -> str:
+    """Markdown table of the first top_k compounds plus a tail summary."""
+    shown = compounds if top_k is None else compounds[:top_k]
     lines = [
-        f"### Protein: {target_summary['protein']}  (PDB: {target_summary['pdb_id']})",
-        f"- Ligands submitted: {target_summary['num_ligands_total']}",
-        f"- Ligands successfully docked: {target_summary['num_ligands_docked']}",
-        f"- Docking wall-clock time: {target_summary['docking_time_seconds']:.1f} s",
-        "",
         "| Rank | Compound | Confidence | Mechanism | FDA Status | Source |",
         "|------|----------|------------|-----------|------------|--------|",
     ]
-    for r in target_summary["results"]:
+    for i, r in enumerate(shown, 1):
         lines.append(
-            f"| {r['rank']} | {r['name'][:80]} | {r['confidence_score']:.4f} "
+            f"| {r.get('rank', i)} | {r['name'][:80]} | {r['confidence_score']:.4f} "
             f"| {r['mechanism'][:60]} | {r['fda_status'][:40]} | {r['source']} |"
         )
+    tail = summarize_tail(compounds[len(shown):])
+    if tail:
+        lines.append(tail)
+    return "\n".join(lines)
+
+
+def format_target_summary_for_prompt(target_summary: dict, top_k: int | None = None) -> str:
+    """Format a target summary as human-readable text for LLM prompts.
+
+    top_k limits the table to the best-scoring compounds; the rest are
+    summarised in one line.
+    """
+    lines = [
+        f"### Protein: {target_summary['protein']}  (PDB: {target_summary['pdb_id']})",
+        f"- Ligands submitted: {target_summary['num_ligands_total']}",
+        f"- Ligands successfully docked: {target_summary['num_ligands_docked']}",
+        f"- Docking wall-clock time: {target_summary['docking_time_seconds']:.1f} s",
+        "",
+        _compound_table(target_summary["results"], top_k),
+    ]
     return "\n".join(lines)
 
 
@@ -156,32 +179,69 @@ def classify_compound(compound: dict, cancer_type: str) -> str:
     return "novel"
 
 
-def build_overview_block(data: dict, target_summaries: list[dict]) -> str:
-    """Build a textual overview of the entire docking run for the LLM."""
-    lines = [
+def build_overview_block(data: dict, target_summaries: list[dict],
+                         budget_tokens: int = OVERVIEW_BUDGET_TOKENS) -> str:
+    """Build a textual overview of the entire docking run for the LLM,
+    keeping as many top compounds per target as fit in budget_tokens.
+
+    The budget covers every target together; when even the shortest
+    tables overflow it, each target shrinks to a one-line summary rather
+    than later targets being cut off.
+    """
+    header = [
         f"Cancer type: {data['cancer_type']}",
         f"Overall status: {data['status']}",
         f"Total protein targets: {data['total_targets']}",
         f"Total docking wall-clock time: {data['total_docking_time_seconds']:.1f} seconds",
         "",
     ]
-    for ts in target_summaries:
-        lines.append(format_target_summary_for_prompt(ts))
-        lines.append("")
-    return "\n".join(lines)
+
+    def render(k):
+        lines = list(header)
+        for ts in target_summaries:
+            lines.append(format_target_summary_for_prompt(ts, top_k=k))
+            lines.append("")
+        return "\n".join(lines)
+
+    def render_summaries():
+        lines = list(header)
+        lines.extend(_target_summary_line(ts) for ts in target_summaries)
+        return "\n".join(lines)
+
+    return fit_top_k(render, budget_tokens, fallback=render_summaries)
+
+
+def _target_summary_line(target_summary: dict) -> str:
+    """One line per target: docking counts, the best compound and a
+    summary of the rest."""
+    results = target_summary["results"]
+    line = (f"- {target_summary['protein']} (PDB: {target_summary['pdb_id']}): "
+            f"{target_summary['num_ligands_docked']}/{target_summary['num_ligands_total']} "
+            f"ligands docked")
+    if results:
+        best = results[0]
+        line += (f"; best {best['name'][:80]} ({best['confidence_score']:.4f}"
+                 f"{', ' + best['fda_status'][:40] if best.get('fda_status') else ''})")
+    if len(results) > 1:
+        scores = [r["confidence_score"] for r in results[1:]]
+        line += (f"; {len(scores)} more compounds: confidence "
+                 f"{min(scores):.4f}–{max(scores):.4f}")
+    return line
 
 
 def build_classified_overview(
-    target_summaries: list[dict], cancer_type: str
+    target_summaries: list[dict], cancer_type: str,
+    budget_tokens: dict = CLASS_BUDGET_TOKENS,
 ) -> dict:
     """Split every target's results into three buckets and return a dict
     with formatted text blocks for:
       - 'cancer_purposed'  (drugs approved for this cancer)
       - 'repurposing'      (drugs approved for other indications)
       - 'novel'            (research / unknown compounds)
-    Each value is a formatted text string ready for an LLM prompt.
+    Each value is a formatted text string ready for an LLM prompt, holding
+    the top compounds per target that fit the bucket's token budget.
     """
-    buckets: dict[str, list[str]] = {
+    buckets: dict[str, list[tuple[dict, list[dict]]]] = {
         "cancer_purposed": [],
         "repurposing": [],
         "novel": [],
@@ -199,27 +259,26 @@ def build_classified_overview(
             categorised[cat].append(r)
 
         for cat, compounds in categorised.items():
-            if not compounds:
-                continue
-            header = (
+            if compounds:
+                buckets[cat].append((ts, compounds))
+
+    def render(groups, k):
+        blocks = []
+        for ts, compounds in groups:
+            ranked = [{**c, "rank": i} for i, c in enumerate(compounds, 1)]
+            blocks.append(
                 f"### Protein: {ts['protein']}  (PDB: {ts['pdb_id']})\n"
                 f"- Compounds in this category: {len(compounds)}\n"
+                + _compound_table(ranked, k) + "\n"
             )
-            table = (
-                "| Rank | Compound | Confidence | Mechanism "
-                "| FDA Status | Source |\n"
-                "|------|----------|------------|-----------|"
-                "------------|--------|\n"
-            )
-            for i, c in enumerate(compounds, 1):
-                table += (
-                    f"| {i} | {c['name'][:80]} | {c['confidence_score']:.4f} "
-                    f"| {c['mechanism'][:60]} | {c['fda_status'][:40]} "
-                    f"| {c['source']} |\n"
-                )
-            buckets[cat].append(header + table)
+        return "\n".join(blocks)
 
-    return {k: "\n".join(v) if v else "(none)" for k, v in buckets.items()}
+    return {
+        cat: fit_top_k(lambda k, groups=groups: render(groups, k),
+                       budget_tokens.get(cat, CLASS_BUDGET_TOKENS[cat]))
+        if groups else "(none)"
+        for cat, groups in buckets.items()
+    }
 
 
 # ---------------------------------------------------------------------------
@@ -365,6 +424,26 @@ def generate_conclusion(
     return query_perplexity(system, user)
 
 
+def generate_report_sections(cancer_type: str, overview: str, classified: dict,
+                             progress: StreamProgress | None = None) -> dict:
+    """Generate the methodology, results and conclusion sections
+    concurrently (they share inputs but not outputs).  With ``progress``,
+    each section streams as it is written.
+
+    The methodology only describes the setup, so it gets the run summary
+    without the compound tables.
+    """
+    run_summary = "\n".join(
+        line for line in overview.splitlines()
+        if not line.startswith("|") and not line.startswith("- …plus")
+    )
+    return run_concurrently({
+        "methodology": lambda: generate_methodology(cancer_type, run_summary),
+        "results": lambda: generate_results(cancer_type, overview, classified),
+        "conclusion": lambda: generate_conclusion(cancer_type, overview, classified),
+    }, progress=progress)
+
+
 # ---------------------------------------------------------------------------
 # Main pipeline
 # ---------------------------------------------------------------------------
@@ -377,19 +456,24 @@ def main():
     parser.add_argument(
         "-i", "--input",
         type=str,
-        default="agent3_output.json",
-        help="Path to the DiffDock results JSON (default: agent3_output.json).",
+        default=AGENT3_OUTPUT,
+        help=f"Path to the DiffDock results JSON (default: {AGENT3_OUTPUT}).",
     )
     parser.add_argument(
         "-o", "--output",
         type=str,
-        default="results.md",
-        help="Output Markdown file (default: results.md).",
+        default=RESULTS_MD,
+        help=f"Output Markdown file (default: {RESULTS_MD}).",
     )
+    add_run_dir_argument(parser)
     args = parser.parse_args()
+    if not get_client().api_key:
+        print("ERROR: PERPLEXITY_API_KEY environment variable is not set.",
+              file=sys.stderr)
+        sys.exit(1)
 
-    input_file = args.input
-    output_file = args.output
+    input_file = in_run_dir(args.run_dir, args.input, AGENT3_OUTPUT)
+    output_file = in_run_dir(args.run_dir, args.output, RESULTS_MD)
 
     # ----- Step 1: Load and parse docking data -----
     print("\n>> Step 1: Loading docking data …")
@@ -418,25 +502,22 @@ def main():
     # ----- Step 2: Classify compounds -----
     print("\n>> Step 2: Classifying compounds …")
     classified = build_classified_overview(target_summaries, cancer_type)
+    counts = Counter(classify_compound(r, cancer_type)
+                     for ts in target_summaries for r in ts["results"])
     for cat, label in [
         ("cancer_purposed", "Approved for this cancer"),
         ("repurposing", "Repurposing candidates"),
         ("novel", "Novel / research"),
     ]:
-        count = classified[cat].count("|") // 7  # rough row count
-        print(f"    {label:30s}: ~{count} compounds")
-
-    # ----- Step 3: Generate Methodology -----
-    print("\n>> Step 3: Generating Methodology section …")
-    methodology = generate_methodology(cancer_type, overview)
-
-    # ----- Step 4: Generate Results -----
-    print("\n>> Step 4: Generating Results section …")
-    results = generate_results(cancer_type, overview, classified)
-
-    # ----- Step 5: Generate Conclusion -----
-    print("\n>> Step 5: Generating Conclusion section …")
-    conclusion = generate_conclusion(cancer_type, overview, classified)
+        print(f"    {label:30s}: {counts[cat]} compounds")
+
+    # ----- Steps 3-5: Generate Methodology, Results and Conclusion -----
+    print("\n>> Steps 3-5: Generating Methodology, Results and Conclusion sections …")
+    sections = generate_report_sections(cancer_type, overview, classified,
+                                        progress=StreamProgress())
+    methodology = sections["methodology"]
+    results = sections["results"]
+    conclusion = sections["conclusion"]
 
     # ----- Step 6: Assemble final document -----
     print("\n>> Step 6: Assembling final Markdown document …")
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+Columnar Docking Results Export
+
+Flattens docking results (agent3_output.json, pipeline_state.json) into one
+row per docked ligand and writes the scalar fields column-wise: Parquet when
+pyarrow is installed, otherwise a NumPy .npz archive.  Per-pose confidence
+scores are ragged, so they are stored as a flat array plus offsets.
+
+Reading a columnar file back is cheap enough to aggregate thousands of runs
+at once, and results.load_docking_data accepts these files directly.
+
+Usage:
+    python results_export.py export agent3_output.json -o docking_results.npz
+    python results_export.py summary runs/*/docking_results.npz
+"""
+
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+from results_store import inchikey_for
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional — fall back to .npz
+    pa = None
+    pq = None
+
+# ---------------------------------------------------------------------------
+# Configuration
+# ---------------------------------------------------------------------------
+
+COLUMNS_FILE = "docking_results.parquet" if pa is not None else "docking_results.npz"
+
+STRING_COLUMNS = [
+    "protein", "pdb_id", "ligand_id", "smiles", "inchikey", "source",
+    "mechanism", "fda_status", "pose_ref",
+]
+FLOAT_COLUMNS = ["confidence_score", "confidence_raw"]
+INT_COLUMNS = ["round", "num_poses"]
+
+
+# ---------------------------------------------------------------------------
+# Flattening
+# ---------------------------------------------------------------------------
+
+def _pose_scores(r: dict) -> list[float]:
+    if "pose_scores" in r:
+        return list(r["pose_scores"])
+    return [p.get("confidence_score", 0.0) for p in r.get("all_poses", [])]
+
+
+def flatten_results(data: dict) -> list[dict]:
+    """One row per docked ligand from agent3 output or pipeline state."""
+    if "all_docking_results" in data:
+        pairs = [(r, {}) for r in data["all_docking_results"]]
+    else:
+        pairs = [(r, t) for t in data.get("targets", []) for r in t.get("results", [])]
+
+    rows = []
+    for r, target in pairs:
+        scores = _pose_scores(r)
+        rows.append({
+            "protein": r.get("protein_target") or target.get("protein", ""),
+            "pdb_id": r.get("pdb_id") or target.get("pdb_id") or "",
+            "ligand_id": r["name"],
+            "smiles": r.get("smiles") or "",
+            "inchikey": r.get("inchikey") or inchikey_for(r.get("smiles")) or "",
+            "source": r.get("source", ""),
+            "mechanism": r.get("mechanism", ""),
+            "fda_status": r.get("fda_status", ""),
+            "pose_ref": r.get("pose_ref") or "",
+            "confidence_score": float(r.get("confidence_score", 0.0)),
+            "confidence_raw": float(r.get("confidence_raw", 0.0)),
+            "round": int(r.get("round") or 1),
+            "num_poses": int(r.get("num_poses", len(scores))),
+            "pose_scores": scores,
+        })
+    return rows
+
+
+def to_columns(rows: list[dict]) -> dict[str, np.ndarray]:
+    """Turn flattened rows into NumPy columns (pose scores as flat + offsets)."""
+    cols = {}
+    for name in STRING_COLUMNS:
+        cols[name] = np.array([r[name] for r in rows], dtype=str)
+    for name in FLOAT_COLUMNS:
+        cols[name] = np.array([r[name] for r in rows], dtype=np.float64)
+    for name in INT_COLUMNS:
+        cols[name] = np.array([r[name] for r in rows], dtype=np.int32)
+    lengths = [len(r["pose_scores"]) for r in rows]
+    cols["pose_offsets"] = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+    cols["pose_scores"] = np.array(
+        [s for r in rows for s in r["pose_scores"]], dtype=np.float32
+    )
+    return cols
+
+
+# ---------------------------------------------------------------------------
+# Write / read
+# ---------------------------------------------------------------------------
+
+def write_columns(data: dict, path: str = COLUMNS_FILE) -> str:
+    """Export docking data column-wise.  Returns the path actually written
+    (a .parquet request falls back to .npz when pyarrow is missing)."""
+    cols = to_columns(flatten_results(data))
+    meta = {"cancer_type": data.get("cancer_type", ""), "run_id": data.get("run_id", "")}
+
+    if path.endswith(".parquet") and pa is None:
+        path = path[: -len(".parquet")] + ".npz"
+        print(f"  pyarrow not installed, writing {path} instead")
+
+    tmp_dir = os.path.dirname(os.path.abspath(path))
+    if path.endswith(".parquet"):
+        offsets = cols.pop("pose_offsets")
+        flat = cols.pop("pose_scores")
+        table = pa.table({
+            **cols,
+            "pose_scores": pa.ListArray.from_arrays(pa.array(offsets, pa.int32()), flat),
+        })
+        table = table.replace_schema_metadata({k: str(v) for k, v in meta.items()})
+        pq.write_table(table, path)
+    else:
+        if not path.endswith(".npz"):
+            path += ".npz"
+        tmp = os.path.join(tmp_dir, f".{os.path.basename(path)}.tmp.npz")
+        np.savez_compressed(tmp, **cols, **{f"meta_{k}": np.array(v) for k, v in meta.items()})
+        os.replace(tmp, path)
+    return path
+
+
+def read_columns(path: str) -> dict:
+    """Read a columnar export back into NumPy columns plus ``meta``.
+
+    ``pose_scores`` is a flat float32 array; row i's scores are
+    ``pose_scores[pose_offsets[i]:pose_offsets[i + 1]]``.
+    """
+    if path.endswith(".parquet"):
+        if pq is None:
+            raise ImportError("reading .parquet exports requires pyarrow")
+        table = pq.read_table(path)
+        cols = {}
+        for name in table.column_names:
+            if name == "pose_scores":
+                arr = table.column(name).combine_chunks()
+                cols["pose_offsets"] = arr.offsets.to_numpy().astype(np.int64)
+                cols["pose_scores"] = arr.values.to_numpy().astype(np.float32)
+            else:
+                cols[name] = table.column(name).to_numpy()
+        raw = table.schema.metadata or {}
+        cols["meta"] = {k.decode(): v.decode() for k, v in raw.items()}
+        return cols
+
+    with np.load(path, allow_pickle=False) as npz:
+        cols = {k: npz[k] for k in npz.files if not k.startswith("meta_")}
+        cols["meta"] = {k[5:]: str(npz[k]) for k in npz.files if k.startswith("meta_")}
+    return cols
+
+
+def columns_to_docking_data(cols: dict) -> dict:
+    """Rebuild an agent3_output-shaped dict (without poses) from columns."""
+    targets = {}
+    offsets = cols["pose_offsets"]
+    for i in range(len(cols["ligand_id"])):
+        protein = str(cols["protein"][i])
+        target = targets.setdefault(protein, {
+            "protein": protein,
+            "pdb_id": str(cols["pdb_id"][i]),
+            "status": "completed",
+            "num_ligands_total": 0,
+            "num_ligands_docked": 0,
+            "docking_time_seconds": 0,
+            "results": [],
+        })
+        target["results"].append({
+            "name": str(cols["ligand_id"][i]),
+            "smiles": str(cols["smiles"][i]),
+            "inchikey": str(cols["inchikey"][i]),
+            "confidence_score": float(cols["confidence_score"][i]),
+            "confidence_raw": float(cols["confidence_raw"][i]),
+            "mechanism": str(cols["mechanism"][i]),
+            "fda_status": str(cols["fda_status"][i]),
+            "source": str(cols["source"][i]),
+            "pose_ref": str(cols["pose_ref"][i]) or None,
+            "round": int(cols["round"][i]),
+            "num_poses": int(cols["num_poses"][i]),
+            "pose_scores": cols["pose_scores"][offsets[i]:offsets[i + 1]].tolist(),
+        })
+    for target in targets.values():
+        target["results"].sort(key=lambda r: r["confidence_score"], reverse=True)
+        target["num_ligands_total"] = target["num_ligands_docked"] = len(target["results"])
+    return {
+        "cancer_type": cols["meta"].get("cancer_type", ""),
+        "status": "completed",
+        "completed_targets": len(targets),
+        "total_targets": len(targets),
+        "total_docking_time_seconds": 0,
+        "targets": list(targets.values()),
+    }
+
+
+# ---------------------------------------------------------------------------
+# Cross-run aggregation
+# ---------------------------------------------------------------------------
+
+def aggregate(paths: list[str]) -> list[dict]:
+    """Per (protein, compound) statistics across many columnar exports.
+
+    Compounds are keyed on InChIKey when known, otherwise on ligand name.
+    """
+    proteins, keys, names, scores = [], [], [], []
+    for path in paths:
+        cols = read_columns(path)
+        key = np.where(cols["inchikey"] != "", cols["inchikey"], cols["ligand_id"])
+        proteins.append(cols["protein"])
+        keys.append(key)
+        names.append(cols["ligand_id"])
+        scores.append(cols["confidence_score"])
+    if not proteins:
+        return []
+
+    protein = np.concatenate(proteins)
+    key = np.concatenate(keys)
+    name = np.concatenate(names)
+    score = np.concatenate(scores)
+
+    pair = np.char.add(np.char.add(protein.astype(str), "\t"), key.astype(str))
+    uniq, first, inverse = np.unique(pair, return_index=True, return_inverse=True)
+    counts = np.bincount(inverse)
+    sums = np.bincount(inverse, weights=score)
+    maxes = np.full(len(uniq), -np.inf)
+    np.maximum.at(maxes, inverse, score)
+
+    rows = [
+        {
+            "protein": str(protein[first[i]]),
+            "compound": str(name[first[i]]),
+            "key": str(key[first[i]]),
+            "runs": int(counts[i]),
+            "mean_score": float(sums[i] / counts[i]),
+            "max_score": float(maxes[i]),
+        }
+        for i in range(len(uniq))
+    ]
+    rows.sort(key=lambda r: r["mean_score"], reverse=True)
+    return rows
+
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Columnar export of docking results.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    exp = sub.add_parser("export", help="Export agent3_output.json / pipeline_state.json.")
+    exp.add_argument("input", type=str)
+    exp.add_argument("-o", "--output", type=str, default=COLUMNS_FILE)
+
+    summ = sub.add_parser("summary", help="Aggregate exports across runs.")
+    summ.add_argument("files", nargs="+")
+    summ.add_argument("--top", type=int, default=25)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        if not os.path.exists(args.input):
+            print(f"ERROR: {args.input} not found", file=sys.stderr)
+            sys.exit(1)
+        with open(args.input, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        path = write_columns(data, args.output)
+        print(f"  Wrote {len(flatten_results(data))} rows → {path} "
+              f"({os.path.getsize(path) / 1024:.0f} KB)")
+        return
+
+    rows = aggregate(args.files)
+    print(f"  {len(args.files)} runs, {len(rows)} protein/compound pairs\n")
+    print(f"  {'Protein':<10} {'Compound':<40} {'Runs':>5} {'Mean':>8} {'Max':>8}")
+    for r in rows[: args.top]:
+        print(f"  {r['protein'][:10]:<10} {r['compound'][:40]:<40} {r['runs']:>5}"
+              f" {r['mean_score']:>8.4f} {r['max_score']:>8.4f}")
+
+
+if __name__ == "__main__":
+    main()
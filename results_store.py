@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+Docking Results Store
+
+Indexed SQLite store for docking outcomes, shared across pipeline runs.
+Every result the pipeline docks is inserted once; the ranking questions the
+pipeline asks each round (top-K overall, top-K per target, what a round
+added, "has this compound already been docked against this protein?",
+seed CIDs for expansion) are answered by indexed queries instead of
+re-sorting the accumulated result list.
+
+Scalar fields live in indexed columns; the full result record is kept as
+JSON so callers get back the same dicts they stored.  Ligands that stopped
+at a progressive-docking pre-screen (docking_tier "prescreen") count as
+docked but rank after the fully sampled ones.
+
+The database is docking_results.db beside this module (override with
+DOCKING_RESULTS_DB), wherever the pipeline is started from.
+
+Usage:
+    python results_store.py                        # list runs
+    python results_store.py --run <run_id> --top 20
+"""
+
+import argparse
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+
+from rdkit import Chem, RDLogger
+
+# ---------------------------------------------------------------------------
+# Configuration
+# ---------------------------------------------------------------------------
+
+# Shared by every run, so it lives next to the code rather than in
+# whatever directory the pipeline was launched from
+RESULTS_DB = os.environ.get(
+    "DOCKING_RESULTS_DB",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "docking_results.db"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id               INTEGER PRIMARY KEY,
+    run_id           TEXT NOT NULL,
+    protein          TEXT NOT NULL,
+    pdb_id           TEXT,
+    round            INTEGER,
+    name             TEXT NOT NULL,
+    smiles           TEXT,
+    inchikey         TEXT,
+    source           TEXT,
+    source_cid       INTEGER,
+    confidence_score REAL,
+    confidence_raw   REAL,
+    docking_tier     TEXT,
+    data             TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_results_run_score   ON results (run_id, confidence_score DESC);
+CREATE INDEX IF NOT EXISTS idx_results_run_protein ON results (run_id, protein, confidence_score DESC);
+CREATE INDEX IF NOT EXISTS idx_results_run_round   ON results (run_id, round);
+CREATE INDEX IF NOT EXISTS idx_results_inchikey    ON results (inchikey, protein);
+CREATE INDEX IF NOT EXISTS idx_results_source_cid  ON results (source_cid);
+"""
+
+# One row per (run, round, target, ligand): re-adding a checkpointed
+# target after a crash or resume is a no-op instead of a duplicate.
+UNIQUE_INDEX = """
+CREATE UNIQUE INDEX IF NOT EXISTS idx_results_unique
+    ON results (run_id, IFNULL(round, 0), protein, name);
+"""
+
+# Pre-screen scores come from fewer samples; rank them after the full tier
+RANK_ORDER = "(docking_tier IS 'prescreen'), confidence_score DESC"
+
+_CID_RE = re.compile(r"cid_(\d+)")
+
+RDLogger.DisableLog("rdApp.*")
+
+
+def inchikey_for(smiles: str | None) -> str | None:
+    """InChIKey for a SMILES string, or None if RDKit cannot parse it."""
+    if not smiles:
+        return None
+    mol = Chem.MolFromSmiles(smiles)
+    if mol is None:
+        return None
+    return Chem.MolToInchiKey(mol) or None
+
+
+def source_cid(source: str | None) -> int | None:
+    """PubChem CID embedded in a result's source tag (pubchem_cid_123, …)."""
+    match = _CID_RE.search(source or "")
+    return int(match.group(1)) if match else None
+
+
+# ---------------------------------------------------------------------------
+# Store
+# ---------------------------------------------------------------------------
+
+class ResultsStore:
+    """SQLite-backed docking results, safe to share between threads."""
+
+    def __init__(self, db_path: str = RESULTS_DB):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._ensure_tier_column()
+        self._ensure_unique()
+
+    def _ensure_tier_column(self):
+        """Add the docking_tier column to databases written before it."""
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(results)")}
+        if "docking_tier" not in columns:
+            with self._conn:
+                self._conn.execute("ALTER TABLE results ADD COLUMN docking_tier TEXT")
+
+    def _ensure_unique(self):
+        """Create the uniqueness index, first dropping duplicate rows that
+        databases written before it may hold (the earliest copy is kept)."""
+        exists = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_results_unique'"
+        ).fetchone()
+        if exists:
+            return
+        with self._conn:
+            self._conn.execute(
+                "DELETE FROM results WHERE id NOT IN (SELECT MIN(id) FROM results"
+                " GROUP BY run_id, IFNULL(round, 0), protein, name)")
+            self._conn.executescript(UNIQUE_INDEX)
+
+    def close(self):
+        self._conn.close()
+
+    def _query(self, sql: str, params=()) -> list[tuple]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    # ----- writes -----
+
+    def add_results(self, run_id: str, results: list[dict]) -> int:
+        """Insert docking results for a run.  Results already stored for
+        the same round, target and ligand are skipped.  Returns rows
+        inserted."""
+        rows = []
+        for r in results:
+            rows.append((
+                run_id,
+                r.get("protein_target", "unknown"),
+                r.get("pdb_id"),
+                r.get("round"),
+                r["name"],
+                r.get("smiles"),
+                r.get("inchikey") or inchikey_for(r.get("smiles")),
+                r.get("source"),
+                source_cid(r.get("source")),
+                r.get("confidence_score"),
+                r.get("confidence_raw"),
+                r.get("docking_tier"),
+                json.dumps(r, ensure_ascii=False),
+            ))
+        with self._lock, self._conn:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO results (run_id, protein, pdb_id, round, name, smiles,"
+                " inchikey, source, source_cid, confidence_score, confidence_raw,"
+                " docking_tier, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            return self._conn.total_changes - before
+
+    def delete_run(self, run_id: str, min_round: int | None = None) -> int:
+        """Remove a run's results (optionally only rounds >= min_round)."""
+        with self._lock, self._conn:
+            if min_round is None:
+                cur = self._conn.execute("DELETE FROM results WHERE run_id = ?", (run_id,))
+            else:
+                cur = self._conn.execute(
+                    "DELETE FROM results WHERE run_id = ? AND round >= ?", (run_id, min_round))
+        return cur.rowcount
+
+    # ----- queries -----
+
+    def count(self, run_id: str | None = None) -> int:
+        if run_id is None:
+            return self._query("SELECT COUNT(*) FROM results")[0][0]
+        return self._query("SELECT COUNT(*) FROM results WHERE run_id = ?", (run_id,))[0][0]
+
+    def top_k(self, run_id: str, k: int = 30, protein: str | None = None) -> list[dict]:
+        """Best-scoring results for a run, optionally for one protein
+        (pre-screened-only ligands after the fully sampled ones)."""
+        if protein is None:
+            rows = self._query(
+                "SELECT data FROM results WHERE run_id = ?"
+                f" ORDER BY {RANK_ORDER} LIMIT ?", (run_id, k))
+        else:
+            rows = self._query(
+                "SELECT data FROM results WHERE run_id = ? AND protein = ?"
+                f" ORDER BY {RANK_ORDER} LIMIT ?", (run_id, protein, k))
+        return [json.loads(row[0]) for row in rows]
+
+    def top_k_per_target(self, run_id: str, k: int = 10) -> dict[str, list[dict]]:
+        """Top-K results for every protein docked in a run."""
+        proteins = [row[0] for row in self._query(
+            "SELECT DISTINCT protein FROM results WHERE run_id = ?", (run_id,))]
+        return {p: self.top_k(run_id, k, protein=p) for p in proteins}
+
+    def round_delta(self, run_id: str, round_num: int, k: int = 30) -> dict:
+        """What a round changed: how many results it added and which of
+        them made it into the run's overall top-K."""
+        added = self._query(
+            "SELECT COUNT(*) FROM results WHERE run_id = ? AND round = ?",
+            (run_id, round_num))[0][0]
+        top = self.top_k(run_id, k)
+        entered = [r for r in top if r.get("round") == round_num]
+        return {"round": round_num, "added": added, "entered_top_k": entered}
+
+    def is_docked(self, run_id: str, protein: str, smiles: str | None = None,
+                  inchikey: str | None = None, name: str | None = None) -> bool:
+        """Whether a compound was already docked against a protein in a run.
+
+        Matches on InChIKey when one can be derived, otherwise on name.
+        """
+        inchikey = inchikey or inchikey_for(smiles)
+        if inchikey:
+            rows = self._query(
+                "SELECT 1 FROM results WHERE inchikey = ? AND protein = ? AND run_id = ?"
+                " LIMIT 1", (inchikey, protein, run_id))
+        else:
+            rows = self._query(
+                "SELECT 1 FROM results WHERE name = ? AND protein = ? AND run_id = ?"
+                " LIMIT 1", (name, protein, run_id))
+        return bool(rows)
+
+    def seed_cids(self, run_id: str, k: int = 5) -> list[int]:
+        """CIDs of the best-scoring PubChem-sourced compounds in a run."""
+        rows = self._query(
+            "SELECT source_cid FROM results WHERE run_id = ?"
+            " AND source LIKE 'pubchem_cid_%' AND source_cid IS NOT NULL"
+            " GROUP BY source_cid ORDER BY MAX(confidence_score) DESC LIMIT ?",
+            (run_id, k))
+        return [row[0] for row in rows]
+
+    def runs(self) -> list[tuple[str, int, float]]:
+        """(run_id, result count, best score) for every run in the store."""
+        return self._query(
+            "SELECT run_id, COUNT(*), MAX(confidence_score) FROM results"
+            " GROUP BY run_id ORDER BY run_id")
+
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the docking results store.")
+    parser.add_argument("--db", type=str, default=RESULTS_DB,
+                        help=f"SQLite database (default: {RESULTS_DB}).")
+    parser.add_argument("--run", type=str, default=None, help="Run ID to query.")
+    parser.add_argument("--protein", type=str, default=None)
+    parser.add_argument("--top", type=int, default=20)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        print(f"ERROR: {args.db} not found", file=sys.stderr)
+        sys.exit(1)
+    store = ResultsStore(args.db)
+
+    if not args.run:
+        print(f"  {'Run':<50} {'Results':>8} {'Best':>8}")
+        for run_id, n, best in store.runs():
+            print(f"  {run_id:<50} {n:>8} {best or 0:>8.4f}")
+        return
+
+    for i, r in enumerate(store.top_k(args.run, args.top, protein=args.protein)):
+        print(f"  {i+1:<4} {r['name'][:40]:40s} {r.get('protein_target', ''):10s}"
+              f" score={r.get('confidence_score', 0):.4f} round={r.get('round')}")
+
+
+if __name__ == "__main__":
+    main()
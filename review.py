@@ -9,17 +9,20 @@ targetable proteins, and FDA-approved drugs that may interact with them.
 
 import argparse
 import json
-import os
 from dotenv import load_dotenv
 import re
 import sys
+import threading
 import time
 import urllib.parse
 import urllib.request
 import xml.etree.ElementTree as ET
 from datetime import datetime
 
-import requests
+from gene_symbols import extract_targets, unmatched_symbols
+from llm_client import get_client, query_perplexity, with_llm_tags
+from stage_dag import Stage, StageGraph
+from workspace import REVIEW_JSON, REVIEW_MD, add_run_dir_argument, in_run_dir
 
 # ---------------------------------------------------------------------------
 # Configuration
@@ -27,18 +30,63 @@ import requests
 
 load_dotenv()
 
-PERPLEXITY_API_KEY = os.environ.get("PERPLEXITY_API_KEY", "")
-PERPLEXITY_URL = "https://api.perplexity.ai/chat/completions"
-PERPLEXITY_MODEL = "sonar-pro"
-
 ARXIV_API_URL = "http://export.arxiv.org/api/query"
 ARXIV_MAX_RESULTS = 15  # fetch up to 15 papers per query
+ARXIV_MIN_INTERVAL = 3.0  # arXiv asks for at most one request every 3 s
+
+LITERATURE_WORKERS = 4  # literature-graph steps run at once
+FALLBACK_PROTEINS = ["EGFR", "TP53", "KRAS"]
+
+# Structured-output schema for the drug → protein map
+DRUG_MAP_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"schema": {
+        "type": "object",
+        "properties": {
+            "drugs": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "drug": {"type": "string"},
+                        "proteins": {"type": "array", "items": {"type": "string"}},
+                        "mechanism": {"type": "string"},
+                        "fda_status": {"type": "string"},
+                        "category": {"type": "string",
+                                     "enum": ["mainstream", "repurposing_candidate"]},
+                    },
+                    "required": ["drug", "proteins"],
+                },
+            },
+        },
+        "required": ["drugs"],
+    }},
+}
+
+_arxiv_lock = threading.Lock()
+_arxiv_next_slot = 0.0
 
 
 # ---------------------------------------------------------------------------
 # arXiv helpers
 # ---------------------------------------------------------------------------
 
+def _wait_for_arxiv_slot():
+    """Block until this caller may query arXiv.
+
+    Each caller reserves the next free slot under a lock, so concurrent
+    searches are spaced ARXIV_MIN_INTERVAL apart and a lone search after
+    a quiet period does not wait at all.
+    """
+    global _arxiv_next_slot
+    with _arxiv_lock:
+        now = time.monotonic()
+        slot = max(now, _arxiv_next_slot)
+        _arxiv_next_slot = slot + ARXIV_MIN_INTERVAL
+    if slot > now:
+        time.sleep(slot - now)
+
+
 def search_arxiv(query: str, max_results: int = ARXIV_MAX_RESULTS) -> list[dict]:
     """Search arXiv and return a list of paper metadata dicts."""
     params = urllib.parse.urlencode({
@@ -49,6 +97,7 @@ def search_arxiv(query: str, max_results: int = ARXIV_MAX_RESULTS) -> list[dict]
         "sortOrder": "descending",
     })
     url = f"{ARXIV_API_URL}?{params}"
+    _wait_for_arxiv_slot()
     print(f"[arXiv] Querying: {query!r}  (max {max_results} results)")
 
     with urllib.request.urlopen(url, timeout=30) as resp:
@@ -98,41 +147,6 @@ def format_papers_for_prompt(papers: list[dict]) -> str:
     return "\n".join(lines)
 
 
-# ---------------------------------------------------------------------------
-# Perplexity helpers
-# ---------------------------------------------------------------------------
-
-def query_perplexity(system_prompt: str, user_prompt: str) -> str:
-    """Send a chat-completion request to the Perplexity API and return the
-    assistant's reply text."""
-    if not PERPLEXITY_API_KEY:
-        print("ERROR: PERPLEXITY_API_KEY environment variable is not set.",
-              file=sys.stderr)
-        sys.exit(1)
-
-    headers = {
-        "Authorization": f"Bearer {PERPLEXITY_API_KEY}",
-        "Content-Type": "application/json",
-    }
-    payload = {
-        "model": PERPLEXITY_MODEL,
-        "messages": [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt},
-        ],
-        "temperature": 0.3,
-        "max_tokens": 8000,
-    }
-
-    print("[Perplexity] Sending request …")
-    resp = requests.post(PERPLEXITY_URL, json=payload, headers=headers, timeout=120)
-    resp.raise_for_status()
-    data = resp.json()
-    reply = data["choices"][0]["message"]["content"]
-    print(f"[Perplexity] Received {len(reply)} chars.")
-    return reply
-
-
 # ---------------------------------------------------------------------------
 # Main pipeline
 # ---------------------------------------------------------------------------
@@ -169,26 +183,106 @@ def build_repurposing_query(proteins: list[str]) -> str:
 
 
 def extract_proteins_from_text(text: str) -> list[str]:
-    """Ask Perplexity to extract a concise list of protein targets from the
-    first-pass review."""
-    system = (
-        "You are a biomedical research assistant. "
-        "Extract a concise list of protein targets from the following text. "
-        "Return ONLY a Python-style list of short protein names/symbols, "
-        "e.g. ['EGFR', 'HER2', 'BRAF']. No explanation."
-    )
-    raw = query_perplexity(system, text)
-    # Parse the list from the response
-    match = re.search(r"\[.*?\]", raw, re.DOTALL)
-    if match:
-        try:
-            proteins = eval(match.group())  # safe-ish: only short names
-            if isinstance(proteins, list):
-                return [str(p) for p in proteins]
-        except Exception:
-            pass
-    # Fallback: split comma-separated tokens
-    return [tok.strip().strip("'\"") for tok in raw.split(",") if tok.strip()]
+    """Extract a concise list of protein targets from the first-pass
+    review: official HGNC symbols of the genes it mentions most, weighted
+    towards its protein-target sections (see gene_symbols.py)."""
+    return extract_targets(text)
+
+
+def _merge_papers(papers: list[dict], more: list[dict]) -> list[dict]:
+    """Append papers not already present (by arxiv_id), keeping order."""
+    merged = list(papers)
+    seen_ids = {p["arxiv_id"] for p in merged}
+    for p in more:
+        if p["arxiv_id"] not in seen_ids:
+            merged.append(p)
+            seen_ids.add(p["arxiv_id"])
+    return merged
+
+
+def build_literature_graph(cancer_type: str, write_first_review,
+                           write_drug_review) -> StageGraph:
+    """The literature review as a dependency graph.
+
+    Steps write their outputs into a shared dict (the graph's "state"):
+    cancer_papers → first_review → proteins, then the two follow-up arXiv
+    searches and the repurposing discovery run side by side (they only
+    need the protein list), the drug review waits for both searches, and
+    the drug-protein map waits for the drug and repurposing reviews.
+    arXiv politeness is enforced inside search_arxiv.
+
+    write_first_review(cancer_papers) -> markdown
+    write_drug_review(proteins, cancer_papers, drug_papers) -> markdown
+      are the caller's prompt-specific steps.
+    """
+    def cancer_papers(ctx):
+        print(">> Searching arXiv for papers on", cancer_type)
+        ctx["cancer_papers"] = search_arxiv(build_cancer_query(cancer_type))
+
+    def first_review(ctx):
+        print(">> Generating literature review via Perplexity …")
+        ctx["first_review"] = write_first_review(ctx["cancer_papers"])
+
+    def proteins(ctx):
+        print(">> Extracting protein targets …")
+        found = extract_proteins_from_text(ctx["first_review"])
+        unmatched = unmatched_symbols(ctx["first_review"])
+        if unmatched:
+            print("    (Gene-like names not in the symbol table: "
+                  + ", ".join(token for token, _ in unmatched[:10]) + ")")
+        if not found:
+            found = list(FALLBACK_PROTEINS)
+            print(f"    (Using fallback protein list: {found})")
+        print(f"    Identified proteins: {found}")
+        ctx["proteins"] = found
+
+    def drug_search(ctx):
+        print(">> Searching arXiv for mainstream drugs targeting these proteins …")
+        ctx["drug_search"] = search_arxiv(build_drug_query(cancer_type, ctx["proteins"]))
+
+    def repurposing_search(ctx):
+        print(">> Searching arXiv for drug-repurposing & off-target interaction studies …")
+        ctx["repurposing_search"] = search_arxiv(build_repurposing_query(ctx["proteins"]))
+
+    def repurposing_review(ctx):
+        print(">> Searching for non-obvious repurposable FDA drugs via Perplexity …")
+        ctx["repurposing_review"] = _discover_repurposing_candidates(cancer_type, ctx["proteins"])
+
+    def drug_review(ctx):
+        ctx["drug_papers"] = _merge_papers(ctx["drug_search"], ctx["repurposing_search"])
+        print(">> Generating drug analysis via Perplexity …")
+        ctx["drug_review"] = write_drug_review(
+            ctx["proteins"], ctx["cancer_papers"], ctx["drug_papers"])
+
+    def drug_map(ctx):
+        print(">> Extracting drug-protein map …")
+        combined = ctx["drug_review"] + "\n\n" + ctx["repurposing_review"]
+        ctx["drug_map"] = _extract_drug_protein_map(combined, cancer_type, ctx["proteins"])
+
+    return StageGraph([
+        Stage("cancer_papers", cancer_papers),
+        Stage("first_review", first_review, deps=("cancer_papers",)),
+        Stage("proteins", proteins, deps=("first_review",)),
+        Stage("drug_search", drug_search, deps=("proteins",)),
+        Stage("repurposing_search", repurposing_search, deps=("proteins",)),
+        Stage("repurposing_review", repurposing_review, deps=("proteins",)),
+        Stage("drug_review", drug_review, deps=("drug_search", "repurposing_search")),
+        Stage("drug_map", drug_map, deps=("drug_review", "repurposing_review")),
+    ])
+
+
+def run_literature_graph(cancer_type: str, write_first_review, write_drug_review) -> dict:
+    """Execute build_literature_graph and return its outputs.
+
+    Each step's LLM calls are tagged with the step's name as their purpose.
+    """
+    graph = build_literature_graph(cancer_type, write_first_review, write_drug_review)
+    for step in graph.stages.values():
+        step.run = with_llm_tags(step.run, purpose=step.name)
+    ctx = {}
+    graph.execute(ctx, max_workers=LITERATURE_WORKERS)
+    ctx.pop("stage_fingerprints", None)
+    return ctx
 
 
 def main():
@@ -203,125 +297,94 @@ def main():
     parser.add_argument(
         "-o", "--output",
         type=str,
-        default="review.md",
-        help="Output Markdown file (default: review.md).",
+        default=REVIEW_MD,
+        help=f"Output Markdown file (default: {REVIEW_MD}).",
     )
+    add_run_dir_argument(parser)
     args = parser.parse_args()
+    if not get_client().api_key:
+        print("ERROR: PERPLEXITY_API_KEY environment variable is not set.",
+              file=sys.stderr)
+        sys.exit(1)
 
     cancer_type = args.prompt.strip()
-    output_file = args.output
+    output_file = in_run_dir(args.run_dir, args.output, REVIEW_MD)
+    review_json = in_run_dir(args.run_dir, REVIEW_JSON, REVIEW_JSON)
 
     print(f"\n{'='*60}")
     print(f"  Literature Review Generator  —  {cancer_type}")
     print(f"{'='*60}\n")
 
-    # ----- Step 1: Search arXiv for cancer papers -----
-    print(">> Step 1: Searching arXiv for papers on", cancer_type)
-    cancer_query = build_cancer_query(cancer_type)
-    cancer_papers = search_arxiv(cancer_query, max_results=ARXIV_MAX_RESULTS)
-
-    if not cancer_papers:
-        print("No papers found on arXiv. Try a different cancer type.",
-              file=sys.stderr)
-        sys.exit(1)
-
-    cancer_papers_text = format_papers_for_prompt(cancer_papers)
-
-    # ----- Step 2: Generate first-pass review (cancer + proteins) -----
-    print("\n>> Step 2: Generating literature review via Perplexity …")
-    system_review = (
-        "You are an expert oncology researcher. Write a detailed, scholarly "
-        "literature review in Markdown format. Use inline citations like "
-        "[1], [2], etc., referencing the papers provided. Include proper "
-        "section headings."
-    )
-    user_review = (
-        f"Using the following arXiv papers as primary references, write a "
-        f"comprehensive literature review about **{cancer_type}**.\n\n"
-        f"The review MUST include:\n"
-        f"1. An introduction to {cancer_type} (epidemiology, significance).\n"
-        f"2. Molecular and genetic landscape of {cancer_type}.\n"
-        f"3. **Key protein targets** that should be targeted for treatment "
-        f"(explain the biological rationale for each).\n"
-        f"4. Current therapeutic strategies and clinical relevance.\n"
-        f"5. A references section listing each paper.\n\n"
-        f"Papers:\n{cancer_papers_text}"
-    )
-    first_review = query_perplexity(system_review, user_review)
-
-    # ----- Step 3: Extract protein targets -----
-    print("\n>> Step 3: Extracting protein targets …")
-    proteins = extract_proteins_from_text(first_review)
-    print(f"    Identified proteins: {proteins}")
-
-    if not proteins:
-        proteins = ["EGFR", "p53", "KRAS"]  # sensible fallback
-        print(f"    (Using fallback protein list: {proteins})")
-
-    # ----- Step 4a: Search arXiv for mainstream drugs -----
-    # Brief pause to respect arXiv rate limits (≤1 req / 3 sec)
-    time.sleep(3)
-    print("\n>> Step 4a: Searching arXiv for mainstream drugs targeting these proteins …")
-    drug_query = build_drug_query(cancer_type, proteins)
-    drug_papers = search_arxiv(drug_query, max_results=ARXIV_MAX_RESULTS)
-
-    # ----- Step 4b: Broader repurposing / docking / off-target search -----
-    time.sleep(3)
-    print("\n>> Step 4b: Searching arXiv for drug-repurposing & off-target interaction studies …")
-    repurpose_query = build_repurposing_query(proteins)
-    repurpose_papers = search_arxiv(repurpose_query, max_results=ARXIV_MAX_RESULTS)
-
-    # Deduplicate by arxiv_id, keeping order
-    seen_ids = {p["arxiv_id"] for p in drug_papers}
-    for rp in repurpose_papers:
-        if rp["arxiv_id"] not in seen_ids:
-            drug_papers.append(rp)
-            seen_ids.add(rp["arxiv_id"])
-
-    drug_papers_text = format_papers_for_prompt(drug_papers) if drug_papers else "(No papers found.)"
-
-    # ----- Step 5a: Generate drug section -----
-    print("\n>> Step 5a: Generating mainstream drug analysis via Perplexity …")
-
-    # Reference numbering continues from the cancer papers
-    offset = len(cancer_papers)
-    re_numbered_drug_text = drug_papers_text
-    if drug_papers:
-        for i, _ in enumerate(drug_papers, 1):
-            re_numbered_drug_text = re_numbered_drug_text.replace(
-                f"[{i}]", f"[{i + offset}]", 1
-            )
-
-    system_drugs = (
-        "You are an expert pharmacology researcher. Write a detailed Markdown "
-        "section for a literature review. Use inline citations like [N] "
-        "referencing the papers provided (numbering starts as indicated). "
-        "Be precise about drug names, mechanisms, and protein interactions."
-    )
-    user_drugs = (
-        f"Continue the literature review on **{cancer_type}**.\n\n"
-        f"The identified protein targets are: {', '.join(proteins)}.\n\n"
-        f"Using the arXiv papers below (citation numbers start at "
-        f"[{offset + 1}]), write the following sections:\n\n"
-        f"1. **FDA-Approved Drugs and Candidate Compounds**: For each protein "
-        f"target, discuss FDA-approved drugs (or promising candidates) that "
-        f"bind to or inhibit these proteins. Include drug names, mechanism of "
-        f"action, and clinical evidence.\n"
-        f"2. **Drug–Protein Interaction Summary Table** (Markdown table): "
-        f"columns = Protein Target | Drug Name | Mechanism | FDA Status | Key Ref.\n"
-        f"3. **Conclusion and Future Directions**: Summarise the therapeutic "
-        f"landscape and open research questions.\n"
-        f"4. **References** for papers [{offset + 1}] onward.\n\n"
-        f"Papers:\n{re_numbered_drug_text}"
-    )
-    drug_review = query_perplexity(system_drugs, user_drugs)
+    # ----- Steps 1-5: searches and Perplexity calls, run as a graph -----
+    def write_first_review(cancer_papers):
+        if not cancer_papers:
+            print("No papers found on arXiv. Try a different cancer type.",
+                  file=sys.stderr)
+            sys.exit(1)
+        cancer_papers_text = format_papers_for_prompt(cancer_papers)
+        system_review = (
+            "You are an expert oncology researcher. Write a detailed, scholarly "
+            "literature review in Markdown format. Use inline citations like "
+            "[1], [2], etc., referencing the papers provided. Include proper "
+            "section headings."
+        )
+        user_review = (
+            f"Using the following arXiv papers as primary references, write a "
+            f"comprehensive literature review about **{cancer_type}**.\n\n"
+            f"The review MUST include:\n"
+            f"1. An introduction to {cancer_type} (epidemiology, significance).\n"
+            f"2. Molecular and genetic landscape of {cancer_type}.\n"
+            f"3. **Key protein targets** that should be targeted for treatment "
+            f"(explain the biological rationale for each).\n"
+            f"4. Current therapeutic strategies and clinical relevance.\n"
+            f"5. A references section listing each paper.\n\n"
+            f"Papers:\n{cancer_papers_text}"
+        )
+        return query_perplexity(system_review, user_review)
+
+    def write_drug_review(proteins, cancer_papers, drug_papers):
+        drug_papers_text = format_papers_for_prompt(drug_papers) if drug_papers else "(No papers found.)"
+
+        # Reference numbering continues from the cancer papers
+        offset = len(cancer_papers)
+        re_numbered_drug_text = drug_papers_text
+        if drug_papers:
+            for i, _ in enumerate(drug_papers, 1):
+                re_numbered_drug_text = re_numbered_drug_text.replace(
+                    f"[{i}]", f"[{i + offset}]", 1
+                )
+
+        system_drugs = (
+            "You are an expert pharmacology researcher. Write a detailed Markdown "
+            "section for a literature review. Use inline citations like [N] "
+            "referencing the papers provided (numbering starts as indicated). "
+            "Be precise about drug names, mechanisms, and protein interactions."
+        )
+        user_drugs = (
+            f"Continue the literature review on **{cancer_type}**.\n\n"
+            f"The identified protein targets are: {', '.join(proteins)}.\n\n"
+            f"Using the arXiv papers below (citation numbers start at "
+            f"[{offset + 1}]), write the following sections:\n\n"
+            f"1. **FDA-Approved Drugs and Candidate Compounds**: For each protein "
+            f"target, discuss FDA-approved drugs (or promising candidates) that "
+            f"bind to or inhibit these proteins. Include drug names, mechanism of "
+            f"action, and clinical evidence.\n"
+            f"2. **Drug–Protein Interaction Summary Table** (Markdown table): "
+            f"columns = Protein Target | Drug Name | Mechanism | FDA Status | Key Ref.\n"
+            f"3. **Conclusion and Future Directions**: Summarise the therapeutic "
+            f"landscape and open research questions.\n"
+            f"4. **References** for papers [{offset + 1}] onward.\n\n"
+            f"Papers:\n{re_numbered_drug_text}"
+        )
+        return query_perplexity(system_drugs, user_drugs)
 
-    # ----- Step 5b: Speculative / repurposing drug discovery via Perplexity -----
-    print("\n>> Step 5b: Searching for non-obvious repurposable FDA drugs via Perplexity …")
-    repurposing_review = _discover_repurposing_candidates(cancer_type, proteins)
+    lit = run_literature_graph(cancer_type, write_first_review, write_drug_review)
+    cancer_papers, drug_papers = lit["cancer_papers"], lit["drug_papers"]
+    first_review, drug_review = lit["first_review"], lit["drug_review"]
+    repurposing_review = lit["repurposing_review"]
 
     # ----- Step 6: Assemble final document -----
-    print("\n>> Step 6: Assembling final Markdown document …")
+    print("\n>> Assembling final Markdown document …")
 
     # Build combined references
     all_papers = cancer_papers + drug_papers
@@ -344,18 +407,13 @@ def main():
     with open(output_file, "w", encoding="utf-8") as f:
         f.write(final_md)
 
-    # ----- Step 7: Generate review.json (drug → protein mapping) -----
-    print("\n>> Step 7: Generating review.json (drug–protein mapping) …")
-    combined_drug_text = drug_review + "\n\n" + repurposing_review
-    drug_protein_json = _extract_drug_protein_map(
-        combined_drug_text, cancer_type, proteins
-    )
-    with open("review.json", "w", encoding="utf-8") as f:
-        json.dump(drug_protein_json, f, indent=2, ensure_ascii=False)
+    # ----- Step 7: Write review.json (drug → protein mapping) -----
+    with open(review_json, "w", encoding="utf-8") as f:
+        json.dump(lit["drug_map"], f, indent=2, ensure_ascii=False)
 
     print(f"\n{'='*60}")
     print(f"  Review saved to: {output_file}")
-    print(f"  Drug map saved to: review.json")
+    print(f"  Drug map saved to: {review_json}")
     print(f"  Total papers cited: {len(all_papers)}")
     print(f"{'='*60}\n")
 
@@ -426,10 +484,17 @@ def _extract_drug_protein_map(drug_review_text: str, cancer_type: str, proteins:
         f"speculative candidates as \"repurposing_candidate\".\n\n"
         f"Text:\n{drug_review_text}"
     )
-    raw = query_perplexity(system, user)
+    raw = query_perplexity(system, user, response_format=DRUG_MAP_RESPONSE_FORMAT)
     data = _parse_json_response(raw)
 
-    # If first attempt fails, ask Perplexity to fix it
+    # Truncated or malformed output: keep every complete drug object
+    if "_parse_error" in data:
+        salvaged = _salvage_json_objects(raw, required_key="drug")
+        if salvaged:
+            print(f"    JSON was malformed; salvaged {len(salvaged)} complete drug entries")
+            data = {"drugs": salvaged}
+
+    # Nothing salvageable: ask Perplexity to fix it
     if "_parse_error" in data:
         print("[Perplexity] JSON parse failed, requesting cleaned JSON …")
         fix_system = (
@@ -437,7 +502,7 @@ def _extract_drug_protein_map(drug_review_text: str, cancer_type: str, proteins:
             "JSON. Return ONLY the corrected, valid JSON. No explanation, no "
             "markdown fences."
         )
-        fixed_raw = query_perplexity(fix_system, raw)
+        fixed_raw = query_perplexity(fix_system, raw, purpose="drug_map_repair")
         data = _parse_json_response(fixed_raw)
 
     # Ensure consistent top-level structure
@@ -491,6 +556,33 @@ def _parse_json_response(raw: str) -> dict:
     return {"drugs": [], "_parse_error": "Could not parse LLM response"}
 
 
+def _salvage_json_objects(raw: str, required_key: str) -> list[dict]:
+    """Recover every complete JSON object carrying ``required_key`` from
+    truncated or malformed output (unterminated strings, missing closing
+    brackets, prose around or between entries).
+
+    Scans for each "{" and decodes the object starting there; complete
+    objects are kept and skipped over, broken ones are stepped into so
+    that complete objects nested inside them are still found.
+    """
+    cleaned = re.sub(r",\s*([}\]])", r"\1", raw)
+    decoder = json.JSONDecoder(strict=False)
+    found = []
+    pos = cleaned.find("{")
+    while pos != -1:
+        try:
+            obj, end = decoder.raw_decode(cleaned, pos)
+        except json.JSONDecodeError:
+            pos = cleaned.find("{", pos + 1)
+            continue
+        if isinstance(obj, dict) and required_key in obj:
+            found.append(obj)
+            pos = cleaned.find("{", end)
+        else:
+            pos = cleaned.find("{", pos + 1)
+    return found
+
+
 def _build_references(papers: list[dict]) -> str:
     lines = []
     for i, p in enumerate(papers, 1):
@@ -39,6 +39,8 @@ MAX_CHAT_CHARS = int(os.getenv("MAX_CHAT_CHARS", "3500"))
 SEND_RETRIES = int(os.getenv("SEND_RETRIES", "3"))
 SEND_RETRY_DELAY_SECONDS = float(os.getenv("SEND_RETRY_DELAY_SECONDS", "1.0"))
 SEND_PACING_SECONDS = float(os.getenv("SEND_PACING_SECONDS", "0.5"))
+# Minimum gap between relayed in-stage progress messages (per stage)
+PROGRESS_RELAY_SECONDS = float(os.getenv("PROGRESS_RELAY_SECONDS", "15"))
 LAST_PAPER_BY_SENDER: Dict[str, str] = {}
 
 
@@ -91,12 +93,23 @@ def post_json(path: str, payload: Dict[str, Any], timeout_seconds: int) -> Dict[
 
 
 def collect_sse_events(
-    path: str, payload: Dict[str, Any], timeout_seconds: int
+    path: str,
+    payload: Dict[str, Any],
+    timeout_seconds: int,
+    on_event: Optional[Callable[[Dict[str, Any]], None]] = None,
 ) -> List[Dict[str, Any]]:
-    """Read server-sent events and return parsed JSON `data:` payloads."""
+    """Read server-sent events and return parsed JSON `data:` payloads.
+
+    on_event, if given, is called with each payload as soon as it arrives.
+    """
     events: List[Dict[str, Any]] = []
     data_lines: List[str] = []
 
+    def add(event: Dict[str, Any]) -> None:
+        events.append(event)
+        if on_event is not None:
+            on_event(event)
+
     with requests.post(
         f"{API_BASE}{path}",
         json=payload,
@@ -115,16 +128,19 @@ def collect_sse_events(
                 raw_json = "\n".join(data_lines)
                 data_lines = []
                 try:
-                    events.append(json.loads(raw_json))
+                    event = json.loads(raw_json)
                 except json.JSONDecodeError:
                     continue
+                add(event)
 
     if data_lines:
         raw_json = "\n".join(data_lines)
         try:
-            events.append(json.loads(raw_json))
+            event = json.loads(raw_json)
         except json.JSONDecodeError:
-            pass
+            event = None
+        if event is not None:
+            add(event)
 
     return events
 
@@ -181,6 +197,27 @@ async def run_pipeline_with_updates(
         if progress_cb is not None:
             await progress_cb(message)
 
+    loop = asyncio.get_running_loop()
+
+    def relay(stage: str) -> Optional[Callable[[Dict[str, Any]], None]]:
+        """SSE callback that forwards a stage's progress messages to the
+        user while the stage is still running (throttled)."""
+        if progress_cb is None:
+            return None
+        last_sent = [0.0]
+
+        def on_event(event: Dict[str, Any]) -> None:
+            message = event.get("message")
+            if event.get("type") != "progress" or not message:
+                return
+            now = loop.time()
+            if now - last_sent[0] < PROGRESS_RELAY_SECONDS:
+                return
+            last_sent[0] = now
+            asyncio.run_coroutine_threadsafe(emit(f"{stage}: {message}"), loop)
+
+        return on_event
+
     ctx.logger.info(f"Pipeline start for cancerType='{cancer_type}'")
 
     # 1) Literature review (SSE)
@@ -191,6 +228,7 @@ async def run_pipeline_with_updates(
         "/api/review",
         {"cancerType": cancer_type},
         300,
+        relay("Stage 1/5"),
     )
     proteins: List[str] = []
     drugs: List[Dict[str, Any]] = []
@@ -229,6 +267,7 @@ async def run_pipeline_with_updates(
         "/api/structures",
         {"proteins": proteins, "drugs": drugs},
         240,
+        relay("Stage 2/5"),
     )
     targets: List[Dict[str, Any]] = []
     for event in structures_events:
@@ -260,6 +299,7 @@ async def run_pipeline_with_updates(
         "/api/dock",
         {"targets": targets, "round": 1},
         1200,
+        relay("Stage 3/5"),
     )
     all_results: List[Dict[str, Any]] = []
     for event in dock_events:
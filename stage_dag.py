@@ -0,0 +1,220 @@
+"""
+Stage DAG executor
+
+A small make-style engine for the pipeline.  Each stage declares the
+stages it depends on and the state parameters it reads; its fingerprint is
+a hash of those parameter values and of its dependencies' fingerprints.
+After a stage completes its fingerprint is recorded in
+state["stage_fingerprints"].  On the next execution a stage is skipped when
+its recorded fingerprint still matches and none of its dependencies ran;
+otherwise its previous outputs are reset (if it declares a reset hook) and
+it runs again.  Stages whose dependencies are satisfied run concurrently.
+
+A stage that was interrupted has no fingerprint, so it is re-entered
+without a reset and can pick up its own checkpoints.
+
+Stages may also declare the artifact files they write (relative to
+state["run_dir"]).  Their content hashes are recorded in
+state["stage_outputs"] when the stage completes; a recorded artifact that
+has since been deleted or edited makes the stage out of date.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class Stage:
+    """One node of the pipeline graph.
+
+    run:    callable(state) -> state
+    deps:   names of stages that must complete first
+    params: state keys whose values feed the fingerprint
+    reset:  optional callable(state) that clears this stage's previous
+            outputs before it re-runs with changed inputs
+    outputs: artifact files the stage writes, relative to state["run_dir"]
+    """
+
+    def __init__(self, name: str, run, deps: tuple = (), params: tuple = (),
+                 reset=None, outputs: tuple = ()):
+        self.name = name
+        self.run = run
+        self.deps = tuple(deps)
+        self.params = tuple(params)
+        self.reset = reset
+        self.outputs = tuple(outputs)
+
+
+def _file_hash(path: str) -> str | None:
+    """SHA-1 of a file's content, or None if it does not exist."""
+    if not os.path.exists(path):
+        return None
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()[:16]
+
+
+class StageGraph:
+    def __init__(self, stages: list[Stage]):
+        self.stages = {s.name: s for s in stages}
+        for s in stages:
+            for d in s.deps:
+                if d not in self.stages:
+                    raise ValueError(f"Stage {s.name!r} depends on unknown stage {d!r}")
+        self.order = self._topological_order()
+
+    def _topological_order(self) -> list[str]:
+        order, visiting, done = [], set(), set()
+
+        def visit(name):
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError(f"Cycle in stage graph at {name!r}")
+            visiting.add(name)
+            for d in self.stages[name].deps:
+                visit(d)
+            visiting.discard(name)
+            done.add(name)
+            order.append(name)
+
+        for name in self.stages:
+            visit(name)
+        return order
+
+    def fingerprints(self, state) -> dict[str, str]:
+        """Current fingerprint of every stage given the state's parameters."""
+        fps = {}
+        for name in self.order:
+            stage = self.stages[name]
+            payload = {
+                "stage": name,
+                "params": {p: state.get(p) for p in stage.params},
+                "deps": [fps[d] for d in stage.deps],
+            }
+            fps[name] = hashlib.sha1(
+                json.dumps(payload, sort_keys=True, default=str).encode("utf-8")
+            ).hexdigest()[:16]
+        return fps
+
+    def output_hashes(self, state, name: str) -> dict[str, str | None]:
+        """Current content hash of each artifact the stage declares."""
+        run_dir = state.get("run_dir", ".")
+        return {out: _file_hash(os.path.join(run_dir, out))
+                for out in self.stages[name].outputs}
+
+    def _outputs_changed(self, state, name: str) -> bool:
+        """A recorded artifact of the stage was deleted or edited since."""
+        recorded = (state.get("stage_outputs") or {}).get(name) or {}
+        if not recorded:
+            return False
+        current = self.output_hashes(state, name)
+        return any(current.get(out) != h for out, h in recorded.items())
+
+    def _record_outputs(self, state, name: str):
+        hashes = {out: h for out, h in self.output_hashes(state, name).items() if h}
+        state["stage_outputs"] = {**(state.get("stage_outputs") or {}), name: hashes}
+
+    def plan(self, state) -> list[tuple[str, str]]:
+        """(stage, action) in execution order; action is 'skip', 'run'
+        (new or interrupted) or 'rerun' (inputs changed, or its artifacts
+        were deleted or edited, since it completed)."""
+        fps = self.fingerprints(state)
+        recorded = state.get("stage_fingerprints") or {}
+        will_run = set()
+        plan = []
+        for name in self.order:
+            stage = self.stages[name]
+            upstream_ran = any(d in will_run for d in stage.deps)
+            if name not in recorded:
+                action = "run"
+            elif (recorded[name] != fps[name] or upstream_ran
+                  or self._outputs_changed(state, name)):
+                action = "rerun"
+            else:
+                action = "skip"
+            if action != "skip":
+                will_run.add(name)
+            plan.append((name, action))
+        return plan
+
+    def execute(self, state, on_complete=None, max_workers: int = 2):
+        """Run every stage that is not up to date.
+
+        Stages run on worker threads only while several are ready at once;
+        a lone ready stage (the usual case in a chain) runs on the calling
+        thread.
+
+        on_complete(state) is called (under a lock) after each stage has
+        recorded its fingerprint — the pipeline uses it to persist state.
+        """
+        fps = self.fingerprints(state)
+        actions = dict(self.plan(state))
+        state.setdefault("stage_fingerprints", {})
+        lock = threading.Lock()
+        finished = {n for n, a in actions.items() if a == "skip"}
+        for name in self.order:
+            if actions[name] == "skip":
+                print(f"  [DAG] {name}: up to date, skipping")
+
+        def run_stage(name):
+            stage = self.stages[name]
+            if actions[name] == "rerun":
+                print(f"  [DAG] {name}: inputs changed, re-running")
+                with lock:
+                    fingerprints = dict(state["stage_fingerprints"])
+                    fingerprints.pop(name, None)
+                    state["stage_fingerprints"] = fingerprints
+                if stage.reset:
+                    stage.reset(state)
+            stage.run(state)
+            with lock:
+                if stage.outputs:
+                    self._record_outputs(state, name)
+                state["stage_fingerprints"] = {**state["stage_fingerprints"], name: fps[name]}
+                if on_complete:
+                    on_complete(state)
+
+        pending = [n for n in self.order if n not in finished]
+        running = {}
+        pool = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            while pending or running:
+                ready = [n for n in pending
+                         if all(d in finished for d in self.stages[n].deps)]
+                if len(ready) == 1 and not running:
+                    # Nothing to overlap with: run it on this thread, so
+                    # Ctrl-C interrupts the stage instead of waiting for it
+                    pending.remove(ready[0])
+                    run_stage(ready[0])
+                    finished.add(ready[0])
+                    continue
+                for name in ready:
+                    pending.remove(name)
+                    running[pool.submit(run_stage, name)] = name
+                if not running:
+                    raise RuntimeError(f"Stages cannot be scheduled: {pending}")
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    name = running.pop(fut)
+                    fut.result()  # re-raise stage failures
+                    finished.add(name)
+        except BaseException:
+            # Start nothing new and do not wait for stages still running
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+        pool.shutdown()
+        return state
+
+    def adopt(self, state, completed: list[str]):
+        """Record current fingerprints for stages a pre-DAG state already
+        completed (derived from its status string)."""
+        fps = self.fingerprints(state)
+        state["stage_fingerprints"] = {n: fps[n] for n in completed if n in fps}
+        for name in completed:
+            if name in fps and self.stages[name].outputs:
+                self._record_outputs(state, name)
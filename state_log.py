@@ -0,0 +1,474 @@
+#!/usr/bin/env python3
+"""
+Pipeline State Log
+
+Persists pipeline state as a snapshot (pipeline_state.json) plus an
+append-only event log (pipeline_state.events.jsonl).  Each save appends only
+the keys that changed since the previous save; lists that grew (docking
+results, hypotheses, expansion history, …) are written as ``extend`` events
+carrying just the new items.  Once the log outgrows the snapshot it is
+compacted: the full state is written as a new snapshot and the log is
+truncated.
+
+Every event has a sequence number and the snapshot records the last one it
+contains, so a crash between writing the snapshot and truncating the log
+never replays an event twice.
+
+Snapshots come with an offset index (pipeline_state.index.json) giving the
+byte range of each top-level value.  load(lazy=True) parses only the
+small values up front and leaves large sections (docking results, markdown
+documents) unread until they are accessed, then reads just their byte
+range, so a resume that only needs the status starts immediately.
+
+Usage:
+    python state_log.py                      # show current status
+    python state_log.py --compact            # fold the log into the snapshot
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+from collections.abc import MutableMapping
+
+# ---------------------------------------------------------------------------
+# Configuration
+# ---------------------------------------------------------------------------
+
+STATE_FILE = "pipeline_state.json"
+
+# Compact once the log is this many times larger than the snapshot
+# (or larger than COMPACT_MIN_BYTES when there is no snapshot yet).
+COMPACT_RATIO = 2.0
+COMPACT_MIN_BYTES = 4 * 1024 * 1024
+
+SEQ_KEY = "_event_seq"
+
+# Top-level values larger than this (serialized) are left unparsed by
+# load(lazy=True) until first accessed.
+LAZY_MIN_BYTES = 16 * 1024
+
+
+def _fingerprint(value) -> str:
+    return hashlib.sha1(_encode(value)).hexdigest()
+
+
+def _encode(value) -> bytes:
+    return json.dumps(value, sort_keys=True, ensure_ascii=False).encode("utf-8")
+
+
+def _list_digests(items: list, n: int) -> tuple[str, str]:
+    """(digest of items[:n], digest of all items), hashing each item once."""
+    h = hashlib.sha1()
+    prefix = None
+    for i, item in enumerate(items):
+        if i == n:
+            prefix = h.hexdigest()
+        h.update(_encode(item))
+        h.update(b"\n")
+    full = h.hexdigest()
+    return (full if prefix is None else prefix), full
+
+
+# ---------------------------------------------------------------------------
+# Log
+# ---------------------------------------------------------------------------
+
+class StateLog:
+    """Snapshot + append-only event log for one pipeline state.
+
+    Lists are assumed to grow by appending: if a list is longer than it was
+    at the last save and the items it held then are unchanged (a digest of
+    all of them, so an in-place edit of an earlier item is caught), only the
+    new items are logged.  Anything else (scalars, dicts, edited, replaced or
+    shrunk lists) is logged as a full ``set`` of that key.
+    """
+
+    def __init__(self, snapshot_path: str = STATE_FILE):
+        self.snapshot_path = snapshot_path
+        self.log_path = os.path.splitext(snapshot_path)[0] + ".events.jsonl"
+        self._seq = 0
+        self._shadow: dict[str, tuple] = {}
+        self._fresh: dict[str, tuple] = {}  # list shadows computed by _diff
+
+    # ----- persistence -----
+
+    def exists(self) -> bool:
+        return os.path.exists(self.snapshot_path) or os.path.exists(self.log_path)
+
+    def reset(self):
+        """Forget any previous run stored at this path."""
+        for path in (self.snapshot_path, self.log_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self._seq = 0
+        self._shadow = {}
+
+    def _remember(self, key: str, value):
+        if isinstance(value, list):
+            shadow = self._fresh.pop(key, None)
+            if shadow is None or shadow[1] != len(value):
+                shadow = ("list", len(value), _list_digests(value, len(value))[1])
+            self._shadow[key] = shadow
+        else:
+            self._shadow[key] = ("value", _fingerprint(value))
+
+    def _diff(self, state) -> list[dict]:
+        events = []
+        items = state.loaded_items() if isinstance(state, LazyState) else state.items()
+        for key, value in items:
+            prev = self._shadow.get(key)
+            if isinstance(value, list):
+                prefix, full = _list_digests(value, prev[1] if prev and prev[0] == "list" else 0)
+                self._fresh[key] = ("list", len(value), full)
+            if isinstance(value, list) and prev and prev[0] == "list":
+                _, n, digest = prev
+                if len(value) >= n and prefix == digest:
+                    if len(value) > n:
+                        events.append({"op": "extend", "key": key, "items": value[n:]})
+                    continue
+            elif prev and prev[0] == "value" and prev[1] == _fingerprint(value):
+                continue
+            events.append({"op": "set", "key": key, "value": value})
+        for key in self._shadow.keys() - state.keys():
+            events.append({"op": "delete", "key": key})
+        return events
+
+    def save(self, state) -> int:
+        """Append the changes since the last save.  Returns events written."""
+        events = self._diff(state)
+        if events:
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                for event in events:
+                    self._seq += 1
+                    # seq/op/key lead each line so the lazy loader can
+                    # route events without parsing their payloads.
+                    f.write(json.dumps({"seq": self._seq, **event}, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            for event in events:
+                if event["op"] == "delete":
+                    self._shadow.pop(event["key"], None)
+                else:
+                    self._remember(event["key"], state[event["key"]])
+        self._fresh.clear()
+
+        if self._should_compact():
+            self.compact(state)
+        return len(events)
+
+    def _should_compact(self) -> bool:
+        if not os.path.exists(self.log_path):
+            return False
+        log_size = os.path.getsize(self.log_path)
+        if os.path.exists(self.snapshot_path):
+            return log_size > COMPACT_RATIO * max(os.path.getsize(self.snapshot_path),
+                                                  COMPACT_MIN_BYTES // 4)
+        return log_size > COMPACT_MIN_BYTES
+
+    def compact(self, state=None):
+        """Write the full state as a snapshot and truncate the log.
+
+        The snapshot is plain JSON; a sidecar index records the byte range
+        of every top-level value so load(lazy=True) can parse keys one at a
+        time.
+        """
+        if state is None:
+            state = self.load()
+        snapshot = dict(state)  # materializes any lazy sections
+        snapshot[SEQ_KEY] = self._seq
+
+        offsets = {}
+        tmp = self.snapshot_path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(b"{")
+            for i, (key, value) in enumerate(snapshot.items()):
+                f.write(((", " if i else "") + json.dumps(key) + ": ").encode("utf-8"))
+                data = json.dumps(value, ensure_ascii=False).encode("utf-8")
+                offsets[key] = (f.tell(), len(data))
+                f.write(data)
+            f.write(b"}")
+            size = f.tell()
+        os.replace(tmp, self.snapshot_path)
+        index = {"size": size, SEQ_KEY: self._seq, "keys": offsets}
+        with open(self.index_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        os.replace(self.index_path + ".tmp", self.index_path)
+        # Snapshot now covers every logged event; a crash before this
+        # truncate is harmless because load() skips seq <= _event_seq.
+        open(self.log_path, "w").close()
+        for key, value in snapshot.items():
+            if key != SEQ_KEY:
+                self._remember(key, value)
+
+    @property
+    def index_path(self) -> str:
+        return os.path.splitext(self.snapshot_path)[0] + ".index.json"
+
+    def _read_index(self) -> dict | None:
+        """The snapshot's offset index, if it matches the snapshot on disk."""
+        if not (os.path.exists(self.index_path) and os.path.exists(self.snapshot_path)):
+            return None
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+        if index.get("size") != os.path.getsize(self.snapshot_path):
+            return None
+        return index
+
+    def load(self, lazy: bool = False):
+        """Reconstruct the current state from the snapshot and the log.
+
+        With lazy=True a LazyState is returned: small top-level values are
+        parsed immediately, large ones (docking results, markdown, …) only
+        when first accessed.
+        """
+        self._drop_torn_tail()
+        if lazy:
+            index = self._read_index()
+            if index is not None or not os.path.exists(self.snapshot_path):
+                return self._load_lazy(index)
+
+        state = {}
+        base_seq = 0
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            base_seq = state.pop(SEQ_KEY, 0)
+        self._seq = base_seq
+
+        for event in self._read_events(base_seq):
+            _apply_event(state, event)
+            self._seq = event["seq"]
+
+        self._shadow = {}
+        for key, value in state.items():
+            self._remember(key, value)
+        return state
+
+    def _drop_torn_tail(self):
+        """Truncate a partially written last event, so that events saved
+        after this load start on a line of their own."""
+        if not os.path.exists(self.log_path):
+            return
+        with open(self.log_path, "r+b") as f:
+            end = f.seek(0, os.SEEK_END)
+            pos = end
+            while pos > 0:
+                step = min(64 * 1024, pos)
+                f.seek(pos - step)
+                block = f.read(step)
+                newline = block.rfind(b"\n")
+                if newline >= 0:
+                    pos = pos - step + newline + 1
+                    break
+                pos -= step
+            if pos < end:
+                f.truncate(pos)
+
+    def _read_events(self, base_seq: int):
+        if not os.path.exists(self.log_path):
+            return
+        with open(self.log_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except json.JSONDecodeError:
+                    return  # torn final write
+                if event["seq"] > base_seq:
+                    yield event
+
+    def _load_lazy(self, index: dict | None) -> "LazyState":
+        # Per key: the snapshot byte range (or None) and the log line ranges
+        # of its events, in order.  Nothing is parsed yet.
+        sources: dict[str, list] = {}
+        base_seq = 0
+        if index is not None:
+            base_seq = index.get(SEQ_KEY, 0)
+            for key, (offset, length) in index["keys"].items():
+                if key != SEQ_KEY:
+                    sources[key] = [(offset, length), [], length]
+        self._seq = base_seq
+
+        if os.path.exists(self.log_path):
+            with open(self.log_path, "rb") as f:
+                offset = 0
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break  # torn final write
+                    head = _EVENT_HEAD.match(line)
+                    if head is None:
+                        event = json.loads(line)
+                        seq, op, key = event["seq"], event["op"], event["key"]
+                    else:
+                        seq, op, key = (int(head.group(1)), head.group(2).decode(),
+                                         json.loads(head.group(3)))
+                    if seq > base_seq:
+                        if op == "delete":
+                            sources.pop(key, None)
+                            self._seq = seq
+                            offset += len(line)
+                            continue
+                        entry = sources.setdefault(key, [None, [], 0])
+                        if op == "set":
+                            entry[0] = None  # earlier history is superseded
+                            entry[1] = []
+                            entry[2] = 0
+                        entry[1].append((offset, len(line)))
+                        entry[2] += len(line)
+                        self._seq = seq
+                    offset += len(line)
+
+        # Sections are read with seek/read when first accessed, so no file
+        # stays open (or mapped) for the life of the state; compact()
+        # materializes every pending key before it replaces either file.
+        log_path = self.log_path
+        snapshot_path = self.snapshot_path
+
+        def materialize(key: str):
+            snap_range, event_ranges, _ = sources.pop(key)
+            holder = {}
+            if snap_range is not None:
+                start, length = snap_range
+                with open(snapshot_path, "rb") as f:
+                    f.seek(start)
+                    holder[key] = json.loads(f.read(length))
+            if event_ranges:
+                with open(log_path, "rb") as f:
+                    for start, length in event_ranges:
+                        f.seek(start)
+                        _apply_event(holder, json.loads(f.read(length)))
+            return holder.get(key, _MISSING)
+
+        eager, pending = {}, []
+        for key, (_, _, size) in list(sources.items()):
+            if size > LAZY_MIN_BYTES:
+                pending.append(key)
+                continue
+            value = materialize(key)
+            if value is not _MISSING:
+                eager[key] = value
+
+        self._shadow = {}
+        for key, value in eager.items():
+            self._remember(key, value)
+        return LazyState(eager, pending, materialize, self._remember, self._forget)
+
+    def _forget(self, key: str):
+        # A key deleted before it was loaded: the tombstone makes the next
+        # save log the delete, since the key is no longer in the state
+        self._shadow[key] = ("deleted",)
+
+
+_MISSING = object()
+
+# Leading fields of an event line: {"seq": N, "op": "...", "key": "..."
+_EVENT_HEAD = re.compile(rb'^\{"seq": (\d+), "op": "(\w+)", "key": ("(?:[^"\\]|\\.)*")')
+
+
+def _apply_event(state, event: dict):
+    key = event["key"]
+    if event["op"] == "set":
+        state[key] = event["value"]
+    elif event["op"] == "extend":
+        state.setdefault(key, []).extend(event["items"])
+    elif event["op"] == "delete":
+        state.pop(key, None)
+
+
+# ---------------------------------------------------------------------------
+# Lazy state
+# ---------------------------------------------------------------------------
+
+class LazyState(MutableMapping):
+    """State mapping whose large sections are parsed on first access.
+
+    Behaves like the state dict for everything the pipeline does with it.
+    Keys that were never touched are, by definition, unchanged, so
+    StateLog.save only diffs the loaded ones.
+    """
+
+    def __init__(self, data: dict, pending: list[str], materialize, on_load,
+                 on_delete=None):
+        self._data = data
+        self._pending = set(pending)
+        self._materialize = materialize
+        self._on_load = on_load
+        self._on_delete = on_delete
+
+    def _load(self, key: str):
+        self._pending.discard(key)
+        value = self._materialize(key)
+        if value is not _MISSING:
+            self._data[key] = value
+            self._on_load(key, value)
+
+    def __getitem__(self, key):
+        if key in self._pending:
+            self._load(key)
+        return self._data[key]
+
+    def __setitem__(self, key, value):
+        self._pending.discard(key)
+        self._data[key] = value
+
+    def __delitem__(self, key):
+        if key in self._pending:
+            self._pending.discard(key)
+            if self._on_delete is not None:
+                self._on_delete(key)
+            return
+        del self._data[key]
+
+    def __contains__(self, key) -> bool:
+        return key in self._data or key in self._pending
+
+    def __iter__(self):
+        yield from list(self._data)
+        yield from list(self._pending)
+
+    def __len__(self) -> int:
+        return len(self._data) + len(self._pending)
+
+    def is_loaded(self, key: str) -> bool:
+        return key not in self._pending
+
+    def loaded_items(self):
+        return self._data.items()
+
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or compact pipeline state.")
+    parser.add_argument("snapshot", nargs="?", default=STATE_FILE,
+                        help=f"Snapshot path (default: {STATE_FILE}).")
+    parser.add_argument("--compact", action="store_true",
+                        help="Fold the event log into a fresh snapshot.")
+    args = parser.parse_args()
+
+    log = StateLog(args.snapshot)
+    if not log.exists():
+        print(f"ERROR: No state at {args.snapshot}", file=sys.stderr)
+        sys.exit(1)
+
+    state = log.load(lazy=True)
+    print(f"  Cancer type:  {state.get('cancer_type')}")
+    print(f"  Status:       {state.get('status')}")
+    print(f"  Round:        {state.get('round')}")
+    print(f"  Results:      {len(state.get('all_docking_results', []))}")
+    print(f"  Events:       {log._seq}")
+    if args.compact:
+        log.compact(state)
+        print(f"  Compacted → {args.snapshot} "
+              f"({os.path.getsize(args.snapshot) / 1024:.0f} KB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Docking Telemetry
+
+Structured per-chunk records for DiffDock jobs.  Every chunk submitted by
+agent3.run_docking produces one record (submit time, RunPod queue/cold-start
+delay vs. execution time, payload size, ligand count, retries, final status)
+which is appended to a JSONL file and can be summarised per round.
+
+Summarise an existing telemetry file:
+    python telemetry.py docking_telemetry.jsonl
+    python telemetry.py docking_telemetry.jsonl --round 2
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+# ---------------------------------------------------------------------------
+# Configuration
+# ---------------------------------------------------------------------------
+
+TELEMETRY_FILE = "docking_telemetry.jsonl"
+
+# A chunk whose RunPod delay (time spent queued before a worker picked it up)
+# exceeds this is counted as a cold start.
+COLD_START_THRESHOLD_SECONDS = 30.0
+
+
+# ---------------------------------------------------------------------------
+# Records
+# ---------------------------------------------------------------------------
+
+def new_chunk_record(chunk_idx: int, n_ligands: int, payload_bytes: int,
+                     **tags) -> dict:
+    """Create a chunk record with the submit timestamp filled in.
+
+    Extra keyword arguments (protein, round, samples_per_complex, …) are
+    stored verbatim so records can be grouped later.
+    """
+    now = time.time()
+    record = {
+        "chunk_idx": chunk_idx,
+        "n_ligands": n_ligands,
+        "payload_bytes": payload_bytes,
+        "submitted_at": datetime.fromtimestamp(now).isoformat(),
+        "submitted_ts": now,
+        "job_id": None,
+        "status": "SUBMITTED",
+        "retries": 0,
+        "delay_seconds": None,
+        "execution_seconds": None,
+        "wall_seconds": None,
+        "processing_time_seconds": None,
+        "n_results": 0,
+    }
+    record.update(tags)
+    return record
+
+
+def finish_chunk_record(record: dict, status: str, job_state: dict | None = None,
+                        output: dict | None = None) -> dict:
+    """Fill in the final status and timings of a chunk record.
+
+    ``job_state`` is the raw RunPod job JSON, whose ``delayTime`` and
+    ``executionTime`` fields are reported in milliseconds.
+    """
+    record["status"] = status
+    record["wall_seconds"] = round(time.time() - record["submitted_ts"], 3)
+    if job_state:
+        if job_state.get("delayTime") is not None:
+            record["delay_seconds"] = job_state["delayTime"] / 1000.0
+        if job_state.get("executionTime") is not None:
+            record["execution_seconds"] = job_state["executionTime"] / 1000.0
+    if output:
+        record["processing_time_seconds"] = output.get("processing_time_seconds")
+        record["n_results"] = len(output.get("results", []))
+    return record
+
+
+def append_records(path: str, records: list[dict]):
+    """Append records to a JSONL telemetry file."""
+    if not path or not records:
+        return
+    with open(path, "a", encoding="utf-8") as f:
+        for r in records:
+            f.write(json.dumps(r, ensure_ascii=False) + "\n")
+
+
+def load_records(path: str, round_num: int | None = None) -> list[dict]:
+    """Read records from a JSONL telemetry file, optionally for one round."""
+    if not os.path.exists(path):
+        return []
+    records = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                r = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if round_num is not None and r.get("round") != round_num:
+                continue
+            records.append(r)
+    return records
+
+
+# ---------------------------------------------------------------------------
+# Summaries
+# ---------------------------------------------------------------------------
+
+def percentile(values: list[float], pct: float) -> float | None:
+    """Linear-interpolated percentile (pct in 0-100) of a list of numbers."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def summarize_chunks(records: list[dict]) -> dict:
+    """Aggregate chunk records into latency / cost statistics.
+
+    Records flagged ``discarded`` (the losing copy of a hedged chunk) count
+    towards GPU spend but not towards chunk latency or ligand throughput.
+    """
+    discarded = [r for r in records if r.get("discarded")]
+    kept = [r for r in records if not r.get("discarded")]
+    completed = [r for r in kept if r.get("status") == "COMPLETED"]
+    latencies = [r["wall_seconds"] for r in kept if r.get("wall_seconds") is not None]
+    delays = [r["delay_seconds"] for r in records if r.get("delay_seconds") is not None]
+    gpu_seconds = sum(r.get("execution_seconds") or 0 for r in records)
+    ligands_done = sum(r.get("n_ligands", 0) for r in completed)
+    cold = [d for d in delays if d > COLD_START_THRESHOLD_SECONDS]
+
+    def _r(x):
+        return round(x, 2) if x is not None else None
+
+    return {
+        "chunks": len(kept),
+        "chunks_completed": len(completed),
+        "chunks_failed": len(kept) - len(completed),
+        "ligands": sum(r.get("n_ligands", 0) for r in kept),
+        "payload_bytes": sum(r.get("payload_bytes", 0) for r in records),
+        "retries": sum(r.get("retries", 0) for r in records),
+        "latency_p50_seconds": _r(percentile(latencies, 50)),
+        "latency_p95_seconds": _r(percentile(latencies, 95)),
+        "delay_p50_seconds": _r(percentile(delays, 50)),
+        "delay_p95_seconds": _r(percentile(delays, 95)),
+        "gpu_seconds": round(gpu_seconds, 2),
+        "gpu_seconds_per_ligand": (
+            round(gpu_seconds / ligands_done, 3) if ligands_done else None
+        ),
+        "cold_start_share": round(len(cold) / len(delays), 3) if delays else None,
+        "hedged_chunks": sum(1 for r in records if r.get("attempt", 0) > 0),
+        "hedge_extra_gpu_seconds": round(
+            sum(r.get("execution_seconds") or 0 for r in discarded), 2
+        ),
+    }
+
+
+def format_summary(summary: dict, title: str = "Docking telemetry") -> str:
+    """Render a summary dict as a short aligned text block."""
+    def _fmt(v, unit=""):
+        return "n/a" if v is None else f"{v}{unit}"
+
+    lines = [
+        f"  {title}:",
+        f"    Chunks:            {summary['chunks_completed']}/{summary['chunks']} completed"
+        f" ({summary['retries']} retries)",
+        f"    Ligands:           {summary['ligands']}"
+        f" ({summary['payload_bytes'] / 1024:.0f} KB submitted)",
+        f"    Latency p50/p95:   {_fmt(summary['latency_p50_seconds'], 's')}"
+        f" / {_fmt(summary['latency_p95_seconds'], 's')}",
+        f"    Delay p50/p95:     {_fmt(summary['delay_p50_seconds'], 's')}"
+        f" / {_fmt(summary['delay_p95_seconds'], 's')}",
+        f"    GPU-seconds:       {summary['gpu_seconds']}"
+        f" ({_fmt(summary['gpu_seconds_per_ligand'], 's')} per ligand)",
+        f"    Cold-start share:  {_fmt(summary['cold_start_share'])}",
+    ]
+    if summary.get("hedged_chunks"):
+        lines.append(
+            f"    Hedged chunks:     {summary['hedged_chunks']}"
+            f" (+{summary['hedge_extra_gpu_seconds']} GPU-s discarded)"
+        )
+    return "\n".join(lines)
+
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Summarise per-chunk docking telemetry."
+    )
+    parser.add_argument(
+        "path",
+        nargs="?",
+        default=TELEMETRY_FILE,
+        help=f"Telemetry JSONL file (default: {TELEMETRY_FILE}).",
+    )
+    parser.add_argument("--round", type=int, default=None,
+                        help="Only summarise chunks from this docking round.")
+    args = parser.parse_args()
+
+    records = load_records(args.path, round_num=args.round)
+    if not records:
+        print(f"ERROR: No telemetry records in {args.path}", file=sys.stderr)
+        sys.exit(1)
+
+    rounds = sorted({r.get("round") for r in records}, key=lambda x: (x is None, x))
+    for rnd in rounds:
+        subset = [r for r in records if r.get("round") == rnd]
+        print(format_summary(summarize_chunks(subset), f"Round {rnd}"))
+        print()
+    if len(rounds) > 1:
+        print(format_summary(summarize_chunks(records), "All rounds"))
+
+
+if __name__ == "__main__":
+    main()
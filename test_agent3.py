@@ -0,0 +1,470 @@
+"""Tests for Agent 3 — DiffDock Simulation Agent.
+
+RunPod is replaced by small in-memory fakes so the scheduling logic
+(chunking, telemetry, hedging) runs offline.  time.sleep is patched out globally
+via autouse fixture.
+"""
+
+import base64
+import json
+import threading
+
+import pytest
+
+import agent3
+import docking_backends
+import pose_store
+import telemetry
+
+
+# ---------------------------------------------------------------------------
+# Fixtures / fakes
+# ---------------------------------------------------------------------------
+
+@pytest.fixture(autouse=True)
+def _no_sleep(monkeypatch):
+    """Eliminate all sleep calls so tests are instant."""
+    monkeypatch.setattr("time.sleep", lambda _: None)
+
+
+class FakeJob:
+    """Mimics runpod.endpoint.runner.Job: queued once, then a final state."""
+
+    def __init__(self, payload, final_status="COMPLETED", delay_ms=2000, exec_ms=8000):
+        self.payload = payload
+        self.job_id = f"job-{id(self)}"
+        self.final_status = final_status
+        self.delay_ms = delay_ms
+        self.exec_ms = exec_ms
+        self.polls = 0
+
+    def _fetch_job(self):
+        self.polls += 1
+        if self.polls < 2:
+            return {"status": "IN_QUEUE"}
+        return {
+            "status": self.final_status,
+            "delayTime": self.delay_ms,
+            "executionTime": self.exec_ms,
+        }
+
+    def status(self):
+        return self._fetch_job()["status"]
+
+    def output(self):
+        if self.final_status != "COMPLETED":
+            return None
+        ligands = self.payload["input"]["ligands"]
+        return {
+            "results": [
+                {
+                    "name": lig["name"],
+                    "confidence_score": 0.1 * (i + 1),
+                    "confidence_raw": -1.0 + i,
+                }
+                for i, lig in enumerate(ligands)
+            ],
+            "processing_time_seconds": self.exec_ms / 1000,
+        }
+
+
+class FakeEndpoint:
+    def __init__(self, **job_kwargs):
+        self.job_kwargs = job_kwargs
+        self.jobs = []
+
+    def run(self, payload):
+        job = FakeJob(payload, **self.job_kwargs)
+        self.jobs.append(job)
+        return job
+
+
+def _runpod(**job_kwargs):
+    return docking_backends.RunPodBackend(endpoint=FakeEndpoint(**job_kwargs))
+
+
+LIGANDS = [{"name": f"lig{i}", "smiles": "CCO"} for i in range(5)]
+
+
+# ===================================================================
+# submit_chunk telemetry
+# ===================================================================
+
+class TestChunkTelemetry:
+    def test_record_for_completed_chunk(self):
+        records = []
+        agent3.submit_chunk(
+            _runpod(delay_ms=45000, exec_ms=12000), "UERC", LIGANDS[:2], 10, 3,
+            records, {"protein": "KRAS", "round": 2},
+        )
+
+        assert len(records) == 1
+        rec = records[0]
+        assert rec["status"] == "COMPLETED"
+        assert rec["chunk_idx"] == 3
+        assert rec["n_ligands"] == 2
+        assert rec["n_results"] == 2
+        assert rec["delay_seconds"] == 45.0
+        assert rec["execution_seconds"] == 12.0
+        assert rec["payload_bytes"] > 0
+        assert rec["protein"] == "KRAS"
+        assert rec["round"] == 2
+
+    def test_record_for_failed_chunk(self):
+        records = []
+        out = agent3.submit_chunk(
+            _runpod(final_status="FAILED"), "UERC", LIGANDS[:1], 10, 0, records,
+        )
+        assert out["results"] == []
+        assert records[0]["status"] == "FAILED"
+
+    def test_cancelled_before_submission_starts_no_job(self):
+        backend = _runpod()
+        records = []
+        cancel = threading.Event()
+        cancel.set()
+        out = agent3.submit_chunk(backend, "UERC", LIGANDS[:2], 10, 0, records,
+                                  cancel_event=cancel)
+
+        assert out == {"cancelled": True, "results": []}
+        assert backend.endpoint.jobs == [] and records == []
+
+    def test_run_docking_writes_jsonl(self, tmp_path, monkeypatch):
+        pdb = tmp_path / "p.pdb"
+        pdb.write_text("END\n")
+        log = tmp_path / "telemetry.jsonl"
+        endpoint = FakeEndpoint()
+        monkeypatch.setattr(docking_backends.runpod, "Endpoint", lambda _id: endpoint)
+
+        records = []
+        results, _ = agent3.run_docking(
+            str(pdb), LIGANDS, api_key="k", endpoint_id="e", chunk_size=2,
+            telemetry=records, telemetry_tags={"round": 1}, telemetry_file=str(log),
+        )
+
+        assert len(results) == 5
+        assert [r["chunk_idx"] for r in records] == [0, 1, 2]
+        lines = [json.loads(l) for l in log.read_text().splitlines()]
+        assert len(lines) == 3
+
+
+class TestSummarizeChunks:
+    def test_percentiles_and_cost(self):
+        records = [
+            {"status": "COMPLETED", "n_ligands": 10, "wall_seconds": w,
+             "delay_seconds": d, "execution_seconds": 20.0, "retries": 0,
+             "payload_bytes": 1000}
+            for w, d in [(30, 1), (40, 2), (50, 60), (200, 90)]
+        ]
+        summary = telemetry.summarize_chunks(records)
+
+        assert summary["chunks"] == 4
+        assert summary["latency_p50_seconds"] == 45.0
+        assert summary["gpu_seconds"] == 80.0
+        assert summary["gpu_seconds_per_ligand"] == 2.0
+        assert summary["cold_start_share"] == 0.5
+
+    def test_empty(self):
+        summary = telemetry.summarize_chunks([])
+        assert summary["chunks"] == 0
+        assert summary["latency_p50_seconds"] is None
+
+
+# ===================================================================
+# dispatch_chunks hedging
+# ===================================================================
+
+class TestHedging:
+    @pytest.fixture(autouse=True)
+    def _fast_checks(self, monkeypatch):
+        monkeypatch.setattr(agent3, "HEDGE_CHECK_INTERVAL", 0.01)
+
+    @staticmethod
+    def _run_chunk_with_straggler(straggler):
+        def run_chunk(chunk_idx, attempt, cancel_event):
+            if chunk_idx == straggler and attempt == 0:
+                # Hang until the dispatcher cancels us
+                cancel_event.wait(timeout=5)
+                return {"cancelled": True, "results": []}
+            return {"results": [{"name": f"c{chunk_idx}", "attempt": attempt}]}
+        return run_chunk
+
+    def test_straggler_gets_duplicate(self):
+        outputs, stats = agent3.dispatch_chunks(
+            self._run_chunk_with_straggler(2), 3, hedge_multiplier=2.0,
+        )
+
+        assert sorted(outputs) == [0, 1, 2]
+        assert outputs[2]["results"] == [{"name": "c2", "attempt": 1}]
+        assert stats["hedged"] == [2]
+        assert stats["won_by_hedge"] == [2]
+        assert (2, 0) in stats["discarded"]
+
+    def test_no_hedging_by_default(self):
+        def run_chunk(chunk_idx, attempt, cancel_event):
+            return {"results": [{"name": f"c{chunk_idx}"}]}
+
+        outputs, stats = agent3.dispatch_chunks(run_chunk, 4)
+
+        assert sorted(outputs) == [0, 1, 2, 3]
+        assert stats["hedged"] == []
+
+    def test_error_falls_back_to_duplicate(self):
+        def run_chunk(chunk_idx, attempt, cancel_event):
+            if chunk_idx == 1 and attempt == 0:
+                cancel_event.wait(timeout=0.2)
+                return {"error": "Chunk 1 FAILED", "results": []}
+            return {"results": [{"name": f"c{chunk_idx}"}]}
+
+        outputs, stats = agent3.dispatch_chunks(run_chunk, 3, hedge_multiplier=1.5)
+
+        assert outputs[1]["results"] == [{"name": "c1"}]
+
+    def test_discarded_spend_reported(self):
+        records = [
+            {"chunk_idx": 0, "attempt": 0, "status": "COMPLETED", "n_ligands": 5,
+             "wall_seconds": 10, "execution_seconds": 10.0, "discarded": False},
+            {"chunk_idx": 1, "attempt": 0, "status": "CANCELLED", "n_ligands": 5,
+             "wall_seconds": 40, "execution_seconds": 30.0, "discarded": True},
+            {"chunk_idx": 1, "attempt": 1, "status": "COMPLETED", "n_ligands": 5,
+             "wall_seconds": 12, "execution_seconds": 11.0, "discarded": False},
+        ]
+        summary = telemetry.summarize_chunks(records)
+
+        assert summary["chunks"] == 2
+        assert summary["hedged_chunks"] == 1
+        assert summary["hedge_extra_gpu_seconds"] == 30.0
+        assert summary["gpu_seconds"] == 51.0
+
+
+# ===================================================================
+# Docking backends
+# ===================================================================
+
+POCKET_PDB = "\n".join(
+    f"ATOM  {i + 1:5d}  CA  ALA A{i + 1:4d}    "
+    f"{x:8.3f}{y:8.3f}{z:8.3f}  1.00  0.00           C"
+    for i, (x, y, z) in enumerate(
+        [(dx * 3.8, dy * 3.8, dz * 3.8)
+         for dx in (-2, 2) for dy in (-2, 0, 2) for dz in (-2, 0, 2)]
+    )
+) + "\nHETATM  999  C1  LIG A 900       0.000   0.000   0.000  1.00  0.00           C\nEND\n"
+
+
+class TestBackends:
+    def test_get_backend_by_name(self):
+        assert isinstance(docking_backends.get_backend("local"), docking_backends.LocalBackend)
+        with pytest.raises(ValueError):
+            docking_backends.get_backend("quantum")
+
+    def test_backend_names_ignore_case_and_keep_credentials(self, monkeypatch):
+        seen = {}
+        monkeypatch.setattr(docking_backends, "RunPodBackend",
+                            lambda **kwargs: seen.update(kwargs) or "runpod-backend")
+        monkeypatch.setenv("DOCKING_BACKEND", "RunPod")
+        assert docking_backends.get_backend(endpoint_id="e", api_key="k") == "runpod-backend"
+        assert seen == {"endpoint_id": "e", "api_key": "k"}
+        assert isinstance(docking_backends.get_backend("LOCAL", endpoint_id="e"),
+                          docking_backends.LocalBackend)
+
+    def test_incomplete_backend_fails_when_constructed(self):
+        class NoPoll(docking_backends.DockingBackend):
+            def prepare(self, protein_pdb_path):
+                return protein_pdb_path
+
+            def submit(self, receptor, ligands, samples_per_complex):
+                return None
+
+            def results(self, job):
+                return None
+
+        with pytest.raises(TypeError):
+            NoPoll()
+
+    def test_default_backend_is_read_when_needed(self, monkeypatch):
+        # e.g. set by load_dotenv() after docking_backends was imported
+        monkeypatch.setenv("DOCKING_BACKEND", "local")
+        assert isinstance(docking_backends.get_backend(), docking_backends.LocalBackend)
+
+    def test_pocket_centre_from_hetatm(self, tmp_path):
+        pdb = tmp_path / "pocket.pdb"
+        pdb.write_text(POCKET_PDB)
+        coords, center = docking_backends._read_receptor(str(pdb))
+        assert coords.shape == (18, 3)
+        assert list(center) == [0.0, 0.0, 0.0]
+
+    def test_local_chunk_matches_diffdock_schema(self, tmp_path):
+        pdb = tmp_path / "pocket.pdb"
+        pdb.write_text(POCKET_PDB)
+        out = docking_backends.dock_chunk_local(
+            str(pdb),
+            [{"name": "ethanol", "smiles": "CCO"}, {"name": "bad", "smiles": "not-a-smiles"}],
+            samples_per_complex=3,
+        )
+
+        assert [r["name"] for r in out["results"]] == ["ethanol"]
+        r = out["results"][0]
+        assert 0.0 < r["confidence_score"] < 1.0
+        assert len(r["all_poses"]) == 3
+        assert r["all_poses"][0]["confidence_raw"] == r["confidence_raw"]
+        assert r["top_pose_sdf_b64"]
+
+    def test_run_docking_with_custom_backend(self, tmp_path):
+        pdb = tmp_path / "p.pdb"
+        pdb.write_text("END\n")
+        backend = _runpod()
+
+        results, _ = agent3.run_docking(
+            str(pdb), LIGANDS, chunk_size=2, backend=backend, telemetry_file=None,
+        )
+
+        assert len(results) == 5
+        assert len(backend.endpoint.jobs) == 3
+
+
+# ===================================================================
+# Progressive docking
+# ===================================================================
+
+class ScoreByName(docking_backends.DockingBackend):
+    """Synchronous backend whose score depends on name and sample count."""
+
+    name = "fake"
+    poll_interval = 0
+
+    def __init__(self, scores):
+        self.scores = scores
+        self.submitted = []
+
+    def prepare(self, protein_pdb_path):
+        return protein_pdb_path
+
+    def submit(self, receptor, ligands, samples_per_complex):
+        self.submitted.append((samples_per_complex, [l["name"] for l in ligands]))
+        return {"ligands": ligands, "samples": samples_per_complex}
+
+    def poll(self, job):
+        return {"status": "COMPLETED", "executionTime": 100 * job["samples"]}
+
+    def results(self, job):
+        bonus = 0.01 * job["samples"]
+        return {"results": [
+            {"name": l["name"], "confidence_score": self.scores[l["name"]] + bonus,
+             "confidence_raw": 0.0}
+            for l in job["ligands"]
+        ]}
+
+
+class TestProgressiveDocking:
+    def test_select_top_fraction_plus_always_full(self):
+        prescreen = [{"name": f"l{i}", "confidence_score": i / 10} for i in range(10)]
+        picked = agent3.select_for_full_sampling(prescreen, fraction=0.2, always_full={"l0"})
+        assert picked == {"l9", "l8", "l0"}
+
+    def test_two_tiers_merge(self, tmp_path):
+        pdb = tmp_path / "p.pdb"
+        pdb.write_text("END\n")
+        scores = {f"lig{i}": i / 10 for i in range(5)}
+        backend = ScoreByName(scores)
+
+        results, _ = agent3.run_docking(
+            str(pdb), LIGANDS, chunk_size=10, samples_per_complex=10,
+            backend=backend, telemetry_file=None,
+            prescreen_samples=2, prescreen_top_k=2,
+        )
+
+        assert backend.submitted[0] == (2, [f"lig{i}" for i in range(5)])
+        assert backend.submitted[1][0] == 10
+        assert sorted(backend.submitted[1][1]) == ["lig3", "lig4"]
+        assert [(r["name"], r["docking_tier"]) for r in results] == \
+            [("lig4", "full"), ("lig3", "full")]
+
+    def test_local_prescreen_scores_are_not_ranked_with_the_full_tier(self, tmp_path):
+        pdb = tmp_path / "p.pdb"
+        pdb.write_text("END\n")
+        local = ScoreByName({f"lig{i}": 5.0 + i for i in range(5)})  # another scale
+        local.name = "local"
+        runpod = ScoreByName({f"lig{i}": i / 10 for i in range(5)})
+        runpod.name = "runpod"
+        prescreen_only = []
+
+        results, _ = agent3.run_docking(
+            str(pdb), LIGANDS, chunk_size=10, samples_per_complex=10,
+            backend=runpod, prescreen_backend=local, telemetry_file=None,
+            prescreen_samples=2, prescreen_top_k=2, prescreen_only=prescreen_only,
+        )
+
+        assert [r["name"] for r in results] == ["lig4", "lig3"]
+        assert all(r["confidence_score"] < 1 for r in results)  # runpod scores only
+        assert sorted(r["name"] for r in prescreen_only) == ["lig0", "lig1", "lig2"]
+        assert {r["docking_tier"] for r in prescreen_only} == {"prescreen"}
+
+
+# ---------------------------------------------------------------------------
+# Pose store
+# ---------------------------------------------------------------------------
+
+def _result_with_pose(name, sdf):
+    return {
+        "name": name,
+        "confidence_score": 0.7,
+        "confidence_raw": 0.85,
+        "top_pose_sdf_b64": base64.b64encode(sdf.encode()).decode(),
+        "all_poses": [
+            {"rank": 1, "confidence_score": 0.7, "confidence_raw": 0.85},
+            {"rank": 2, "confidence_score": 0.4, "confidence_raw": -0.4},
+        ],
+    }
+
+
+class TestPoseStore:
+    def test_offload_replaces_inline_poses_with_ref(self, tmp_path):
+        store = pose_store.PoseStore(str(tmp_path / "poses.pack"))
+        results = [_result_with_pose("A", "molA\n$$$$\n")]
+
+        assert pose_store.offload_poses(results, store) == 1
+        r = results[0]
+        assert "top_pose_sdf_b64" not in r and "all_poses" not in r
+        assert r["num_poses"] == 2
+        assert r["pose_scores"] == [0.7, 0.4]
+        assert pose_store.load_pose(r, store) == "molA\n$$$$\n"
+
+    def test_identical_poses_are_stored_once(self, tmp_path):
+        store = pose_store.PoseStore(str(tmp_path / "poses.pack"))
+        results = [_result_with_pose("A", "same\n"), _result_with_pose("B", "same\n")]
+        pose_store.offload_poses(results, store)
+        assert results[0]["pose_ref"] == results[1]["pose_ref"]
+        assert len(store) == 1
+
+    def test_reopen_reads_index_and_ignores_torn_tail(self, tmp_path):
+        pack = str(tmp_path / "poses.pack")
+        store = pose_store.PoseStore(pack)
+        ref = store.put("molA\n")
+        # Simulate a crash after the pack write but before the index line
+        with open(pack, "ab") as f:
+            f.write(b"garbage")
+        with open(pack + ".idx", "a") as f:
+            f.write('{"ref": "tor')
+
+        reopened = pose_store.PoseStore(pack)
+        assert len(reopened) == 1
+        assert reopened.get(ref) == "molA\n"
+        ref2 = reopened.put("molB\n")
+        assert reopened.get(ref2) == "molB\n"
+
+    def test_migrate_file_shrinks_state(self, tmp_path):
+        state_path = tmp_path / "pipeline_state.json"
+        state = {
+            "all_docking_results": [_result_with_pose("A", "x" * 5000)],
+            "targets": [{"protein": "EGFR",
+                         "results": [_result_with_pose("B", "y" * 5000)]}],
+        }
+        state_path.write_text(json.dumps(state))
+        before = state_path.stat().st_size
+
+        store = pose_store.PoseStore(str(tmp_path / "poses.pack"))
+        assert pose_store.migrate_file(str(state_path), store) == 2
+        assert state_path.stat().st_size < before / 4
+        migrated = json.loads(state_path.read_text())
+        ref = migrated["targets"][0]["results"][0]["pose_ref"]
+        assert store.get(ref) == "y" * 5000
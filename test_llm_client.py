@@ -0,0 +1,408 @@
+"""Tests for the shared Perplexity client and its response cache.
+
+A fake session stands in for HTTP; no network calls are made.
+"""
+
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+import requests
+
+import llm_cache
+import llm_client
+import llm_ledger
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, content="ok", usage=None, headers=None,
+                 lines=None, text="", finish_reason="stop"):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers or {}
+        self.encoding = None
+        self._content = content
+        self._usage = usage or {"prompt_tokens": 10, "completion_tokens": 5,
+                                "total_tokens": 15}
+        self._lines = lines
+        self._finish = finish_reason
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} error")
+
+    def json(self):
+        return {"choices": [{"message": {"content": self._content},
+                             "finish_reason": self._finish}],
+                "usage": self._usage}
+
+    def iter_lines(self, decode_unicode=False):
+        if self._lines is not None:
+            yield from self._lines
+            return
+        for token in self._content.split(" "):
+            yield "data: " + json.dumps({"choices": [{"delta": {"content": token + " "}}]})
+            yield ""
+        yield "data: " + json.dumps({"choices": [{"delta": {}, "finish_reason": self._finish}],
+                                     "usage": self._usage})
+        yield "data: [DONE]"
+
+    def close(self):
+        pass
+
+
+class FakeSession:
+    def __init__(self, responses=None, delay=0.0):
+        self.responses = list(responses or [])
+        self.delay = delay
+        self.payloads = []
+        self.timeouts = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def post(self, url, json=None, headers=None, timeout=None, stream=False):
+        with self._lock:
+            self.payloads.append(json)
+            self.timeouts.append(timeout)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        if self.delay:
+            time.sleep(self.delay)
+        with self._lock:
+            self.in_flight -= 1
+            return self.responses.pop(0) if self.responses else FakeResponse()
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def no_sleep(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(llm_client.time, "sleep", sleeps.append)
+    return sleeps
+
+
+def test_backoff_releases_the_concurrency_slot(monkeypatch):
+    session = FakeSession([FakeResponse(429, headers={"Retry-After": "7"})])
+    client = llm_client.PerplexityClient(api_key="k", session=session, max_concurrency=1)
+    slot_free = []
+
+    def sleep(seconds):
+        # Another call could start while this one waits out its Retry-After
+        free = client._slots.acquire(blocking=False)
+        slot_free.append(free)
+        if free:
+            client._slots.release()
+
+    monkeypatch.setattr(llm_client.time, "sleep", sleep)
+    assert client.complete("sys", "user") == "ok"
+    assert slot_free == [True]
+
+
+def test_retries_rate_limits_and_server_errors(no_sleep):
+    session = FakeSession([
+        FakeResponse(429, headers={"Retry-After": "7"}),
+        FakeResponse(503),
+        FakeResponse(200, content="review text"),
+    ])
+    client = llm_client.PerplexityClient(api_key="k", session=session)
+
+    assert client.complete("sys", "user", temperature=0.2) == "review text"
+    assert len(session.payloads) == 3
+    assert no_sleep[0] == 7.0  # Retry-After is honoured
+    assert session.payloads[0]["temperature"] == 0.2
+    assert client.calls[0]["retries"] == 2
+
+
+def test_gives_up_after_max_retries(no_sleep):
+    session = FakeSession([FakeResponse(500)] * 3)
+    client = llm_client.PerplexityClient(api_key="k", session=session, max_retries=2)
+    with pytest.raises(llm_client.PerplexityError):
+        client.complete("sys", "user")
+
+
+def test_client_errors_are_not_retried(no_sleep):
+    session = FakeSession([FakeResponse(400)])
+    client = llm_client.PerplexityClient(api_key="k", session=session)
+    with pytest.raises(llm_client.PerplexityError):
+        client.complete("sys", "user")
+    assert len(session.payloads) == 1
+
+
+def test_missing_key_raises_instead_of_exiting():
+    client = llm_client.PerplexityClient(api_key="", session=FakeSession())
+    with pytest.raises(llm_client.MissingAPIKeyError):
+        client.complete("sys", "user")
+
+
+def test_usage_accounting():
+    client = llm_client.PerplexityClient(api_key="k", session=FakeSession())
+    client.complete("sys", "a", purpose="abstract")
+    client.complete("sys", "b")
+    usage = client.usage_summary()
+    assert usage["calls"] == 2
+    assert usage["total_tokens"] == 30
+    assert client.calls[0]["purpose"] == "abstract"
+
+
+def test_calls_are_tagged_and_written_to_the_ledger(tmp_path, monkeypatch):
+    client = llm_client.PerplexityClient(api_key="k", session=FakeSession())
+    client.ledger_path = str(tmp_path / llm_ledger.LEDGER_FILE)
+    monkeypatch.setattr(llm_client, "_client", client)
+
+    with llm_client.llm_tags(stage="paper"):
+        llm_client.run_concurrently({
+            "abstract": lambda: llm_client.query_perplexity("sys", "write"),
+            "intro": lambda: llm_client.query_perplexity("sys", "merge", purpose="merge"),
+        })
+    client.complete("sys", "untagged")
+
+    records = llm_ledger.load_records(client.ledger_path)
+    tags = sorted((r["stage"], r["purpose"]) for r in records)
+    assert tags == [("", ""), ("paper", "abstract"), ("paper", "merge")]
+    untagged = next(r for r in records if not r["stage"])
+    assert untagged["prompt_chars"] == len("sys") + len("untagged")
+
+
+def test_failed_calls_are_recorded_with_their_error(tmp_path, no_sleep):
+    session = FakeSession([FakeResponse(503)] * 3 + [FakeResponse(401)])
+    client = llm_client.PerplexityClient(api_key="k", session=session, max_retries=2)
+    client.ledger_path = str(tmp_path / llm_ledger.LEDGER_FILE)
+
+    for _ in range(2):
+        with pytest.raises(llm_client.PerplexityError):
+            client.complete("sys", "user", purpose="abstract")
+
+    records = llm_ledger.load_records(client.ledger_path)
+    assert [(r["retries"], r["error"]) for r in records] == [(2, "HTTP 503"), (0, "401 error")]
+    assert client.usage_summary()["failed"] == 2
+    assert llm_ledger.summarize_calls(records)[0]["errors"] == 2
+
+
+def test_ledger_summary_groups_by_stage_and_purpose():
+    records = [
+        {"stage": "report", "purpose": "results", "latency_seconds": 30.0,
+         "prompt_tokens": 900, "completion_tokens": 400, "retries": 1},
+        {"stage": "report", "purpose": "results", "latency_seconds": 10.0,
+         "prompt_tokens_estimate": 800, "completion_tokens": 300},
+        {"stage": "report", "purpose": "results", "cache_hit": True, "latency_seconds": 0.0},
+        {"stage": "paper", "purpose": "abstract", "latency_seconds": 10.0},
+    ]
+    rows = llm_ledger.summarize_calls(records)
+    assert [(r["stage"], r["purpose"]) for r in rows] == [("report", "results"),
+                                                         ("paper", "abstract")]
+    assert rows[0]["calls"] == 2 and rows[0]["cache_hits"] == 1
+    assert rows[0]["prompt_tokens"] == 1700  # billed count, else the estimate
+    assert rows[0]["latency_share"] == 0.8
+    assert "report / results" in llm_ledger.format_table(rows)
+
+
+def test_concurrent_calls_respect_the_limit():
+    session = FakeSession(delay=0.05)
+    client = llm_client.PerplexityClient(api_key="k", session=session, max_concurrency=2)
+
+    async def run():
+        return await asyncio.gather(*(client.acomplete("sys", str(i)) for i in range(6)))
+
+    assert asyncio.run(run()) == ["ok"] * 6
+    assert session.max_in_flight == 2
+
+
+def test_streamed_reply_is_reported_as_it_arrives():
+    session = FakeSession([FakeResponse(content="one two three")])
+    client = llm_client.PerplexityClient(api_key="k", session=session)
+    seen = []
+
+    assert client.complete("sys", "user", on_text=seen.append) == "one two three "
+    assert session.payloads[0]["stream"] is True
+    # Read timeout is the stall window, not the whole-request timeout
+    assert session.timeouts[0] == (llm_client.CONNECT_TIMEOUT, client.stall_seconds)
+    assert seen == ["", "one ", "one two ", "one two three "]
+    assert client.calls[0]["completion_tokens"] == 5  # from the final chunk
+
+
+def test_stalled_stream_is_retried(no_sleep, monkeypatch):
+    clock = iter(range(0, 1000, 20))
+    monkeypatch.setattr(llm_client.time, "monotonic", lambda: next(clock))
+    keepalives = ['data: {"choices": [{"delta": {"content": "par"}}]}'] + [""] * 5
+    session = FakeSession([FakeResponse(lines=keepalives), FakeResponse(content="done")])
+    client = llm_client.PerplexityClient(api_key="k", session=session, stall_seconds=30)
+    seen = []
+
+    assert client.complete("sys", "user", on_text=seen.append) == "done "
+    assert len(session.payloads) == 2
+    assert client.calls[0]["retries"] == 1
+    assert seen[-1] == "done "
+
+
+def test_queueing_for_a_slot_does_not_eat_the_stream_timeout():
+    session = FakeSession(delay=0.3)
+    client = llm_client.PerplexityClient(api_key="k", session=session, max_concurrency=1)
+    errors = []
+
+    def call():
+        try:
+            client.complete("sys", "user", timeout=0.5, on_text=lambda text: None)
+        except llm_client.PerplexityError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == [] and len(client.calls) == 3
+
+
+def test_streaming_to_applies_to_the_calling_thread_only():
+    session = FakeSession()
+    client = llm_client.PerplexityClient(api_key="k", session=session)
+    seen = []
+    with llm_client.streaming_to(seen.append):
+        client.complete("sys", "a")
+    client.complete("sys", "b")
+    assert "stream" in session.payloads[0] and "stream" not in session.payloads[1]
+    assert seen[-1] == "ok "
+
+
+def test_stream_progress_writes_sections_and_live_json(tmp_path, monkeypatch):
+    client = llm_client.PerplexityClient(api_key="k", session=FakeSession())
+    monkeypatch.setattr(llm_client, "_client", client)
+    events = []
+    progress = llm_client.StreamProgress(out_dir=str(tmp_path / "stream"),
+                                         live_json=str(tmp_path / "progress.json"),
+                                         listener=events.append)
+
+    def boom():
+        raise ValueError("bad section")
+
+    with pytest.raises(ValueError):
+        llm_client.run_concurrently({
+            "abstract": lambda: llm_client.query_perplexity("sys", "abstract"),
+            "intro": boom,
+        }, progress=progress)
+
+    with open(tmp_path / "progress.json") as f:
+        sections = json.load(f)["sections"]
+    assert sections["abstract"] == {"status": "done", "chars": 3}
+    assert sections["intro"]["status"] == "error"
+    assert open(tmp_path / "stream" / "abstract.md").read() == "ok "
+    assert ("abstract", "streaming") in [(e["section"], e["status"]) for e in events]
+
+
+# ---------------------------------------------------------------------------
+# Response cache
+# ---------------------------------------------------------------------------
+
+@pytest.fixture
+def cache(tmp_path):
+    c = llm_cache.LLMCache(str(tmp_path / "cache.db"))
+    yield c
+    c.close()
+
+
+def test_identical_prompts_are_served_from_cache(cache):
+    session = FakeSession([FakeResponse(content="first"), FakeResponse(content="second")])
+    client = llm_client.PerplexityClient(api_key="k", session=session, cache=cache)
+
+    assert client.complete("sys", "user") == "first"
+    assert client.complete("sys", "user") == "first"
+    assert len(session.payloads) == 1
+    # Any change to the key material is a miss
+    assert client.complete("sys", "user", max_tokens=100) == "second"
+
+    usage = client.usage_summary()
+    assert (usage["calls"], usage["cache_hits"], usage["tokens_saved"]) == (2, 1, 15)
+
+
+def test_cache_hit_needs_no_api_key(cache):
+    llm_client.PerplexityClient(api_key="k", session=FakeSession(), cache=cache).complete("s", "u")
+    keyless = llm_client.PerplexityClient(api_key="", session=FakeSession(), cache=cache)
+    assert keyless.complete("s", "u") == "ok"
+
+
+def test_bypass_refreshes_the_entry(cache):
+    session = FakeSession([FakeResponse(content="old"), FakeResponse(content="new")])
+    llm_client.PerplexityClient(api_key="k", session=session, cache=cache).complete("s", "u")
+    bypass = llm_client.PerplexityClient(api_key="k", session=session, cache=cache,
+                                         bypass_cache=True)
+    assert bypass.complete("s", "u") == "new"
+    key = llm_cache.cache_key(bypass.model, "s", "u", llm_client.DEFAULT_TEMPERATURE,
+                              llm_client.DEFAULT_MAX_TOKENS)
+    assert cache.get(key)["reply"] == "new"
+
+
+def test_expired_entries_are_ignored_and_purged(cache, monkeypatch):
+    cache.put("k1", "reply")
+    cache.ttl_seconds = 10
+    now = time.time()
+    monkeypatch.setattr(llm_cache.time, "time", lambda: now + 60)
+    assert cache.get("k1") is None
+    assert cache.purge_expired() == 1
+    assert len(cache) == 0
+
+
+# ---------------------------------------------------------------------------
+# Concurrent section generation
+# ---------------------------------------------------------------------------
+
+def test_paper_sections_are_generated_concurrently(monkeypatch):
+    import final
+
+    lock = threading.Lock()
+    in_flight = []
+    peak = []
+
+    def fake_query(system_prompt, user_prompt):
+        with lock:
+            in_flight.append(1)
+            peak.append(len(in_flight))
+        time.sleep(0.05)
+        with lock:
+            in_flight.pop()
+        return "## Echoed header\nbody"
+
+    monkeypatch.setattr(final, "query_perplexity", fake_query)
+    sections = final.generate_paper_sections("# Review: x\n", "# Results\n")
+    assert set(sections) == {"abstract", "intro", "landscape", "results", "conclusion"}
+    assert all(text == "body" for text in sections.values())
+    # All five run at once, up to the concurrency cap
+    assert max(peak) == min(5, llm_client.MAX_CONCURRENCY)
+
+
+def test_run_concurrently_reraises_failures():
+    def boom():
+        raise ValueError("bad section")
+
+    with pytest.raises(ValueError):
+        llm_client.run_concurrently({"ok": lambda: "x", "bad": boom})
+
+
+def test_rejected_response_format_is_dropped(no_sleep):
+    rejection = FakeResponse(400, text='{"error": "Invalid response_format: unsupported"}')
+    session = FakeSession([rejection, FakeResponse(content='{"drugs": []}')])
+    client = llm_client.PerplexityClient(api_key="k", session=session)
+    schema = {"type": "json_schema", "json_schema": {"schema": {"type": "object"}}}
+
+    assert client.complete("sys", "user", response_format=schema) == '{"drugs": []}'
+    assert "response_format" in session.payloads[0]
+    assert "response_format" not in session.payloads[1]
+    client.complete("sys", "again", response_format=schema)
+    assert "response_format" not in session.payloads[2]  # not offered again
+
+
+def test_unrelated_bad_request_keeps_structured_output(no_sleep):
+    too_long = FakeResponse(400, text='{"error": "prompt exceeds the context window"}')
+    session = FakeSession([too_long, FakeResponse(content="{}"), FakeResponse(content="{}")])
+    client = llm_client.PerplexityClient(api_key="k", session=session)
+    schema = {"type": "json_schema", "json_schema": {"schema": {"type": "object"}}}
+
+    assert client.complete("sys", "user", response_format=schema) == "{}"
+    assert "response_format" not in session.payloads[1]  # dropped for this call
+    assert client.supports_response_format
+    client.complete("sys", "again", response_format=schema)
+    assert "response_format" in session.payloads[2]
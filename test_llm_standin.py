@@ -0,0 +1,103 @@
+"""Tests for the local Perplexity stand-in.
+
+The stand-in runs on a free local port; the real client talks to it over
+HTTP exactly as it would to the API.
+"""
+
+import json
+import threading
+
+import pytest
+
+import llm_cache
+import llm_client
+import llm_standin
+import review
+
+
+@pytest.fixture
+def serve(tmp_path, monkeypatch):
+    """serve(**options) -> (StandIn, PerplexityClient pointed at it)."""
+    monkeypatch.setattr(llm_client.time, "sleep", lambda s: None)  # client backoff
+    servers = []
+
+    def start(recordings=None, **options):
+        path = tmp_path / llm_standin.RECORDINGS_FILE
+        if recordings:
+            path.write_text("".join(json.dumps(r) + "\n" for r in recordings))
+        standin = llm_standin.StandIn(str(path), jitter=0.0, seed=1, **options)
+        server = llm_standin.make_server(standin, port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        host, port = server.server_address[:2]
+        client = llm_client.PerplexityClient(
+            api_key="local", url=f"http://{host}:{port}/chat/completions", max_retries=2)
+        return standin, client
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_recorded_replies_are_replayed_by_prompt_hash(serve):
+    messages = [{"role": "system", "content": "sys"}, {"role": "user", "content": "hello"}]
+    recording = {"prompt_hash": llm_standin.prompt_hash(messages), "reply": "recorded",
+                 "usage": {"prompt_tokens": 3, "completion_tokens": 1, "total_tokens": 4}}
+    standin, client = serve([recording])
+
+    assert client.complete("sys", "hello") == "recorded"
+    assert client.calls[0]["total_tokens"] == 4
+    assert client.complete("sys", "something else") != "recorded"
+    assert standin.stats["replayed"] == 1 and standin.stats["synthesized"] == 1
+
+
+def test_synthesized_markdown_follows_the_prompt_and_streams(serve):
+    _, client = serve()
+    prompt = "Write sections on:\n1. **Key protein targets**\n2. Drug-Protein Summary Table\n" \
+             "Focus on KRAS and EGFR."
+    streamed = []
+    reply = client.complete("sys", prompt, on_text=streamed.append)
+
+    assert "## Key protein targets" in reply and "| Drug | Target |" in reply
+    assert "KRAS" in reply or "EGFR" in reply
+    assert streamed[-1] == reply and len(streamed) > 2
+    assert client.complete("sys", prompt) == reply  # deterministic per prompt
+
+
+def test_synthesized_drug_map_parses_without_repair(serve, monkeypatch):
+    standin, client = serve()
+    monkeypatch.setattr(llm_client, "_client", client)
+    data = review._extract_drug_protein_map("Sotorasib targets KRAS.", "lung cancer", ["KRAS"])
+
+    assert data["drugs"] and all("drug" in d and "proteins" in d for d in data["drugs"])
+    assert standin.stats["requests"] == 1
+
+
+def test_rate_limits_are_retried_until_the_client_gives_up(serve):
+    standin, client = serve(rate_limit=1.0, retry_after=0)
+    with pytest.raises(llm_client.PerplexityError):
+        client.complete("sys", "user")
+    assert standin.stats["rate_limited"] == client.max_retries + 1
+
+
+def test_truncated_replies_are_cut_short(serve):
+    _, full_client = serve()
+    _, cut_client = serve(truncate=1.0)
+    prompt = "1. Introduction\n2. Molecular landscape\n3. Therapeutic strategies"
+
+    full = full_client.complete("sys", prompt)
+    cut = cut_client.complete("sys", prompt, on_text=lambda text: None)
+    assert full.startswith(cut) and len(cut) < len(full)
+    assert cut_client.calls[0]["completion_tokens"] < full_client.calls[0]["completion_tokens"]
+
+
+def test_truncated_replies_are_not_cached(serve, tmp_path):
+    standin, client = serve(truncate=1.0)
+    client.cache = llm_cache.LLMCache(str(tmp_path / "cache.db"))
+
+    client.complete("sys", "1. Introduction\n2. Methods")
+    client.complete("sys", "1. Introduction\n2. Methods")
+    assert standin.stats["requests"] == 2  # the cut reply was not served again
+    assert [c["finish_reason"] for c in client.calls] == ["length", "length"]
+    assert client.usage_summary()["truncated"] == 2
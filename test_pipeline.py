@@ -0,0 +1,850 @@
+"""Tests for the pipeline orchestrator's persistence layer.
+
+All tests run in tmp_path; no network or LLM calls are made.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+
+import pytest
+
+import pipeline
+import planner
+import prompt_budget
+import results as results_mod
+import results_export
+import results_store
+import stage_dag
+import state_log
+import workspace
+
+
+@pytest.fixture
+def log(tmp_path):
+    return state_log.StateLog(str(tmp_path / "pipeline_state.json"))
+
+
+def _read_events(log):
+    with open(log.log_path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+# ---------------------------------------------------------------------------
+# State log
+# ---------------------------------------------------------------------------
+
+class TestStateLog:
+    def test_round_trip(self, log):
+        state = pipeline.new_state("melanoma")
+        log.save(state)
+        state["status"] = "literature_complete"
+        state["review_md"] = "# Review"
+        log.save(state)
+
+        loaded = state_log.StateLog(log.snapshot_path).load()
+        assert loaded == state
+
+    def test_grown_lists_log_only_new_items(self, log):
+        state = pipeline.new_state("melanoma")
+        state["all_docking_results"] = [{"name": "A", "confidence_score": 0.5}]
+        log.save(state)
+        state["all_docking_results"].append({"name": "B", "confidence_score": 0.6})
+        state["status"] = "docking_round_2_complete"
+        n = log.save(state)
+
+        assert n == 2
+        events = _read_events(log)[-2:]
+        extend = next(e for e in events if e["op"] == "extend")
+        assert extend["key"] == "all_docking_results"
+        assert extend["items"] == [{"name": "B", "confidence_score": 0.6}]
+
+    def test_unchanged_state_writes_nothing(self, log):
+        state = pipeline.new_state("melanoma")
+        log.save(state)
+        size = os.path.getsize(log.log_path)
+        assert log.save(state) == 0
+        assert os.path.getsize(log.log_path) == size
+
+    def test_replaced_list_is_set(self, log):
+        state = pipeline.new_state("melanoma")
+        state["targets"] = [{"protein": "BRAF"}, {"protein": "MEK1"}]
+        log.save(state)
+        state["targets"] = [{"protein": "NRAS"}]
+        log.save(state)
+        assert _read_events(log)[-1]["op"] == "set"
+        assert state_log.StateLog(log.snapshot_path).load()["targets"] == [{"protein": "NRAS"}]
+
+    def test_edited_earlier_item_is_saved(self, log):
+        state = pipeline.new_state("melanoma")
+        state["targets"] = [{"protein": "BRAF"}, {"protein": "MEK1"}]
+        log.save(state)
+        state["targets"][0]["pdb_file"] = "structures/1ABC.pdb"
+        log.save(state)
+        assert state_log.StateLog(log.snapshot_path).load()["targets"][0] == {
+            "protein": "BRAF", "pdb_file": "structures/1ABC.pdb"}
+
+        # ...also when the list grows in the same save
+        state["targets"][1]["pdb_id"] = "2XYZ"
+        state["targets"].append({"protein": "NRAS"})
+        log.save(state)
+        assert _read_events(log)[-1]["op"] == "set"
+        assert state_log.StateLog(log.snapshot_path).load()["targets"] == state["targets"]
+
+    def test_compaction_is_crash_safe(self, log):
+        state = pipeline.new_state("melanoma")
+        state["hypotheses"] = ["h1"]
+        log.save(state)
+        # Keep a copy of the log as if the truncate after compaction never happened
+        with open(log.log_path) as f:
+            stale_log = f.read()
+        log.compact(state)
+        with open(log.log_path, "w") as f:
+            f.write(stale_log)
+
+        loaded = state_log.StateLog(log.snapshot_path).load()
+        assert loaded["hypotheses"] == ["h1"]
+
+    def test_torn_final_line_is_ignored(self, log):
+        state = pipeline.new_state("melanoma")
+        log.save(state)
+        with open(log.log_path, "a") as f:
+            f.write('{"op": "set", "key": "status", "val')
+        assert state_log.StateLog(log.snapshot_path).load()["status"] == "initialized"
+
+    @pytest.mark.parametrize("lazy", [False, True])
+    def test_saves_after_a_torn_line_survive_reload(self, log, lazy):
+        log.save({"a": 1})
+        log.save({"a": 2, "b": [1]})
+        with open(log.log_path, "a") as f:
+            f.write('{"seq": 3, "op": "set", "key": "a", "val')
+
+        resumed = state_log.StateLog(log.snapshot_path)
+        state = resumed.load(lazy=lazy)
+        state["a"] = 3
+        state["c"] = "new"
+        resumed.save(state)
+
+        assert state_log.StateLog(log.snapshot_path).load() == {"a": 3, "b": [1], "c": "new"}
+
+    def test_reads_legacy_snapshot(self, log):
+        legacy = pipeline.new_state("melanoma")
+        legacy["status"] = "report_complete"
+        with open(log.snapshot_path, "w") as f:
+            json.dump(legacy, f, indent=2)
+        assert log.load() == legacy
+
+
+# ---------------------------------------------------------------------------
+# Results store
+# ---------------------------------------------------------------------------
+
+def _res(name, protein, score, round_num=1, smiles=None, source=""):
+    return {"name": name, "protein_target": protein, "confidence_score": score,
+            "confidence_raw": score, "round": round_num, "smiles": smiles,
+            "source": source}
+
+
+class TestResultsStore:
+    @pytest.fixture
+    def store(self, tmp_path):
+        s = results_store.ResultsStore(str(tmp_path / "results.db"))
+        yield s
+        s.close()
+
+    def test_default_database_does_not_follow_the_cwd(self):
+        default = results_store.RESULTS_DB
+        assert os.path.isabs(default)
+        assert os.path.dirname(default) == os.path.dirname(os.path.abspath(results_store.__file__))
+
+    def test_top_k_overall_and_per_target(self, store):
+        store.add_results("run1", [
+            _res("A", "BRAF", 0.2), _res("B", "BRAF", 0.9),
+            _res("C", "MEK1", 0.5), _res("D", "MEK1", 0.7),
+        ])
+        store.add_results("run2", [_res("Z", "BRAF", 0.99)])
+
+        assert [r["name"] for r in store.top_k("run1", 3)] == ["B", "D", "C"]
+        per_target = store.top_k_per_target("run1", 1)
+        assert {p: [r["name"] for r in rs] for p, rs in per_target.items()} == {
+            "BRAF": ["B"], "MEK1": ["D"]}
+
+    def test_round_delta(self, store):
+        store.add_results("run1", [_res("A", "BRAF", 0.5), _res("B", "BRAF", 0.4)])
+        store.add_results("run1", [_res("C", "BRAF", 0.8, round_num=2),
+                                   _res("D", "BRAF", 0.1, round_num=2)])
+        delta = store.round_delta("run1", 2, k=2)
+        assert delta["added"] == 2
+        assert [r["name"] for r in delta["entered_top_k"]] == ["C"]
+
+    def test_re_adding_a_checkpointed_target_is_a_no_op(self, store):
+        results = [_res("A", "BRAF", 0.5), _res("B", "BRAF", 0.4)]
+        assert store.add_results("run1", results) == 2
+        # Crash between add_results and save_state: the target is re-docked
+        assert store.add_results("run1", results) == 0
+        assert store.count("run1") == 2
+        assert store.add_results("run1", [_res("A", "BRAF", 0.6, round_num=2)]) == 1
+
+    def test_existing_duplicates_are_dropped_on_open(self, tmp_path):
+        path = str(tmp_path / "old.db")
+        conn = sqlite3.connect(path)
+        conn.executescript(results_store.SCHEMA)
+        for _ in range(2):
+            conn.execute("INSERT INTO results (run_id, protein, round, name, data)"
+                         " VALUES ('run1', 'BRAF', 1, 'A', '{}')")
+        conn.commit()
+        conn.close()
+
+        store = results_store.ResultsStore(path)
+        assert store.count("run1") == 1
+        store.close()
+
+    def test_is_docked_matches_on_inchikey(self, store):
+        store.add_results("run1", [_res("aspirin", "BRAF", 0.5,
+                                        smiles="CC(=O)Oc1ccccc1C(=O)O")])
+        # Same molecule, different SMILES spelling and name
+        assert store.is_docked("run1", "BRAF", smiles="OC(=O)c1ccccc1OC(C)=O", name="x")
+        assert not store.is_docked("run1", "MEK1", smiles="CC(=O)Oc1ccccc1C(=O)O")
+        assert not store.is_docked("run2", "BRAF", smiles="CC(=O)Oc1ccccc1C(=O)O")
+
+    def test_seed_cids_orders_by_best_score(self, store):
+        store.add_results("run1", [
+            _res("A", "BRAF", 0.3, source="pubchem_cid_11"),
+            _res("B", "BRAF", 0.9, source="pubchem_cid_22"),
+            _res("A", "MEK1", 0.95, source="pubchem_cid_11"),
+            _res("C", "BRAF", 0.99, source="literature"),
+            _res("D", "BRAF", 0.98, source="pubchem_3dsim_cid_33_from_22"),
+        ])
+        assert store.seed_cids("run1", 5) == [11, 22]
+
+
+# ---------------------------------------------------------------------------
+# Columnar export
+# ---------------------------------------------------------------------------
+
+def _agent3_output():
+    return {
+        "cancer_type": "melanoma",
+        "targets": [{
+            "protein": "BRAF", "pdb_id": "1UWH",
+            "results": [
+                {"name": "A", "confidence_score": 0.6, "confidence_raw": 0.4,
+                 "smiles": "CCO", "source": "literature", "num_poses": 2,
+                 "pose_scores": [0.6, 0.3], "pose_ref": "abc"},
+                {"name": "B", "confidence_score": 0.2, "confidence_raw": -1.4,
+                 "all_poses": [{"confidence_score": 0.2}]},
+            ],
+        }],
+    }
+
+
+class TestColumnarExport:
+    def test_round_trip_through_results_loader(self, tmp_path):
+        import results
+
+        path = results_export.write_columns(_agent3_output(), str(tmp_path / "r.npz"))
+        data = results.load_docking_data(path)
+
+        assert data["cancer_type"] == "melanoma"
+        [target] = data["targets"]
+        assert target["pdb_id"] == "1UWH"
+        a, b = target["results"]
+        assert a["pose_scores"] == pytest.approx([0.6, 0.3])
+        assert a["inchikey"] == "LFQSCWFLJHTTHZ-UHFFFAOYSA-N"
+        assert b["num_poses"] == 1 and b["pose_ref"] is None
+        assert results.summarise_target(target)["results"][0]["num_poses"] == 2
+
+    def test_aggregate_across_runs(self, tmp_path):
+        run1 = results_export.write_columns(_agent3_output(), str(tmp_path / "1.npz"))
+        second = _agent3_output()
+        second["targets"][0]["results"][0]["confidence_score"] = 0.8
+        run2 = results_export.write_columns(second, str(tmp_path / "2.npz"))
+
+        rows = results_export.aggregate([run1, run2])
+        top = rows[0]
+        assert (top["compound"], top["runs"]) == ("A", 2)
+        assert top["mean_score"] == pytest.approx(0.7)
+        assert top["max_score"] == pytest.approx(0.8)
+
+
+# ---------------------------------------------------------------------------
+# Run workspaces
+# ---------------------------------------------------------------------------
+
+class TestWorkspace:
+    def test_concurrent_runs_keep_separate_state(self, tmp_path):
+        runs = str(tmp_path / "runs")
+        a = pipeline.new_state("melanoma")
+        b = pipeline.new_state("glioblastoma")
+        a["run_dir"] = workspace.create_run_dir("a", runs)
+        b["run_dir"] = workspace.create_run_dir("b", runs)
+        pipeline.save_state(a)
+        pipeline.save_state(b)
+
+        assert pipeline.load_state(a["run_dir"])["cancer_type"] == "melanoma"
+        assert pipeline.load_state(b["run_dir"])["cancer_type"] == "glioblastoma"
+        assert pipeline.artifact_path(a, "results.md") == os.path.join(runs, "a", "results.md")
+
+    def test_find_run_dir(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        runs = "runs"
+        assert workspace.find_run_dir(runs_dir=runs) is None
+
+        for run_id, mtime in (("old", 1000), ("new", 2000)):
+            path = workspace.create_run_dir(run_id, runs)
+            with open(os.path.join(path, "pipeline_state.json"), "w") as f:
+                f.write("{}")
+            os.utime(path, (mtime, mtime))
+        workspace.create_run_dir("empty", runs)
+
+        assert workspace.find_run_dir(runs_dir=runs) == os.path.join(runs, "new")
+        assert workspace.find_run_dir("old", runs) == os.path.join(runs, "old")
+        assert workspace.find_run_dir("empty", runs) is None
+
+    def test_find_run_dir_falls_back_to_legacy_state(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        (tmp_path / "pipeline_state.json").write_text("{}")
+        assert workspace.find_run_dir(runs_dir="runs") == "."
+
+    def test_in_run_dir_only_moves_default_paths(self, tmp_path):
+        run = str(tmp_path / "r")
+        assert workspace.in_run_dir(run, "results.md", "results.md") == os.path.join(run, "results.md")
+        assert workspace.in_run_dir(run, "custom.md", "results.md") == "custom.md"
+        assert workspace.in_run_dir(None, "results.md", "results.md") == "results.md"
+
+
+# ---------------------------------------------------------------------------
+# Lazy state loading
+# ---------------------------------------------------------------------------
+
+def _big_state():
+    state = pipeline.new_state("melanoma")
+    state["status"] = "docking_round_1_complete"
+    state["review_md"] = "# Review\n" + "text " * 10000
+    state["all_docking_results"] = [
+        {"name": f"L{i}", "confidence_score": i / 1000, "protein_target": "BRAF"}
+        for i in range(1000)
+    ]
+    return state
+
+
+class TestLazyState:
+    @pytest.mark.parametrize("compacted", [False, True])
+    def test_heavy_sections_load_on_access(self, log, compacted):
+        state = _big_state()
+        log.save(state)
+        if compacted:
+            log.compact(state)
+
+        lazy = state_log.StateLog(log.snapshot_path).load(lazy=True)
+        assert lazy["status"] == "docking_round_1_complete"
+        assert not lazy.is_loaded("all_docking_results")
+        assert not lazy.is_loaded("review_md")
+        assert "all_docking_results" in lazy
+        assert lazy["all_docking_results"] == state["all_docking_results"]
+        assert dict(lazy) == state
+
+    def test_events_after_snapshot_are_applied(self, log):
+        state = _big_state()
+        log.save(state)
+        log.compact(state)
+        state["all_docking_results"].append({"name": "new", "confidence_score": 1.0})
+        state["round"] = 2
+        log.save(state)
+
+        lazy = state_log.StateLog(log.snapshot_path).load(lazy=True)
+        assert lazy["round"] == 2
+        assert lazy["all_docking_results"][-1]["name"] == "new"
+        assert len(lazy["all_docking_results"]) == 1001
+
+    def test_saving_lazy_state_appends_only_changes(self, log):
+        log.save(_big_state())
+        reader = state_log.StateLog(log.snapshot_path)
+        lazy = reader.load(lazy=True)
+
+        lazy["status"] = "report_complete"
+        assert reader.save(lazy) == 1
+        lazy["all_docking_results"].append({"name": "x", "confidence_score": 0.1})
+        assert reader.save(lazy) == 1
+        assert _read_events(reader)[-1]["op"] == "extend"
+
+        reloaded = state_log.StateLog(log.snapshot_path).load()
+        assert reloaded["status"] == "report_complete"
+        assert len(reloaded["all_docking_results"]) == 1001
+
+    def test_deleting_an_unloaded_section_is_saved(self, log):
+        state = _big_state()
+        log.save(state)
+        log.compact(state)
+        reader = state_log.StateLog(log.snapshot_path)
+        lazy = reader.load(lazy=True)
+
+        del lazy["review_md"]
+        assert reader.save(lazy) == 1
+        assert "review_md" not in state_log.StateLog(log.snapshot_path).load(lazy=True)
+        assert "review_md" not in state_log.StateLog(log.snapshot_path).load()
+
+    @pytest.mark.skipif(not os.path.isdir("/proc/self/fd"), reason="needs /proc")
+    def test_lazy_state_holds_no_open_files(self, log):
+        state = _big_state()
+        log.compact(state)
+        lazy = state_log.StateLog(log.snapshot_path).load(lazy=True)
+        assert lazy["review_md"] == state["review_md"]
+
+        snapshot = os.path.realpath(log.snapshot_path)
+        open_files = {os.path.realpath(os.path.join("/proc/self/fd", fd))
+                      for fd in os.listdir("/proc/self/fd")}
+        assert snapshot not in open_files
+
+    def test_stale_index_falls_back_to_full_load(self, log):
+        state = _big_state()
+        log.save(state)
+        log.compact(state)
+        # Snapshot rewritten by something that did not update the index
+        with open(log.snapshot_path, "w") as f:
+            json.dump({**state, "status": "complete"}, f, indent=2)
+        loaded = state_log.StateLog(log.snapshot_path).load(lazy=True)
+        assert isinstance(loaded, dict) and loaded["status"] == "complete"
+
+
+# ---------------------------------------------------------------------------
+# Incremental rankings / agent3_output.json
+# ---------------------------------------------------------------------------
+
+class TestRankings:
+    def _state(self, tmp_path):
+        state = pipeline.new_state("melanoma", run_dir=str(tmp_path))
+        state["targets"] = [
+            {"protein": "BRAF", "pdb_id": "1UWH", "pdb_file": "x.pdb", "ligands": [{}] * 3},
+            {"protein": "MEK1", "pdb_id": "3EQC", "pdb_file": "y.pdb", "ligands": []},
+        ]
+        return state
+
+    def test_output_matches_full_regroup_across_rounds(self, tmp_path):
+        state = self._state(tmp_path)
+        pipeline._rankings.clear()
+        state["all_docking_results"] = [
+            _res("A", "BRAF", 0.3), _res("B", "BRAF", 0.9), _res("C", "MEK1", 0.5)]
+        pipeline._write_docking_output(state)
+        state["all_docking_results"] += [
+            _res("D", "BRAF", 0.5, round_num=2), _res("E", "BRAF", 0.3, round_num=2)]
+        pipeline._write_docking_output(state)
+
+        with open(tmp_path / "agent3_output.json") as f:
+            data = json.load(f)
+        braf, mek1 = data["targets"]
+        assert [r["name"] for r in braf["results"]] == ["B", "D", "A", "E"]
+        assert braf["num_ligands_docked"] == 4 and braf["num_ligands_total"] == 3
+        assert [r["name"] for r in mek1["results"]] == ["C"]
+        assert data["cancer_type"] == "melanoma" and data["total_targets"] == 2
+
+    def test_sync_only_consumes_new_results(self):
+        rankings = pipeline.Rankings()
+        results = [_res("A", "BRAF", 0.3)]
+        assert rankings.sync(results) == 1
+        results.append(_res("B", "BRAF", 0.8))
+        assert rankings.sync(results) == 1
+        assert rankings.sync(results) == 0
+        assert [r["name"] for r in rankings.get("BRAF").top(1)] == ["B"]
+        assert len(rankings.get("KRAS")) == 0
+
+
+# ---------------------------------------------------------------------------
+# Checkpointing
+# ---------------------------------------------------------------------------
+
+class TestCheckpointing:
+    @pytest.fixture
+    def state(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(pipeline, "RESULTS_DB", str(tmp_path / "results.db"))
+        monkeypatch.setattr(pipeline, "_results_store", None)
+        pipeline._rankings.clear()
+        pdb = tmp_path / "x.pdb"
+        pdb.write_text("END\n")
+        state = pipeline.new_state("melanoma", run_dir=str(tmp_path))
+        state["status"] = "structures_complete"
+        state["round"] = 1
+        state["targets"] = [
+            {"protein": p, "pdb_id": "1ABC", "pdb_file": str(pdb),
+             "ligands": [{"name": f"{p}-lig", "smiles": "CCO"}]}
+            for p in ("BRAF", "MEK1", "NRAS")
+        ]
+        return state
+
+    def test_interrupted_round_resumes_remaining_targets(self, state, monkeypatch):
+        docked = []
+        fail = {"NRAS"}
+
+        def flaky_docking(protein_pdb_path, ligands, **kwargs):
+            protein = kwargs["telemetry_tags"]["protein"]
+            if protein in fail:
+                fail.discard(protein)
+                raise RuntimeError("worker lost")
+            docked.append(protein)
+            return [{"name": ligands[0]["name"], "confidence_score": 0.5,
+                     "confidence_raw": 0.0}], 1.0
+
+        monkeypatch.setattr(pipeline, "run_docking", flaky_docking)
+        with pytest.raises(RuntimeError):
+            pipeline.stage_docking(state)
+
+        saved = pipeline.load_state(state["run_dir"])
+        assert saved["status"] == "docking_round_1_in_progress"
+        assert saved["docking_progress"]["done"] == ["BRAF", "MEK1"]
+        assert [r["protein_target"] for r in saved["all_docking_results"]] == ["BRAF", "MEK1"]
+
+        saved = pipeline.stage_docking(saved, saved["docking_progress"]["targets"])
+        assert docked == ["BRAF", "MEK1", "NRAS"]
+        assert saved["status"] == "docking_round_1_complete"
+        assert saved["docking_progress"] is None
+        assert len(saved["all_docking_results"]) == 3
+
+    def test_prescreened_ligands_count_as_docked(self, state, monkeypatch):
+        state["targets"] = state["targets"][:1]
+        state["targets"][0]["ligands"] = [{"name": "kept", "smiles": "CCO"},
+                                          {"name": "cut", "smiles": "CCN"}]
+        state["docking_options"] = {"prescreen_samples": 2, "prescreen_top_k": 1}
+
+        def docking(protein_pdb_path, ligands, prescreen_only=None, **kwargs):
+            # The cut ligand's cheap score is higher but on another scale
+            prescreen_only.append({"name": "cut", "confidence_score": 0.9,
+                                   "confidence_raw": 0.0, "docking_tier": "prescreen"})
+            return [{"name": "kept", "confidence_score": 0.4, "confidence_raw": 0.0,
+                     "docking_tier": "full"}], 1.0
+
+        monkeypatch.setattr(pipeline, "run_docking", docking)
+        state = pipeline.stage_docking(state)
+
+        assert [r["name"] for r in state["all_docking_results"]] == ["kept", "cut"]
+        store = pipeline.get_results_store(state)
+        assert store.is_docked(state["run_id"], "BRAF", smiles="CCN")
+        assert [r["name"] for r in store.top_k(state["run_id"], 5)] == ["kept", "cut"]
+        ranked = pipeline.get_rankings(state).get("BRAF").results()
+        assert [r["name"] for r in ranked] == ["kept", "cut"]
+
+    def test_pipelined_structures_dock_as_targets_arrive(self, state, tmp_path, monkeypatch):
+        events = []
+        pdb = state["targets"][0]["pdb_file"]
+        state["status"] = "literature_complete"
+        state["targets"] = []
+        state["protein_targets"] = ["BRAF", "MEK1", "NRAS"]
+        state["drugs"] = []
+        state["pipelined"] = True
+
+        braf_docked = threading.Event()
+
+        def search_pdb(protein):
+            if protein == "NRAS":
+                # Retrieval of a later protein overlaps docking of an earlier one
+                assert braf_docked.wait(timeout=5)
+            events.append(("retrieve", protein))
+            return [{"pdb_id": "1ABC"}]
+
+        def docking(protein_pdb_path, ligands, **kwargs):
+            protein = kwargs["telemetry_tags"]["protein"]
+            events.append(("dock", protein))
+            if protein == "BRAF":
+                braf_docked.set()
+            return [{"name": ligands[0]["name"], "confidence_score": 0.5,
+                     "confidence_raw": 0.0}], 1.0
+
+        monkeypatch.setattr(pipeline, "search_pdb", search_pdb)
+        monkeypatch.setattr(pipeline, "pick_best_structure", lambda c: c[0])
+        monkeypatch.setattr(pipeline, "download_pdb", lambda pdb_id, d: pdb)
+        monkeypatch.setattr(pipeline, "search_compounds_for_target",
+                            lambda p, max_compounds: [{"cid": 1, "smiles": "CCO"}])
+        monkeypatch.setattr(pipeline, "run_docking", docking)
+
+        pipeline.stage_structure_pipelined(state)
+        assert state["status"] == "structures_complete"
+        assert sorted(state["docking_progress"]["done"]) == ["BRAF", "MEK1", "NRAS"]
+        assert events.index(("dock", "BRAF")) < events.index(("retrieve", "NRAS"))
+        assert len(state["all_docking_results"]) == 3
+
+        docked = len([e for e in events if e[0] == "dock"])
+        pipeline._stage_first_docking_round(state)
+        assert len([e for e in events if e[0] == "dock"]) == docked
+        assert state["status"] == "docking_round_1_complete"
+        assert state["docking_progress"] is None
+
+
+# ---------------------------------------------------------------------------
+# Stage DAG
+# ---------------------------------------------------------------------------
+
+class TestStageGraph:
+    def _graph(self, calls, resets=None):
+        def stage(name):
+            def run(state):
+                calls.append(name)
+                return state
+            return run
+
+        def reset(name):
+            return (lambda state: resets.append(name)) if resets is not None else None
+
+        return stage_dag.StageGraph([
+            stage_dag.Stage("a", stage("a"), params=("p",)),
+            stage_dag.Stage("b", stage("b"), deps=("a",), params=("q",), reset=reset("b")),
+            stage_dag.Stage("c", stage("c"), deps=("b",)),
+            stage_dag.Stage("d", stage("d"), deps=("a",)),
+        ])
+
+    def test_second_execution_skips_everything(self):
+        calls = []
+        graph = self._graph(calls)
+        state = {"p": 1, "q": 1}
+        graph.execute(state)
+        assert sorted(calls) == ["a", "b", "c", "d"]
+        calls.clear()
+        graph.execute(state)
+        assert calls == []
+
+    def test_changed_param_reruns_only_affected_stages(self):
+        calls, resets = [], []
+        graph = self._graph(calls, resets)
+        state = {"p": 1, "q": 1}
+        graph.execute(state)
+        calls.clear()
+
+        state["q"] = 2
+        assert dict(graph.plan(state)) == {"a": "skip", "b": "rerun", "c": "rerun", "d": "skip"}
+        graph.execute(state)
+        assert calls == ["b", "c"]
+        assert resets == ["b"]
+
+        # In the pipeline, the ligand count changes stage 2's output
+        state = pipeline.new_state("melanoma", max_compounds=10)
+        pipeline.PIPELINE_STAGES.adopt(state, ["literature", "structures"])
+        state["max_compounds"] = 40
+        plan = dict(pipeline.PIPELINE_STAGES.plan(state))
+        assert plan["literature"] == "skip" and plan["structures"] == "rerun"
+
+    def test_interrupted_stage_runs_without_reset(self):
+        calls, resets = [], []
+        graph = self._graph(calls, resets)
+        state = {"p": 1, "q": 1}
+        graph.execute(state)
+        # Simulate a crash inside "c": its fingerprint was never recorded
+        del state["stage_fingerprints"]["c"]
+        calls.clear()
+        graph.execute(state)
+        assert calls == ["c"] and resets == []
+
+    def test_independent_stages_run_concurrently(self):
+        import threading
+
+        barrier = threading.Barrier(2, timeout=5)
+
+        def waits(state):
+            barrier.wait()  # deadlocks unless both run at once
+            return state
+
+        graph = stage_dag.StageGraph([
+            stage_dag.Stage("root", lambda s: s),
+            stage_dag.Stage("left", waits, deps=("root",)),
+            stage_dag.Stage("right", waits, deps=("root",)),
+        ])
+        state = graph.execute({})
+        assert set(state["stage_fingerprints"]) == {"root", "left", "right"}
+
+    def test_edited_or_deleted_artifacts_rerun_their_stage(self, tmp_path):
+        calls = []
+
+        def write(state):
+            calls.append("write")
+            (tmp_path / "out.md").write_text("generated")
+            return state
+
+        graph = stage_dag.StageGraph([
+            stage_dag.Stage("write", write, outputs=("out.md",)),
+            stage_dag.Stage("after", lambda s: calls.append("after"), deps=("write",)),
+        ])
+        state = graph.execute({"run_dir": str(tmp_path)})
+        assert dict(graph.plan(state)) == {"write": "skip", "after": "skip"}
+
+        (tmp_path / "out.md").write_text("edited by hand")
+        assert dict(graph.plan(state)) == {"write": "rerun", "after": "rerun"}
+        graph.execute(state)
+        assert dict(graph.plan(state)) == {"write": "skip", "after": "skip"}
+
+        (tmp_path / "out.md").unlink()
+        assert dict(graph.plan(state))["write"] == "rerun"
+
+    def test_resume_merges_docking_options(self, tmp_path, monkeypatch):
+        state = pipeline.new_state("melanoma", {"backend": "local", "prescreen_samples": 2},
+                                   run_dir=str(tmp_path))
+        pipeline.save_state(state)
+        monkeypatch.setattr(pipeline.PIPELINE_STAGES, "execute", lambda s, **kw: s)
+        monkeypatch.setattr(pipeline, "_print_summary", lambda s: None)
+        monkeypatch.setattr(pipeline.get_client(), "ledger_path", None)  # restored after
+
+        resumed = pipeline.resume_pipeline(str(tmp_path), docking_options={"hedge_multiplier": 2.0})
+        assert resumed["docking_options"] == {"backend": "local", "prescreen_samples": 2,
+                                              "hedge_multiplier": 2.0}
+
+        resumed = pipeline.resume_pipeline(str(tmp_path), max_compounds=40)
+        assert resumed["max_compounds"] == 40
+
+    def test_chain_runs_on_the_calling_thread(self):
+        import threading
+
+        threads = []
+        graph = stage_dag.StageGraph([
+            stage_dag.Stage("a", lambda s: threads.append(threading.current_thread())),
+            stage_dag.Stage("b", lambda s: threads.append(threading.current_thread()),
+                            deps=("a",)),
+        ])
+        graph.execute({})
+        assert threads == [threading.current_thread()] * 2
+
+    def test_interrupt_does_not_wait_for_running_stages(self):
+        import threading
+        import time
+
+        release = threading.Event()
+
+        def interrupted(state):
+            time.sleep(0.05)
+            raise KeyboardInterrupt
+
+        graph = stage_dag.StageGraph([
+            stage_dag.Stage("root", lambda s: s),
+            stage_dag.Stage("slow", lambda s: release.wait(5), deps=("root",)),
+            stage_dag.Stage("quick", interrupted, deps=("root",)),
+        ])
+        start = time.monotonic()
+        with pytest.raises(KeyboardInterrupt):
+            graph.execute({})
+        assert time.monotonic() - start < 2
+        release.set()
+
+    def test_cycle_is_rejected(self):
+        with pytest.raises(ValueError):
+            stage_dag.StageGraph([
+                stage_dag.Stage("a", lambda s: s, deps=("b",)),
+                stage_dag.Stage("b", lambda s: s, deps=("a",)),
+            ])
+
+    def test_legacy_status_is_adopted(self):
+        state = pipeline.new_state("melanoma")
+        del state["stage_fingerprints"]
+        state["status"] = "docking_round_2_complete"
+        state["round"] = 2
+        pipeline.PIPELINE_STAGES.adopt(state, pipeline._completed_stages_from_status(state))
+        assert dict(pipeline.PIPELINE_STAGES.plan(state)) == {
+            "literature": "skip", "structures": "skip", "docking": "skip",
+            "reasoning": "skip", "report": "run", "paper": "run",
+        }
+        state["max_rounds"] = 5
+        plan = dict(pipeline.PIPELINE_STAGES.plan(state))
+        assert plan["docking"] == "skip" and plan["reasoning"] == "rerun"
+
+
+# ---------------------------------------------------------------------------
+# Dry-run planner
+# ---------------------------------------------------------------------------
+
+class TestPlanner:
+    def _workload(self, ligands=25):
+        return {"cancer_type": "melanoma", "source": "test", "targets": [
+            {"protein": "BRAF", "drugs": 2, "ligands": ligands, "pdb_cached": True},
+            {"protein": "MEK1", "drugs": 1, "ligands": ligands, "pdb_cached": False},
+        ]}
+
+    def _stage(self, plan, name):
+        return next(s for s in plan["stages"] if s["stage"] == name)
+
+    def test_docking_chunks_and_rates_from_telemetry(self, tmp_path):
+        run = tmp_path / "run1"
+        run.mkdir()
+        with open(run / "docking_telemetry.jsonl", "w") as f:
+            f.write(json.dumps({"backend": "runpod", "status": "COMPLETED",
+                                "n_ligands": 10, "samples_per_complex": 10,
+                                "execution_seconds": 50.0, "delay_seconds": 4.0}) + "\n")
+
+        plan = planner.estimate(self._workload(), max_rounds=0,
+                                docking_options={"chunk_size": 10, "samples_per_complex": 20,
+                                                 "backend": "runpod"},
+                                runs_dir=str(tmp_path))
+        dock = self._stage(plan, "docking")
+        assert plan["docking_rates"].startswith("telemetry")
+        assert (dock["docking_jobs"], dock["chunks"], dock["ligands"]) == (2, 6, 50)
+        assert dock["gpu_seconds"] == pytest.approx(50 * 20 * 0.5)
+        # 3 chunks per target fit in one wave: delay + 10 ligands × 20 samples × 0.5 s
+        assert dock["wall_seconds"] == pytest.approx(2 * (4.0 + 100.0))
+        assert self._stage(plan, "structures")["requests"]["rcsb"] == 2 * 11 + 1
+        assert self._stage(plan, "reasoning")["docking_jobs"] == 0
+
+    def test_prescreen_reduces_full_sampling(self, tmp_path):
+        full = planner.estimate(self._workload(100), max_rounds=0, runs_dir=str(tmp_path))
+        progressive = planner.estimate(
+            self._workload(100), max_rounds=0, runs_dir=str(tmp_path),
+            docking_options={"prescreen_samples": 2, "prescreen_fraction": 0.1})
+        assert (self._stage(progressive, "docking")["gpu_seconds"]
+                < self._stage(full, "docking")["gpu_seconds"])
+
+    def test_resume_plan_skips_completed_stages(self, tmp_path):
+        state = pipeline.new_state("melanoma", run_dir=str(tmp_path))
+        state["status"] = "report_complete"
+        state["targets"] = [{"protein": "BRAF", "pdb_file": None,
+                             "ligands": [{"name": "x", "smiles": "CCO"}]}]
+        pipeline.PIPELINE_STAGES.adopt(state, pipeline._completed_stages_from_status(state))
+        plan = pipeline.plan_pipeline(state, runs_dir=str(tmp_path))
+        assert [s["stage"] for s in plan["stages"] if not s.get("skipped")] == ["paper"]
+        # Paper sections are generated concurrently
+        waves = -(-planner.PAPER_PERPLEXITY_CALLS // planner.LLM_CONCURRENCY)
+        assert planner.total_wall_seconds(plan) == pytest.approx(
+            waves * planner.REQUEST_SECONDS["perplexity"])
+
+
+class TestReportPrompts:
+    @staticmethod
+    def _summaries(n_targets, n_compounds):
+        targets = []
+        for t in range(n_targets):
+            results = [{"name": f"cmpd-{t}-{i}", "confidence_score": 1 - i / n_compounds,
+                        "confidence_raw": 0.0,
+                        "mechanism": "kinase inhibitor" if i % 2 else "",
+                        "fda_status": "FDA-approved for gout" if i % 3 == 0 else "",
+                        "source": "pubchem"}
+                       for i in range(n_compounds)]
+            targets.append(results_mod.summarise_target(
+                {"protein": f"P{t}", "pdb_id": "1ABC", "results": results}))
+        return targets
+
+    def test_overview_stays_in_budget_as_the_library_grows(self):
+        data = {"cancer_type": "x", "status": "complete", "total_targets": 4,
+                "total_docking_time_seconds": 1.0}
+        small = results_mod.build_overview_block(data, self._summaries(4, 5))
+        large = results_mod.build_overview_block(data, self._summaries(4, 2000))
+
+        assert "…plus" not in small  # everything fits, nothing summarised
+        assert prompt_budget.count_tokens(large) <= results_mod.OVERVIEW_BUDGET_TOKENS
+        assert "cmpd-0-0 " in large and "cmpd-3-0 " in large  # every target's best kept
+        assert "more compounds: confidence" in large
+
+    def test_overview_keeps_every_target_when_tables_do_not_fit(self):
+        data = {"cancer_type": "x", "status": "complete", "total_targets": 40,
+                "total_docking_time_seconds": 1.0}
+        overview = results_mod.build_overview_block(data, self._summaries(40, 50))
+
+        assert prompt_budget.count_tokens(overview) <= results_mod.OVERVIEW_BUDGET_TOKENS
+        assert "tokens omitted" not in overview
+        for t in range(40):
+            assert f"- P{t} (PDB: 1ABC)" in overview and f"best cmpd-{t}-0 " in overview
+
+    def test_classified_buckets_keep_top_k_per_target(self):
+        classified = results_mod.build_classified_overview(self._summaries(3, 900), "lung cancer")
+        repurposing = classified["repurposing"]
+        assert prompt_budget.count_tokens(repurposing) <= results_mod.CLASS_BUDGET_TOKENS["repurposing"]
+        assert repurposing.count("### Protein:") == 3
+        assert classified["cancer_purposed"] == "(none)"
+
+    def test_fit_text_cuts_at_a_paragraph(self):
+        text = "\n\n".join(f"paragraph {i} " + "x" * 200 for i in range(50))
+        cut = prompt_budget.fit_text(text, 300)
+        assert prompt_budget.count_tokens(cut) <= 320
+        assert cut.endswith("tokens omitted for length]")
+        assert "paragraph 0 " in cut and "paragraph 49 " not in cut
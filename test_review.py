@@ -0,0 +1,163 @@
+"""Tests for the literature-review stage.
+
+arXiv and Perplexity are replaced by fakes; no network calls are made.
+"""
+
+import threading
+
+import pytest
+
+import gene_symbols
+import review
+
+
+@pytest.fixture
+def arxiv_gate(monkeypatch):
+    """A fresh arXiv gate on a frozen clock; returns the recorded sleeps."""
+    sleeps = []
+    monkeypatch.setattr(review, "_arxiv_next_slot", 0.0)
+    monkeypatch.setattr(review.time, "monotonic", lambda: 100.0)
+    monkeypatch.setattr(review.time, "sleep", sleeps.append)
+    return sleeps
+
+
+def test_arxiv_gate_spaces_back_to_back_queries(arxiv_gate):
+    for _ in range(3):
+        review._wait_for_arxiv_slot()
+    # The first query goes straight out; each later one waits its turn
+    assert arxiv_gate == [review.ARXIV_MIN_INTERVAL, 2 * review.ARXIV_MIN_INTERVAL]
+
+
+def test_literature_graph_overlaps_repurposing_with_searches(arxiv_gate, monkeypatch):
+    searches_started = threading.Barrier(3, timeout=5)
+
+    def fake_search(query, max_results=review.ARXIV_MAX_RESULTS):
+        if "repurposing" in query.lower() or "off-target" in query.lower():
+            searches_started.wait()
+            return [{"arxiv_id": "2"}, {"arxiv_id": "3"}]
+        if "KRAS" in query:
+            searches_started.wait()
+            return [{"arxiv_id": "1"}, {"arxiv_id": "2"}]
+        return [{"arxiv_id": "0"}]
+
+    def fake_repurposing(cancer_type, proteins):
+        # Only returns once both follow-up searches are in flight
+        searches_started.wait()
+        return "repurposing"
+
+    monkeypatch.setattr(review, "search_arxiv", fake_search)
+    monkeypatch.setattr(review, "extract_proteins_from_text", lambda text: ["KRAS"])
+    monkeypatch.setattr(review, "_discover_repurposing_candidates", fake_repurposing)
+    monkeypatch.setattr(review, "_extract_drug_protein_map",
+                        lambda text, cancer_type, proteins: {"drugs": [text]})
+
+    seen = {}
+
+    def write_drug_review(proteins, cancer_papers, drug_papers):
+        seen["drug_papers"] = [p["arxiv_id"] for p in drug_papers]
+        return "drugs"
+
+    lit = review.run_literature_graph("lung cancer", lambda papers: "first",
+                                      write_drug_review)
+
+    assert lit["proteins"] == ["KRAS"]
+    assert seen["drug_papers"] == ["1", "2", "3"]  # deduplicated, in order
+    assert lit["drug_map"] == {"drugs": ["drugs\n\nrepurposing"]}
+    assert "stage_fingerprints" not in lit
+
+
+# ---------------------------------------------------------------------------
+# Drug-protein map parsing
+# ---------------------------------------------------------------------------
+
+TRUNCATED_MAP = (
+    'Here is the JSON:\n```json\n{"drugs": [\n'
+    '  {"drug": "Sotorasib", "proteins": ["KRAS"], "mechanism": "KRAS G12C inhibitor",},\n'
+    '  {"drug": "Metformin", "proteins": ["AMPK", "mTOR"], "category": "repurposing_candidate"},\n'
+    '  {"drug": "Erlotinib", "proteins": ["EGFR"], "mechanism": "tyrosine kin'
+)
+
+
+def test_salvage_keeps_complete_objects_from_truncated_output():
+    drugs = review._salvage_json_objects(TRUNCATED_MAP, required_key="drug")
+    assert [d["drug"] for d in drugs] == ["Sotorasib", "Metformin"]
+    assert drugs[1]["proteins"] == ["AMPK", "mTOR"]
+
+
+def test_drug_map_salvages_instead_of_a_repair_call(monkeypatch):
+    calls = []
+
+    def fake_query(system, user, **kwargs):
+        calls.append(kwargs)
+        return TRUNCATED_MAP
+
+    monkeypatch.setattr(review, "query_perplexity", fake_query)
+    data = review._extract_drug_protein_map("text", "lung cancer", ["KRAS"])
+
+    assert len(calls) == 1
+    assert calls[0]["response_format"]["type"] == "json_schema"
+    assert [d["drug"] for d in data["drugs"]] == ["Sotorasib", "Metformin"]
+    assert data["protein_targets"] == ["KRAS"]
+
+
+def test_drug_map_falls_back_to_repair_when_nothing_is_salvageable(monkeypatch):
+    replies = ["I could not find any drugs.", '{"drugs": [{"drug": "Aspirin", "proteins": []}]}']
+    monkeypatch.setattr(review, "query_perplexity", lambda system, user, **kw: replies.pop(0))
+    data = review._extract_drug_protein_map("text", "lung cancer", ["KRAS"])
+    assert not replies
+    assert data["drugs"] == [{"drug": "Aspirin", "proteins": []}]
+
+
+# ---------------------------------------------------------------------------
+# Local target extraction
+# ---------------------------------------------------------------------------
+
+FIRST_REVIEW = """# Pancreatic cancer
+
+## Introduction
+Pancreatic cancer is driven by KRAS mutations; p53 loss is common.
+
+## Key Protein Targets
+### KRAS
+K-Ras G12D is the dominant allele and KRAS remains the key target.
+### HER2
+ERBB2 (HER2/neu) amplification occurs in a subset; EML4-ALK fusions are rare.
+Downstream, ERK2 and p53 signalling matter.
+
+## References
+[1] KRAS, EGFR, EGFR, EGFR and BRAF in pancreatic cancer.
+"""
+
+
+def test_extracts_official_symbols_ranked_by_section():
+    ranked = dict(gene_symbols.rank_targets(FIRST_REVIEW))
+    # Aliases fold into the official symbol
+    assert ranked["ERBB2"] == 9.0 and ranked["TP53"] == 4.0
+    # The fusion counts once, for ALK; the reference list counts for nothing
+    assert ranked["ALK"] == 3.0 and ranked["EGFR"] == 0.0
+    assert review.extract_proteins_from_text(FIRST_REVIEW) == \
+        ["KRAS", "ERBB2", "TP53", "ALK", "MAPK1"]
+
+
+def test_matches_are_whole_words():
+    matcher = gene_symbols.get_matcher()
+    assert matcher.mentions("METHODS and ATMOSPHERE") == []
+    assert [m[2] for m in matcher.mentions("MET-amplified; anaplastic lymphoma kinase")] == \
+        ["MET", "ALK"]
+
+
+def test_variant_suffixes_count_for_the_gene():
+    text = "## Key Protein Targets\nEGFRvIII and EGFRvIII-positive glioma; PSMB5, CYP19A1."
+    assert review.extract_proteins_from_text(text) == ["EGFR", "PSMB5", "CYP19A1"]
+    ranked = dict(gene_symbols.rank_targets(text))
+    assert ranked["EGFR"] == 6.0 and ranked["PSMB5"] == 3.0 and ranked["CYP19A1"] == 3.0
+
+
+def test_unknown_gene_like_tokens_are_reported():
+    text = "KRAS G12C and V600E; ZNF711 and ZNF711 binding, EML4-ALK, PSMB5."
+    assert gene_symbols.unmatched_symbols(text) == [("ZNF711", 2)]
+
+
+def test_aho_corasick_finds_overlapping_patterns():
+    ac = gene_symbols.AhoCorasick({"he": "1", "she": "2", "hers": "3"})
+    assert sorted(ac.find("ushers")) == [(1, 4, "2"), (2, 4, "1"), (2, 6, "3")]
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Run Workspaces
+
+Every pipeline run writes its artifacts (state, review, agent2/agent3
+output, report, paper, poses, telemetry) into its own directory under
+runs/<run_id>/, so several cancer types can run side by side on one host.
+Caches that are safe to share between runs stay global: downloaded PDB
+structures (structures/) and the docking results database.
+
+The stand-alone CLIs (review, agent2, agent3, results, final) accept
+``--run-dir``; files left at their default names are then read from and
+written to that directory.
+
+Usage:
+    python workspace.py                 # list runs, newest first
+"""
+
+import argparse
+import os
+
+# ---------------------------------------------------------------------------
+# Configuration
+# ---------------------------------------------------------------------------
+
+RUNS_DIR = os.environ.get("PIPELINE_RUNS_DIR", "runs")
+SHARED_STRUCTURES_DIR = "structures"
+
+# Artifact names inside a run directory
+REVIEW_MD = "review.md"
+REVIEW_JSON = "review.json"
+AGENT2_OUTPUT = "agent2_output.json"
+AGENT3_OUTPUT = "agent3_output.json"
+RESULTS_MD = "results.md"
+FINAL_PAPER_MD = "final_paper.md"
+STATE_FILE = "pipeline_state.json"
+LLM_PROGRESS = "llm_progress.json"  # live status of streaming sections
+LLM_STREAM_DIR = "llm_stream"       # text of each section as it streams
+
+
+# ---------------------------------------------------------------------------
+# Run directories
+# ---------------------------------------------------------------------------
+
+def create_run_dir(run_id: str, runs_dir: str = RUNS_DIR) -> str:
+    """Create runs/<run_id>/ and return its path."""
+    path = os.path.join(runs_dir, run_id)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _has_state(path: str) -> bool:
+    base = os.path.splitext(STATE_FILE)[0]
+    return (os.path.exists(os.path.join(path, STATE_FILE))
+            or os.path.exists(os.path.join(path, base + ".events.jsonl")))
+
+
+def list_runs(runs_dir: str = RUNS_DIR) -> list[str]:
+    """Run directories that hold pipeline state, newest first."""
+    if not os.path.isdir(runs_dir):
+        return []
+    paths = [os.path.join(runs_dir, d) for d in os.listdir(runs_dir)]
+    paths = [p for p in paths if os.path.isdir(p) and _has_state(p)]
+    return sorted(paths, key=os.path.getmtime, reverse=True)
+
+
+def find_run_dir(run_id: str | None = None, runs_dir: str = RUNS_DIR) -> str | None:
+    """Locate a run to resume: the named run, else the most recent one,
+    else a pre-workspace state in the current directory."""
+    if run_id:
+        path = run_id if os.path.isdir(run_id) else os.path.join(runs_dir, run_id)
+        return path if _has_state(path) else None
+    runs = list_runs(runs_dir)
+    if runs:
+        return runs[0]
+    return "." if _has_state(".") else None
+
+
+def in_run_dir(run_dir: str | None, path: str, default: str) -> str:
+    """Place a CLI path inside run_dir (creating it) when the path was left
+    at its default."""
+    if run_dir and path == default:
+        os.makedirs(run_dir, exist_ok=True)
+        return os.path.join(run_dir, os.path.basename(default))
+    return path
+
+
+def add_run_dir_argument(parser: argparse.ArgumentParser):
+    """Add the shared ``--run-dir`` option to a CLI parser."""
+    parser.add_argument(
+        "--run-dir",
+        type=str,
+        default=None,
+        help="Run workspace directory; default-named inputs and outputs "
+             "are read from and written there.",
+    )
+
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="List pipeline run workspaces.")
+    parser.add_argument("--runs-dir", type=str, default=RUNS_DIR)
+    args = parser.parse_args()
+
+    for path in list_runs(args.runs_dir):
+        artifacts = [f for f in (REVIEW_MD, AGENT3_OUTPUT, RESULTS_MD, FINAL_PAPER_MD)
+                     if os.path.exists(os.path.join(path, f))]
+        print(f"  {os.path.basename(path):<50} {', '.join(artifacts)}")
+
+
+if __name__ == "__main__":
+    main()